@@ -19,7 +19,7 @@ setuptools.setup(
     install_requires=[
         "oyaml",
         "docker",
-        "pan-python",
+        "pan-python>=0.21.0,<0.27",
         "pathlib",
         "jinja2",
         "pyyaml",
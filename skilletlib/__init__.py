@@ -1,4 +1,35 @@
-from .panoply import EphemeralPanos  # noqa
-from .panoply import Panoply  # noqa
-from .panoply import Panos  # noqa
-from .skilletLoader import SkilletLoader  # noqa
+import importlib
+import sys
+
+# the public classes are imported on first use so importing skilletlib does not import the dependencies of every
+# skillet type, i.e. pan-python, lxml, and requests are only needed when working with PAN-OS devices
+_lazy_imports = {
+    'EphemeralPanos': '.panoply',
+    'Panoply': '.panoply',
+    'Panos': '.panoply',
+    'SkilletLoader': '.skilletLoader',
+}
+
+__all__ = list(_lazy_imports)
+
+
+def __getattr__(name):
+
+    if name in _lazy_imports:
+        value = getattr(importlib.import_module(_lazy_imports[name], __name__), name)
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_imports))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ requires python 3.7
+    from .panoply import EphemeralPanos  # noqa
+    from .panoply import Panoply  # noqa
+    from .panoply import Panos  # noqa
+    from .skilletLoader import SkilletLoader  # noqa
@@ -0,0 +1,400 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+"""
+A single file bundle of skillets for workers that start often and only use a few skillets.
+
+.. code-block:: python
+
+    # build step, i.e. in CI
+    sl = SkilletLoader('skillets')
+    sl.build_bundle('skillets.zip')
+
+    # worker
+    sl = SkilletLoader()
+    sl.load_from_bundle('skillets.zip')
+
+    # once the skillets are no longer needed
+    close_bundle('skillets.zip')
+
+The bundle is a zip file containing an index of the metadata of every skillet, the snippets of each skillet, the
+contents of every file read while creating the skillets, and the compiled code of every jinja2 template found in the
+snippets. Opening a bundle only reads the index, each skillet is read from the bundle the first time it is used.
+
+The compiled templates are only used by the same version of Python and jinja2 that built the bundle. As with the
+skillets themselves, only load bundles from a trusted source.
+
+Each bundle file is opened once and shared by every SkilletLoader that loads it, until the file changes or
+close_bundle is called.
+"""
+
+import copy
+import importlib.util
+import json
+import logging
+import marshal
+import os
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from types import CodeType
+from typing import Callable
+from typing import List
+from typing import Optional
+
+import jinja2
+
+from skilletlib.cache import use_file_source
+from skilletlib.exceptions import SkilletLoaderException
+from skilletlib.skillet.base import Skillet
+from skilletlib.snippet.base import register_template_code_provider
+from skilletlib.snippet.base import template_key
+from skilletlib.snippet.base import unregister_template_code_provider
+
+logger = logging.getLogger(__name__)
+
+# bump this when the layout of the bundle changes
+bundle_version = 1
+
+index_name = 'index.json'
+
+# open bundles keyed by the real path of the bundle file, see open_bundle
+_bundles = dict()
+_bundles_lock = threading.Lock()
+
+
+class SkilletBundle:
+    """
+    SkilletBundle provides read only access to a skillet bundle. It is also used as the file source for the skillets
+    it contains, serving their snippet files from below a virtual root that does not exist on disk.
+    """
+
+    def __init__(self, path: (str, Path)):
+        """
+        Open a skillet bundle and read the index
+
+        :param path: path to the bundle file
+        """
+        self.path = os.path.realpath(os.path.expanduser(str(path)))
+        self.closed = False
+
+        try:
+            st = os.stat(self.path)
+            self.stamp = (st.st_mtime_ns, st.st_size)
+            self._zip = zipfile.ZipFile(self.path)
+            index = json.loads(self._zip.read(index_name).decode('UTF-8'))
+
+        except (OSError, zipfile.BadZipFile, KeyError, ValueError) as e:
+            raise SkilletLoaderException(f'Could not open skillet bundle {path}: {e}')
+
+        if index.get('version', None) != bundle_version:
+            self._zip.close()
+            raise SkilletLoaderException(f'Unsupported skillet bundle version in {path}')
+
+        self.root = self.path + '.skillets'
+        self._files = set(index['files'])
+        self._lock = threading.Lock()
+
+        # skillet metadata without the snippets, with the snippet path below the virtual root
+        self.skillets = list()
+
+        for entry in index['skillets']:
+            metadata = entry['metadata']
+            metadata['snippet_path'] = os.path.join(self.root, *metadata['snippet_path'].split('/'))
+            self.skillets.append((metadata, entry['member']))
+
+        if index['template_tag'] == _template_tag():
+            self._templates = set(index['templates'])
+
+        else:
+            logger.info(f'Ignoring compiled templates in {path} built for {index["template_tag"]}')
+            self._templates = set()
+
+    def read_snippets(self, member: str) -> list:
+        """
+        Returns the snippets of a skillet
+
+        :param member: name of the bundle member holding the snippets of the skillet
+        :return: list of snippet definitions
+        """
+        return json.loads(self.__read(member).decode('UTF-8'))
+
+    def get_template_code(self, key: str) -> Optional[CodeType]:
+        """
+        Returns the compiled code of a template found in the bundle
+
+        :param key: sha256 of the template source
+        :return: code or None if the template is not found
+        """
+        if key not in self._templates:
+            return None
+
+        return marshal.loads(self.__read(f'templates/{key}'))
+
+    def contains(self, path: (str, Path)) -> bool:
+        """
+        Determine if the path is below the virtual root of this bundle
+
+        :param path: absolute path
+        :return: bool True if the path is within this bundle
+        """
+        return str(path).startswith(self.root + os.sep)
+
+    def exists(self, path: (str, Path)) -> bool:
+        """
+        Determine if a file exists in this bundle
+
+        :param path: absolute path below the virtual root
+        :return: bool True if the file exists
+        """
+        return self.__relative(path) in self._files
+
+    def read(self, path: (str, Path)) -> str:
+        """
+        Read the contents of a file in this bundle
+
+        :param path: absolute path below the virtual root
+        :return: contents of the file
+        """
+        relative = self.__relative(path)
+
+        if relative not in self._files:
+            raise FileNotFoundError(f'{path} not found in {self.path}')
+
+        return self.__read(f'files/{relative}').decode('UTF-8')
+
+    def close(self) -> None:
+        """
+        Close the bundle file and stop using the compiled templates it contains. Skillets that were not yet read from
+        the bundle can no longer be used.
+
+        :return: None
+        """
+        unregister_template_code_provider(self.path, self.get_template_code)
+
+        with self._lock:
+            self.closed = True
+            self._zip.close()
+
+    def __relative(self, path: (str, Path)) -> str:
+        relative = os.path.relpath(os.path.normpath(str(path)), self.root)
+        return relative.replace(os.sep, '/')
+
+    def __read(self, member: str) -> bytes:
+        with self._lock:
+
+            if self.closed:
+                raise SkilletLoaderException(f'Skillet bundle {self.path} is closed')
+
+            return self._zip.read(member)
+
+
+def open_bundle(path: (str, Path)) -> SkilletBundle:
+    """
+    Returns the open SkilletBundle for the given path, opening it if it is not already open or if the file has changed
+    since it was opened. The compiled templates of the bundle replace those of any bundle previously opened from the
+    same path. A replaced bundle stays open for any skillets still using it, and is closed once they are gone.
+
+    :param path: path to the bundle file
+    :return: SkilletBundle
+    """
+    real_path = os.path.realpath(os.path.expanduser(str(path)))
+
+    try:
+        st = os.stat(real_path)
+
+    except OSError as e:
+        raise SkilletLoaderException(f'Could not open skillet bundle {path}: {e}')
+
+    with _bundles_lock:
+        bundle = _bundles.get(real_path, None)
+
+        if bundle is not None and not bundle.closed and bundle.stamp == (st.st_mtime_ns, st.st_size):
+            return bundle
+
+        bundle = SkilletBundle(real_path)
+        _bundles[real_path] = bundle
+        register_template_code_provider(real_path, bundle.get_template_code)
+
+    return bundle
+
+
+def close_bundle(path: (str, Path)) -> None:
+    """
+    Close the bundle opened from the given path, if any. See SkilletBundle.close
+
+    :param path: path to the bundle file
+    :return: None
+    """
+    real_path = os.path.realpath(os.path.expanduser(str(path)))
+
+    with _bundles_lock:
+        bundle = _bundles.pop(real_path, None)
+
+    if bundle is not None:
+        bundle.close()
+
+
+class _RecordingSource:
+    """
+    File source that reads from the filesystem and keeps the contents of every file read
+    """
+
+    def __init__(self):
+        self.files = dict()
+
+    def contains(self, path: (str, Path)) -> bool:
+        return True
+
+    def exists(self, path: (str, Path)) -> bool:
+        return Path(path).exists()
+
+    def read(self, path: (str, Path)) -> str:
+
+        with open(str(path), 'r') as f:
+            contents = f.read()
+
+        self.files[os.path.realpath(str(path))] = contents
+        return contents
+
+
+def build_bundle(skillet_dicts: List[dict], destination: (str, Path),
+                 create_skillet: Callable[[dict], Skillet]) -> int:
+    """
+    Write a skillet bundle containing the given skillets. Each skillet is created while recording the files it reads,
+    and every string found in its snippets is compiled as a jinja2 template.
+
+    :param skillet_dicts: list of normalized skillet dicts, as loaded from the metadata files
+    :param destination: path of the bundle file to write
+    :param create_skillet: function used to create each skillet, i.e. SkilletLoader.create_skillet
+    :return: number of skillets written to the bundle
+    """
+    entries = list()
+    files = dict()
+    templates = dict()
+
+    for skillet_dict in skillet_dicts:
+        skillet_dict = copy.deepcopy(skillet_dict)
+        source = _RecordingSource()
+
+        with use_file_source(source):
+            created = create_skillet(copy.deepcopy(skillet_dict))
+
+            for snippet in created.get_snippets():
+                template_strs = list(_find_strings(snippet.metadata))
+
+                if isinstance(getattr(snippet, 'template_str', None), str):
+                    template_strs.append(snippet.template_str)
+
+                for template_str in template_strs:
+                    _compile_template(snippet, template_str, templates)
+
+        entries.append(skillet_dict)
+        files.update(source.files)
+
+    # all paths are stored relative to the deepest dir containing every skillet and file
+    for skillet_dict in entries:
+        skillet_dict['snippet_path'] = os.path.realpath(skillet_dict.get('snippet_path', '') or os.getcwd())
+
+    paths = [e['snippet_path'] for e in entries] + list(files)
+    base = os.path.commonpath(paths) if paths else os.getcwd()
+
+    if any(p == base for p in files):
+        base = os.path.dirname(base)
+
+    destination = os.path.abspath(os.path.expanduser(str(destination)))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.tmp')
+    os.close(fd)
+
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            index = {
+                'version': bundle_version,
+                'template_tag': _template_tag(),
+                'skillets': list(),
+                'files': sorted(_relative(p, base) for p in files),
+                'templates': sorted(templates),
+            }
+
+            for i, skillet_dict in enumerate(entries):
+                member = f'skillets/{i}.json'
+                metadata = {k: v for k, v in skillet_dict.items() if k != 'snippets'}
+                metadata['snippet_path'] = _relative(metadata['snippet_path'], base)
+
+                zf.writestr(member, json.dumps(skillet_dict.get('snippets', list()), default=str))
+                index['skillets'].append({'metadata': metadata, 'member': member})
+
+            for path, contents in files.items():
+                zf.writestr(f'files/{_relative(path, base)}', contents)
+
+            for key, code in templates.items():
+                zf.writestr(f'templates/{key}', marshal.dumps(code))
+
+            zf.writestr(index_name, json.dumps(index, default=str))
+
+        os.replace(tmp_path, destination)
+
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    logger.debug(f'Wrote {len(entries)} skillets, {len(files)} files, and {len(templates)} templates to {destination}')
+    return len(entries)
+
+
+def _find_strings(value) -> list:
+    """
+    Returns every string found in a snippet definition
+    """
+    if isinstance(value, str):
+        return [value]
+
+    if isinstance(value, dict):
+        return [s for k, v in value.items() for s in _find_strings(k) + _find_strings(v)]
+
+    if isinstance(value, (list, tuple)):
+        return [s for v in value for s in _find_strings(v)]
+
+    return list()
+
+
+def _compile_template(snippet, template_str: str, templates: dict) -> None:
+    """
+    Compile a template using the environment of the snippet, strings that are not valid templates are skipped
+    """
+    key = template_key(template_str)
+
+    if key in templates:
+        return
+
+    try:
+        templates[key] = snippet._env.compile(template_str)
+
+    except jinja2.TemplateError:
+        # not every string in a snippet is a template
+        pass
+
+
+def _relative(path: str, base: str) -> str:
+    return os.path.relpath(path, base).replace(os.sep, '/')
+
+
+def _template_tag() -> str:
+    """
+    Compiled templates may only be used by the same version of python and jinja2
+    """
+    return f'{importlib.util.MAGIC_NUMBER.hex()}-jinja2-{getattr(jinja2, "__version__", "")}'
@@ -0,0 +1,370 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+"""
+A persistent cache of parsed skillet metadata and snippet file contents.
+
+.. code-block:: python
+
+    sl = SkilletLoader('skillets', cache_dir='~/.pan_cnc/skilletlib/cache')
+
+The first load parses every metadata file as usual and stores the normalized skillet dict, along with the contents of
+any snippet files read while creating the skillets. Later loads only stat each file, and use the stored values for any
+file whose modification time and size are unchanged. If only the modification time differs, i.e. after a fresh git
+checkout, the contents are hashed and compared before the stored values are discarded.
+
+Skillet dicts are stored as JSON, so the cache database never contains anything that is executed when read. Skillet
+dicts that JSON cannot represent exactly, i.e. with dates or non str keys parsed from the YAML, are not cached.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# name of the cache database created in the cache dir
+cache_file_name = 'skilletlib-cache.db'
+
+# bump this when the structure of the normalized skillet dict changes so old entries are ignored
+cache_version = 2
+
+_local = threading.local()
+
+
+class MetadataCache:
+    """
+    MetadataCache stores values derived from files on disk in a single SQLite database, keyed by the absolute path of
+    the file and validated using the modification time, size, and sha256 hash of the file.
+    """
+
+    def __init__(self, cache_dir: (str, Path)):
+        """
+        Initialize a new MetadataCache, creating the cache database if necessary
+
+        :param cache_dir: directory in which to store the cache database
+        """
+        cache_path = Path(cache_dir).expanduser()
+        cache_path.mkdir(parents=True, exist_ok=True)
+
+        self.path = cache_path.joinpath(cache_file_name)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS entries (kind TEXT, path TEXT, version INTEGER, '
+                                 'mtime_ns INTEGER, size INTEGER, sha256 TEXT, value BLOB, PRIMARY KEY (kind, path))')
+        self._connection.commit()
+
+    def get_skillet(self, meta_cnc_file: (str, Path)) -> Optional[dict]:
+        """
+        Returns the stored skillet dict for the given metadata file if the file has not changed
+
+        :param meta_cnc_file: path to the .meta-cnc.yaml file
+        :return: normalized skillet dict or None
+        """
+        value = self.__get('skillet', meta_cnc_file)
+
+        if value is None:
+            return None
+
+        try:
+            return _loads(value)
+
+        except ValueError as ve:
+            logger.debug(f'Ignoring unreadable cache entry for {meta_cnc_file}: {ve}')
+            return None
+
+    def put_skillet(self, meta_cnc_file: (str, Path), skillet_dict: dict) -> None:
+        """
+        Store the normalized skillet dict for the given metadata file
+
+        :param meta_cnc_file: path to the .meta-cnc.yaml file
+        :param skillet_dict: normalized skillet dict
+        :return: None
+        """
+        value = _dumps(skillet_dict)
+
+        if value is None:
+            logger.debug(f'Not caching {meta_cnc_file} as it cannot be stored as JSON')
+            return
+
+        self.__put('skillet', meta_cnc_file, value)
+
+    def get_blob_skillet(self, blob_sha: str) -> Optional[dict]:
+        """
+        Returns the stored skillet dict for the metadata file with the given git blob id. Blobs never change, so no
+        validation is required.
+
+        :param blob_sha: git object id of the .meta-cnc.yaml file contents
+        :return: normalized skillet dict or None
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT version, value FROM entries WHERE kind = ? AND path = ?',
+                                           ('skillet-blob', blob_sha)).fetchone()
+
+        if row is None or row[0] != cache_version:
+            self.misses += 1
+            return None
+
+        try:
+            value = _loads(row[1])
+
+        except ValueError as ve:
+            logger.debug(f'Ignoring unreadable cache entry for blob {blob_sha}: {ve}')
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value
+
+    def put_blob_skillet(self, blob_sha: str, skillet_dict: dict) -> None:
+        """
+        Store the normalized skillet dict for the metadata file with the given git blob id
+
+        :param blob_sha: git object id of the .meta-cnc.yaml file contents
+        :param skillet_dict: normalized skillet dict
+        :return: None
+        """
+        value = _dumps(skillet_dict)
+
+        if value is None:
+            logger.debug(f'Not caching blob {blob_sha} as it cannot be stored as JSON')
+            return
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     ('skillet-blob', blob_sha, cache_version, 0, 0, blob_sha, value))
+
+    def read_file(self, path: (str, Path)) -> str:
+        """
+        Returns the contents of the given file, from the cache if the file has not changed
+
+        :param path: path to the file
+        :return: contents of the file
+        """
+        value = self.__get('file', path)
+
+        if value is None:
+
+            with open(str(path), 'rb') as f:
+                value = f.read()
+
+            self.__put('file', path, value, value)
+
+        # the same newline handling as reading the file in text mode
+        return value.decode('UTF-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    def commit(self) -> None:
+        """
+        Write all new entries to disk
+
+        :return: None
+        """
+        with self._lock:
+            self._connection.commit()
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache
+
+        :return: None
+        """
+        with self._lock:
+            self._connection.execute('DELETE FROM entries')
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Commit any pending entries and close the cache database
+
+        :return: None
+        """
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    @contextmanager
+    def activate(self) -> Generator['MetadataCache', None, None]:
+        """
+        Use this cache for all snippet files read via read_file in the current thread
+
+        :return: this MetadataCache
+        """
+        previous = getattr(_local, 'cache', None)
+        _local.cache = self
+
+        try:
+            yield self
+
+        finally:
+            _local.cache = previous
+            self.commit()
+
+    def __get(self, kind: str, path: (str, Path)) -> Optional[bytes]:
+        """
+        Returns the stored value for the given file if it is still valid
+        """
+        path = str(Path(path).absolute())
+
+        try:
+            st = os.stat(path)
+
+        except OSError:
+            return None
+
+        with self._lock:
+            row = self._connection.execute('SELECT version, mtime_ns, size, sha256, value FROM entries '
+                                           'WHERE kind = ? AND path = ?', (kind, path)).fetchone()
+
+            if row is None or row[0] != cache_version or row[2] != st.st_size:
+                self.misses += 1
+                return None
+
+            if row[1] != st.st_mtime_ns:
+
+                # the file may have been touched without being modified, i.e. by a git checkout
+                if _sha256_file(path) != row[3]:
+                    self.misses += 1
+                    return None
+
+                self._connection.execute('UPDATE entries SET mtime_ns = ? WHERE kind = ? AND path = ?',
+                                         (st.st_mtime_ns, kind, path))
+
+            self.hits += 1
+            return row[4]
+
+    def __put(self, kind: str, path: (str, Path), value: bytes, contents: Optional[bytes] = None) -> None:
+        """
+        Store a value for the given file along with the current modification time, size, and hash of the file
+        """
+        path = str(Path(path).absolute())
+
+        try:
+            st = os.stat(path)
+            sha256 = hashlib.sha256(contents).hexdigest() if contents is not None else _sha256_file(path)
+
+        except OSError:
+            return
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     (kind, path, cache_version, st.st_mtime_ns, st.st_size, sha256, value))
+
+
+def read_file(path: (str, Path)) -> str:
+    """
+    Read the contents of a snippet file, from the file source activated in the current thread if there is one, or
+    using the cache activated in the current thread if there is one
+
+    :param path: path to the file
+    :return: contents of the file
+    """
+    source = getattr(_local, 'source', None)
+
+    if source is not None and source.contains(path):
+        return source.read(path)
+
+    cache = getattr(_local, 'cache', None)
+
+    if cache is not None:
+        return cache.read_file(path)
+
+    with open(str(path), 'r') as f:
+        return f.read()
+
+
+def file_exists(path: (str, Path)) -> bool:
+    """
+    Determine if a snippet file exists, in the file source activated in the current thread if there is one
+
+    :param path: path to the file
+    :return: bool True if the file exists
+    """
+    source = getattr(_local, 'source', None)
+
+    if source is not None and source.contains(path):
+        return source.exists(path)
+
+    return Path(path).exists()
+
+
+@contextmanager
+def use_file_source(source) -> Generator:
+    """
+    Read snippet files below the root of the given source from the source instead of the filesystem in the current
+    thread. The source must provide 'contains', 'exists', and 'read' methods, i.e. remotes.git.GitTree
+
+    :param source: file source
+    :return: the file source
+    """
+    previous = getattr(_local, 'source', None)
+    _local.source = source
+
+    try:
+        yield source
+
+    finally:
+        _local.source = previous
+
+
+def _dumps(skillet_dict: dict) -> Optional[bytes]:
+    """
+    Serialize a skillet dict as JSON, or None if it would not be loaded back exactly as given
+    """
+    try:
+        value = json.dumps(skillet_dict)
+
+    except (TypeError, ValueError):
+        return None
+
+    if json.loads(value) != skillet_dict:
+        return None
+
+    return value.encode('UTF-8')
+
+
+def _loads(value: bytes) -> dict:
+    """
+    Load a skillet dict stored with _dumps
+
+    :raises ValueError: if the value is not a JSON object
+    """
+    skillet_dict = json.loads(value.decode('UTF-8'))
+
+    if not isinstance(skillet_dict, dict):
+        raise ValueError('not a skillet dict')
+
+    return skillet_dict
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+
+    return h.hexdigest()
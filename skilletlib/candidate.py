@@ -0,0 +1,525 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+import logging
+import mmap
+import re
+from copy import deepcopy
+from typing import List
+from typing import Optional
+
+from lxml import etree
+
+from .exceptions import PanoplyException
+
+logger = logging.getLogger(__name__)
+
+# a single xpath step that may be created if missing, i.e. 'address' or "entry[@name='web-server']"
+_step_re = re.compile(r"""^([\w\-.:]+)(?:\[@name=(['"])(.*?)\2\])?$""")
+
+
+class CandidateConfig:
+    """
+    CandidateConfig applies PAN-OS configuration commands to an in-memory configuration document. This allows
+    'set', 'edit', 'delete', etc snippets to be executed offline and the resulting candidate configuration to be
+    inspected or validated without a device.
+
+    The semantics follow those of the PAN-OS XML API:
+
+    * set - the element is merged into the node found at the xpath. Missing nodes along the xpath are created.
+      Entries are matched by name, members by value, and leaf values are replaced
+    * edit / override - the node found at the xpath is replaced with the element
+    * delete - all nodes found at the xpath are removed
+    * move - the entry found at the xpath is moved to the top, bottom, or before / after the dst entry
+    * rename - the entry found at the xpath is given a new name
+    * clone - the entry found at xpath_from is copied with a new name into the node found at the xpath
+
+    The configuration is only parsed once it is first required, and the serialized document is cached until the
+    next change.
+    """
+
+    def __init__(self, config: (str, bytes)):
+        """
+        Initialize a new CandidateConfig
+
+        :param config: configuration document as a str or bytes
+        """
+        self._xml = config.decode('UTF-8') if isinstance(config, bytes) else str(config)
+        self._root = None
+        self._path = None
+        self.changed = False
+
+    @classmethod
+    def from_file(cls, path: str) -> 'CandidateConfig':
+        """
+        Create a CandidateConfig from a configuration file. The file is parsed directly from disk the first time the
+        document is required, without first reading it into a str.
+
+        :param path: path to the configuration file
+        :return: CandidateConfig
+        """
+        c = cls('')
+        c._xml = None
+        c._path = str(path)
+        return c
+
+    @property
+    def root(self) -> etree.Element:
+        """
+        Returns the root element of the configuration document, parsing it if necessary
+
+        :return: root Element
+        """
+        if self._root is None:
+
+            try:
+                parser = etree.XMLParser(remove_blank_text=True, huge_tree=True)
+
+                if self._xml is None:
+                    self._root = etree.parse(self._path, parser).getroot()
+
+                else:
+                    self._root = etree.fromstring(self._xml.encode('UTF-8'), parser)
+
+            except (etree.XMLSyntaxError, OSError) as xse:
+                raise PanoplyException(f'Could not parse configuration: {xse}')
+
+        return self._root
+
+    def to_xml(self, pretty_print: bool = False) -> str:
+        """
+        Returns the current candidate configuration
+
+        :param pretty_print: return an indented document
+        :return: configuration as an XML encoded str
+        """
+        if pretty_print:
+            return etree.tostring(self.root, pretty_print=True).decode('UTF-8')
+
+        if self._xml is None:
+
+            if self._path is not None and not self.changed:
+                # unchanged, so use the file contents as is
+                self._xml = read_config_file(self._path)
+
+            else:
+                self._xml = etree.tostring(self.root).decode('UTF-8')
+
+        return self._xml
+
+    def __str__(self):
+        return self.to_xml()
+
+    def copy(self) -> 'CandidateConfig':
+        """
+        Returns an independent copy of this candidate configuration
+
+        :return: CandidateConfig
+        """
+        c = CandidateConfig(self.to_xml())
+        c.changed = self.changed
+        return c
+
+    def apply(self, cmd: str, params: dict) -> str:
+        """
+        Apply the given cmd using the same parameters as Panoply.execute_cmd
+
+        :param cmd: Valid options are: 'show', 'get', 'delete', 'set', 'edit', 'override', 'move', 'rename', 'clone'
+        :param params: valid parameters for the given cmd type
+        :return: the xml found at the xpath for 'show' or 'get' cmds, otherwise an empty str
+        """
+        try:
+            xpath = ''.join(params['xpath'].strip().split('\n'))
+
+            if cmd in ('show', 'get'):
+                return self.show(xpath)
+
+            if cmd == 'set':
+                self.set(xpath, params['element'].strip())
+
+            elif cmd in ('edit', 'override'):
+                self.edit(xpath, params['element'].strip())
+
+            elif cmd == 'delete':
+                self.delete(xpath)
+
+            elif cmd == 'move':
+                self.move(xpath, params['where'], params.get('dst', None))
+
+            elif cmd == 'rename':
+                self.rename(xpath, params.get('new_name', params.get('newname', None)))
+
+            elif cmd == 'clone':
+                self.clone(xpath, params['xpath_from'], params.get('new_name', params.get('newname', None)))
+
+            else:
+                raise PanoplyException(f'Cannot apply cmd {cmd} to an offline configuration')
+
+        except KeyError as ke:
+            raise PanoplyException(f'Invalid parameters passed to apply: {ke}')
+
+        return ''
+
+    def show(self, xpath: str) -> str:
+        """
+        Returns the xml found at the given xpath
+
+        :param xpath: xpath to find
+        :return: xml str of all matching nodes
+        """
+        return ''.join(etree.tostring(n).decode('UTF-8') for n in self.find(xpath))
+
+    def find(self, xpath: str) -> List[etree.Element]:
+        """
+        Returns all the nodes found at the given xpath
+
+        :param xpath: xpath to find
+        :return: list of Elements
+        """
+        xpath = xpath.strip()
+
+        if xpath in ('', '/config', '.'):
+            return [self.root]
+
+        try:
+            found = self.root.xpath(xpath, smart_strings=False)
+
+        except etree.XPathError:
+            raise PanoplyException(f'Invalid xpath: {xpath}')
+
+        if not isinstance(found, list):
+            return list()
+
+        return [n for n in found if isinstance(n, etree._Element)]
+
+    def set(self, xpath: str, element: str) -> None:
+        """
+        Merge the element into the node found at the xpath, creating any missing nodes
+
+        :param xpath: xpath of the parent node
+        :param element: one or more elements to merge into the parent node
+        :return: None
+        """
+        target = self.__ensure_path(xpath)
+
+        for child in self.__parse_element(element):
+            self.__merge(target, child)
+
+        self.__changed()
+
+    def edit(self, xpath: str, element: str) -> None:
+        """
+        Replace the node found at the xpath with the element. The node is created if it does not already exist
+
+        :param xpath: xpath of the node to replace
+        :param element: a single element to replace the node with
+        :return: None
+        """
+        new_elements = self.__parse_element(element)
+
+        if len(new_elements) != 1:
+            raise PanoplyException(f'edit requires a single element for xpath: {xpath}')
+
+        new_element = new_elements[0]
+        nodes = self.find(xpath)
+
+        if nodes:
+            node = nodes[0]
+            parent = node.getparent()
+
+            if parent is None:
+                # replacing the entire configuration
+                self._root = new_element
+
+            else:
+                parent.replace(node, new_element)
+
+        else:
+            parent_xpath, _ = _split_last_step(xpath)
+            self.__ensure_path(parent_xpath).append(new_element)
+
+        self.__changed()
+
+    def delete(self, xpath: str) -> None:
+        """
+        Remove all nodes found at the xpath. It is not an error if nothing is found
+
+        :param xpath: xpath of the nodes to remove
+        :return: None
+        """
+        for node in self.find(xpath):
+            parent = node.getparent()
+
+            if parent is not None:
+                parent.remove(node)
+
+        self.__changed()
+
+    def move(self, xpath: str, where: str, dst: Optional[str] = None) -> None:
+        """
+        Move the entry found at the xpath within its parent
+
+        :param xpath: xpath of the entry to move
+        :param where: one of 'top', 'bottom', 'before', or 'after'
+        :param dst: name of the sibling entry when where is 'before' or 'after'
+        :return: None
+        """
+        node = self.__find_one(xpath)
+        parent = node.getparent()
+
+        if where == 'top':
+            parent.remove(node)
+            parent.insert(0, node)
+
+        elif where == 'bottom':
+            parent.remove(node)
+            parent.append(node)
+
+        elif where in ('before', 'after'):
+            sibling = next((c for c in parent.iterchildren(node.tag) if c.get('name') == dst), None)
+
+            if sibling is None or sibling is node:
+                raise PanoplyException(f'Could not find dst {dst} to move {where}')
+
+            parent.remove(node)
+
+            if where == 'before':
+                sibling.addprevious(node)
+
+            else:
+                sibling.addnext(node)
+
+        else:
+            raise PanoplyException(f'Invalid where for move: {where}')
+
+        self.__changed()
+
+    def rename(self, xpath: str, new_name: str) -> None:
+        """
+        Rename the entry found at the xpath
+
+        :param xpath: xpath of the entry to rename
+        :param new_name: new name of the entry
+        :return: None
+        """
+        if not new_name:
+            raise PanoplyException('new_name is required for rename')
+
+        node = self.__find_one(xpath)
+        parent = node.getparent()
+
+        if any(c.get('name') == new_name for c in parent.iterchildren(node.tag)):
+            raise PanoplyException(f'{new_name} already exists')
+
+        node.set('name', new_name)
+        self.__changed()
+
+    def clone(self, xpath: str, xpath_from: str, new_name: str) -> None:
+        """
+        Copy the entry found at xpath_from into the node found at the xpath using a new name
+
+        :param xpath: xpath of the parent node to copy the entry into
+        :param xpath_from: xpath of the entry to copy
+        :param new_name: name of the new entry
+        :return: None
+        """
+        if not new_name:
+            raise PanoplyException('new_name is required for clone')
+
+        source = self.__find_one(xpath_from)
+        parent = self.__find_one(xpath)
+
+        if any(c.get('name') == new_name for c in parent.iterchildren(source.tag)):
+            raise PanoplyException(f'{new_name} already exists')
+
+        cloned = deepcopy(source)
+        cloned.set('name', new_name)
+        parent.append(cloned)
+
+        self.__changed()
+
+    def __changed(self) -> None:
+        # invalidate the serialized document
+        self._xml = None
+        self.changed = True
+
+    def __find_one(self, xpath: str) -> etree.Element:
+        nodes = self.find(xpath)
+
+        if not nodes:
+            raise PanoplyException(f'No such node: {xpath}')
+
+        return nodes[0]
+
+    @staticmethod
+    def __parse_element(element: str) -> List[etree.Element]:
+        try:
+            parser = etree.XMLParser(remove_blank_text=True)
+            wrapper = etree.fromstring(f'<root>{element}</root>'.encode('UTF-8'), parser)
+
+        except etree.XMLSyntaxError as xse:
+            raise PanoplyException(f'Could not parse element: {xse}')
+
+        return list(wrapper)
+
+    def __ensure_path(self, xpath: str) -> etree.Element:
+        """
+        Find the node at the given xpath, creating any missing nodes along the way
+        """
+        nodes = self.find(xpath)
+
+        if nodes:
+            return nodes[0]
+
+        steps = _split_steps(xpath)
+
+        if steps and steps[0] == '.':
+            steps = steps[1:]
+
+        elif steps and xpath.strip().startswith('/') and steps[0] == self.root.tag:
+            steps = steps[1:]
+
+        node = self.root
+
+        for step in steps:
+            match = _step_re.match(step)
+
+            if not match:
+                raise PanoplyException(f'Could not create missing node for xpath: {xpath}')
+
+            tag, _, name = match.groups()
+
+            if name is not None:
+                child = next((c for c in node.iterchildren(tag) if c.get('name') == name), None)
+
+            else:
+                child = node.find(tag)
+
+            if child is None:
+                child = etree.SubElement(node, tag)
+
+                if name is not None:
+                    child.set('name', name)
+
+            node = child
+
+        return node
+
+    def __merge(self, target: etree.Element, element: etree.Element) -> None:
+        """
+        Merge the element into the children of the target. Entries are matched by name, members by text, and all
+        other elements by tag
+        """
+        name = element.get('name', None)
+
+        if name is not None:
+            existing = next((c for c in target.iterchildren(element.tag) if c.get('name') == name), None)
+
+        elif element.tag == 'member':
+            existing = next((c for c in target.iterchildren('member') if c.text == element.text), None)
+
+        else:
+            existing = target.find(element.tag)
+
+        if existing is None:
+            target.append(element)
+            return
+
+        for attr, value in element.attrib.items():
+            existing.set(attr, value)
+
+        if len(element) == 0:
+            # leaf values replace existing values, but an empty element does not remove existing children
+            if len(existing) == 0 or (element.text and element.text.strip()):
+                existing.text = element.text
+
+            return
+
+        for child in list(element):
+            self.__merge(existing, child)
+
+
+def read_config_file(path: str) -> str:
+    """
+    Read a configuration file into a str. The file is memory-mapped and decoded directly, which avoids holding an
+    additional bytes copy of large configurations in memory.
+
+    :param path: path to the configuration file
+    :return: contents of the file
+    """
+    with open(path, 'rb') as f:
+
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return str(m, 'UTF-8')
+
+        except ValueError:
+            # empty files cannot be mapped
+            return ''
+
+
+def _split_steps(xpath: str) -> List[str]:
+    """
+    Split an xpath into its steps, ignoring any '/' found inside of predicates
+    """
+    steps = list()
+    current = ''
+    depth = 0
+    quote = None
+
+    for c in xpath.strip():
+
+        if quote is not None:
+
+            if c == quote:
+                quote = None
+
+        elif c in ('"', "'"):
+            quote = c
+
+        elif c == '[':
+            depth += 1
+
+        elif c == ']':
+            depth -= 1
+
+        elif c == '/' and depth == 0:
+
+            if current:
+                steps.append(current)
+
+            current = ''
+            continue
+
+        current += c
+
+    if current:
+        steps.append(current)
+
+    return steps
+
+
+def _split_last_step(xpath: str) -> (str, str):
+    """
+    Split an xpath into the xpath of the parent and the last step
+    """
+    steps = _split_steps(xpath)
+
+    if not steps:
+        return xpath, ''
+
+    prefix = '/' if xpath.strip().startswith('/') and steps[0] != '.' else ''
+    return prefix + '/'.join(steps[:-1]), steps[-1]
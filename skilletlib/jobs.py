@@ -0,0 +1,483 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from pan.xapi import PanXapiError
+
+from skilletlib.exceptions import PanoplyException
+from skilletlib.panoply import Panoply
+
+logger = logging.getLogger(__name__)
+
+# all dynamic content types that may be updated with update_dynamic_content
+dynamic_content_types = ('content', 'anti-virus', 'wildfire')
+
+
+class TrackedJob:
+    """
+    A single job on a single device that is being tracked by a JobTracker
+    """
+
+    def __init__(self, panoply: Panoply, job_id: str, description: str, timeout: int, interval: float):
+        self.panoply = panoply
+        self.job_id = str(job_id)
+        self.description = description
+        self.device = panoply.serial_number or panoply.hostname
+        self.started = time.time()
+        self.timeout_mark = self.started + timeout
+        self.interval = interval
+        self.next_poll = self.started + interval
+        self.future = Future()
+
+        self.status = ''
+        self.result = ''
+        self.progress = ''
+        self.details = ''
+        self.last_error = ''
+        self.errors = 0
+
+    def to_dict(self) -> dict:
+        """
+        Returns the current state of this job
+
+        :return: dict containing the device, job_id, description, status, result, progress, details, success,
+        and elapsed keys
+        """
+        return {
+            'device': self.device,
+            'job_id': self.job_id,
+            'description': self.description,
+            'status': self.status,
+            'result': self.result,
+            'progress': self.progress,
+            'details': self.details or self.last_error,
+            'success': self.status == 'FIN' and self.result == 'OK',
+            'elapsed': round(time.time() - self.started, 2)
+        }
+
+
+class JobTracker:
+    """
+    JobTracker tracks many jobs across many devices in a single polling loop. This is useful when waiting for commits,
+    commit-all, or content updates on a fleet of devices, as all the jobs progress together and the overall wait
+    ends as soon as the slowest job finishes.
+
+    Each job is polled using an adaptive interval. Jobs are checked frequently at first, then less often the longer
+    they run without making progress, up to max_interval.
+
+    .. code-block:: python
+
+        tracker = JobTracker(progress_callback=print)
+        tracker.add_job(panorama, commit_job_id, 'commit')
+        tracker.add_job(firewall, content_job_id, 'content install')
+        results = tracker.wait()
+
+    """
+
+    def __init__(self, min_interval: float = 2, max_interval: float = 30, backoff: float = 1.5, timeout: int = 600,
+                 max_errors: int = 10, progress_callback: Optional[Callable[[dict], None]] = None):
+        """
+        Initialize a new JobTracker
+
+        :param min_interval: initial time in seconds between status checks of each job
+        :param max_interval: maximum time in seconds between status checks of each job
+        :param backoff: multiplier applied to a job's interval each time it is checked without making progress
+        :param timeout: how long to wait for each job before it is considered failed
+        :param max_errors: number of consecutive failed status checks before a job is considered failed
+        :param progress_callback: optional function called with the job dict each time a job status changes
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_errors = max_errors
+        self.progress_callback = progress_callback
+
+        self.jobs = list()
+        self.future = Future()
+
+        self._pending = list()
+        self._connections = dict()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add_job(self, panoply: Panoply, job_id: str, description: str = '') -> Future:
+        """
+        Begin tracking the given job. Jobs may be added before or after the tracker has been started, as long as the
+        tracker has not already completed.
+
+        :param panoply: Panoply instance for the device the job is running on
+        :param job_id: id of the job to track
+        :param description: optional description of the job, used in logging and progress reporting
+        :return: Future that will be resolved with the job dict once the job completes
+        """
+
+        with self._condition:
+
+            if self.future.done():
+                raise PanoplyException('Cannot add a job to a JobTracker that has already completed')
+
+            job = TrackedJob(panoply, job_id, description, self.timeout, self.min_interval)
+            self.jobs.append(job)
+            self._pending.append(job)
+            self._condition.notify()
+
+        logger.debug(f'Tracking job {job.job_id} on {job.device}')
+
+        return job.future
+
+    def start(self) -> Future:
+        """
+        Start polling all tracked jobs in a background thread
+
+        :return: Future that will be resolved once all tracked jobs have completed. The result is a dict keyed by
+        (device, job_id) tuples with the job dict as the value
+        """
+
+        with self._condition:
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.__poll_loop, name='skilletlib-job-tracker', daemon=True)
+                self._thread.start()
+
+        return self.future
+
+    def wait(self, timeout: Optional[float] = None) -> Dict[Tuple[str, str], dict]:
+        """
+        Start polling if necessary and block until all tracked jobs have completed
+
+        :param timeout: optional maximum time in seconds to wait
+        :return: dict keyed by (device, job_id) tuples with the job dict as the value
+        """
+        return self.start().result(timeout=timeout)
+
+    def __poll_loop(self) -> None:
+
+        while True:
+
+            with self._condition:
+
+                if not self._pending:
+                    results = dict()
+
+                    for job in self.jobs:
+                        results[(job.device, job.job_id)] = job.to_dict()
+
+                    self.future.set_result(results)
+                    return
+
+                now = time.time()
+                due = [job for job in self._pending if job.next_poll <= now]
+
+                if not due:
+                    next_poll = min(job.next_poll for job in self._pending)
+                    self._condition.wait(timeout=max(next_poll - now, 0))
+                    continue
+
+            for job in due:
+                self.__poll_job(job)
+
+    def __poll_job(self, job: TrackedJob) -> None:
+        """
+        Check the status of a single job and schedule the next check
+
+        :param job: the job to check
+        :return: None
+        """
+        previous = (job.status, job.progress)
+
+        try:
+            status = job.panoply.get_job_status(job.job_id, self.__get_connection(job.panoply))
+            job.status = status['status']
+            job.result = status['result']
+            job.progress = status['progress']
+            job.details = status['details']
+            job.last_error = ''
+            job.errors = 0
+
+        except (PanoplyException, PanXapiError) as pe:
+            # the device may be temporarily unavailable, for example during a content install
+            logger.debug(f'Could not check job {job.job_id} on {job.device}: {pe}')
+            job.last_error = str(pe)
+            job.errors += 1
+
+        now = time.time()
+
+        if job.status == 'FIN':
+            self.__complete(job)
+            return
+
+        if job.errors >= self.max_errors:
+            # the device is unreachable or the credentials are no longer valid, there is no point in waiting any longer
+            logger.error(f'Could not check job {job.job_id} on {job.device} after {job.errors} attempts: '
+                         f'{job.last_error}')
+            job.status = job.status or 'ERROR'
+            job.result = 'ERROR'
+            self.__complete(job)
+            return
+
+        if now > job.timeout_mark:
+            logger.error(f'Timed out waiting for job {job.job_id} on {job.device}')
+            job.status = job.status or 'TIMEOUT'
+            job.result = 'TIMEOUT'
+            self.__complete(job)
+            return
+
+        if (job.status, job.progress) != previous:
+            self.__notify(job)
+            job.interval = self.min_interval
+
+        else:
+            job.interval = min(job.interval * self.backoff, self.max_interval)
+
+        job.next_poll = now + job.interval
+
+    def __complete(self, job: TrackedJob) -> None:
+
+        with self._condition:
+            self._pending.remove(job)
+
+        job_dict = job.to_dict()
+        logger.debug(f'Job {job.job_id} on {job.device} completed with result: {job.result}')
+        self.__notify(job)
+        job.future.set_result(job_dict)
+
+    def __notify(self, job: TrackedJob) -> None:
+
+        if self.progress_callback is None:
+            return
+
+        try:
+            self.progress_callback(job.to_dict())
+
+        except Exception as e:
+            logger.error(f'Exception caught in job progress callback: {e}')
+
+    def __get_connection(self, panoply: Panoply):
+        """
+        Each device gets its own connection for polling, so the tracker can run alongside other work on the same
+        Panoply instance
+
+        :param panoply: Panoply instance
+        :return: PanXapi instance to use for polling
+        """
+        key = id(panoply)
+
+        if key not in self._connections:
+
+            try:
+                self._connections[key] = panoply.clone_xapi()
+
+            except PanoplyException:
+                self._connections[key] = panoply.xapi
+
+        return self._connections[key]
+
+
+class ContentUpdate:
+    """
+    Pipelines the dynamic content updates of a single device. Downloads of all content types run at the same time,
+    and each content type is installed as soon as its download completes. PAN-OS only allows one content install at a
+    time, so installs are queued and run one after the other.
+    """
+
+    def __init__(self, panoply: Panoply, tracker: JobTracker, content_types: Iterable[str]):
+        self.panoply = panoply
+        self.tracker = tracker
+        self.device = panoply.serial_number or panoply.hostname
+        self.content_types = list(content_types)
+        self.future = Future()
+
+        self.results = dict()
+
+        for content_type in self.content_types:
+            self.results[content_type] = {'version': None, 'status': 'pending', 'success': False, 'details': ''}
+
+        self._installs = deque()
+        self._installing = False
+        self._lock = threading.RLock()
+
+    def start(self) -> Future:
+        """
+        Check for updates to all content types and begin downloading any that are out of date. Installs are started
+        from the JobTracker as downloads complete.
+
+        :return: Future that will be resolved with the results dict once all content types are finished
+        """
+
+        for content_type in self.content_types:
+            result = self.results[content_type]
+
+            try:
+                version = self.panoply.check_content_updates(content_type)
+
+                if version is None:
+                    result.update({'status': 'current', 'success': True})
+                    continue
+
+                result['version'] = version
+                logger.info(f'Downloading {content_type} version {version} on {self.device}')
+                job_id = self.__op(f'<request><{content_type}><upgrade><download><latest/></download></upgrade>'
+                                   f'</{content_type}></request>')
+
+                if job_id is None:
+                    self._installs.append(content_type)
+                    continue
+
+                result['status'] = 'downloading'
+                job_future = self.tracker.add_job(self.panoply, job_id, f'{content_type} download')
+                job_future.add_done_callback(lambda f, t=content_type: self.__downloaded(t, f.result()))
+
+            except (PanoplyException, PanXapiError) as pe:
+                result.update({'status': 'failed', 'details': str(pe)})
+
+        self.__next_install()
+        return self.future
+
+    def __downloaded(self, content_type: str, job: dict) -> None:
+
+        with self._lock:
+
+            if not job['success']:
+                self.results[content_type].update({'status': 'failed', 'details': job['details'] or job['result']})
+
+            else:
+                self._installs.append(content_type)
+
+            self.__next_install()
+
+    def __installed(self, content_type: str, job: dict) -> None:
+
+        with self._lock:
+            self._installing = False
+            # the installed content versions in the facts only change once the install job completes
+            self.panoply.invalidate_op_cache()
+
+            if job['success']:
+                self.results[content_type].update({'status': 'installed', 'success': True})
+
+            else:
+                self.results[content_type].update({'status': 'failed', 'details': job['details'] or job['result']})
+
+            self.__next_install()
+
+    def __next_install(self) -> None:
+        """
+        Start the next queued install if no other install is running, and resolve the future once all content types
+        are finished
+        """
+
+        with self._lock:
+
+            while self._installs and not self._installing:
+                content_type = self._installs.popleft()
+                result = self.results[content_type]
+
+                try:
+                    logger.info(f'Installing {content_type} on {self.device}')
+                    job_id = self.__op(f'<request><{content_type}><upgrade><install><version>latest</version>'
+                                       f'<commit>no</commit></install></upgrade></{content_type}></request>')
+
+                except (PanoplyException, PanXapiError) as pe:
+                    result.update({'status': 'failed', 'details': str(pe)})
+                    continue
+
+                if job_id is None:
+                    result.update({'status': 'installed', 'success': True})
+                    continue
+
+                result['status'] = 'installing'
+                self._installing = True
+                job_future = self.tracker.add_job(self.panoply, job_id, f'{content_type} install')
+                job_future.add_done_callback(lambda f, t=content_type: self.__installed(t, f.result()))
+
+            finished = all(r['status'] in ('current', 'installed', 'failed') for r in self.results.values())
+
+            if finished and not self.future.done():
+                self.future.set_result(self.results)
+
+    def __op(self, cmd: str) -> Optional[str]:
+        """
+        Send a content download or install cmd and return the resulting job id, if any
+
+        :param cmd: op cmd to send
+        :return: job id or None
+        """
+
+        with self._lock:
+            self.panoply.invalidate_op_cache()
+            self.panoply.xapi.op(cmd=cmd)
+            result = self.panoply.xapi.element_result
+            job_element = result.find('.//job') if result is not None else None
+
+        return job_element.text if job_element is not None else None
+
+
+def update_dynamic_content(devices: List[Panoply], content_types: Iterable[str] = dynamic_content_types,
+                           max_workers: int = 8, timeout: int = 600, poll_interval: float = 2,
+                           progress_callback: Optional[Callable[[dict], None]] = None) -> Dict[str, dict]:
+    """
+    Check for and install newer dynamic content on many devices at once. All content types on all devices are checked
+    concurrently, downloads run in parallel, and installs on each device begin as soon as their download finishes. All
+    of the resulting jobs are tracked together in a single JobTracker, so the overall update takes roughly as long as
+    the slowest single download and install.
+
+    .. code-block:: python
+
+        results = update_dynamic_content([fw1, fw2], ['content', 'anti-virus'])
+        failed = [d for d, r in results.items() if not all(c['success'] for c in r.values())]
+
+    :param devices: list of connected Panoply instances
+    :param content_types: list of content types to update. Options are: 'content', 'anti-virus', 'wildfire'
+    :param max_workers: maximum number of devices to check and begin downloads on at once
+    :param timeout: how long to wait for each job before it is considered failed
+    :param poll_interval: initial time in seconds between status checks of each job
+    :param progress_callback: optional function called with the job dict each time a job status changes
+    :return: dict keyed by device serial number or hostname. Each value is a dict keyed by content type containing
+    the 'version', 'status' ('current', 'installed', or 'failed'), 'success', and 'details' keys
+    """
+
+    for content_type in content_types:
+
+        if content_type not in dynamic_content_types:
+            raise PanoplyException(f'Unknown content type: {content_type}')
+
+    tracker = JobTracker(min_interval=poll_interval, timeout=timeout, progress_callback=progress_callback)
+    updates = [ContentUpdate(device, tracker, content_types) for device in devices]
+
+    if updates:
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(updates))) as executor:
+            futures = list(executor.map(lambda u: u.start(), updates))
+
+        tracker.start()
+
+        for f in futures:
+            f.result()
+
+    return {u.device: u.results for u in updates}
@@ -14,22 +14,40 @@
 
 # Authors: Nathan Embery
 
+import copy
 import datetime
+import itertools
 import logging
 import os
 import random
 import re
 import sys
+import tempfile
+import threading
 import time
+from collections import UserString
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Generator
+from typing import IO
+from typing import Iterable
+from typing import List
 from typing import Optional
 from typing import Tuple
 from xml.etree import ElementTree
 from xml.etree.ElementTree import ParseError
+from xml.sax.saxutils import quoteattr
 
 import requests
 import requests_toolbelt
 import xmltodict
+from jinja2 import Template
+from jinja2 import TemplateError
 from lxml import etree
 from lxml.etree import Element
 from pan import xapi
@@ -37,15 +55,23 @@ from pan.config import PanConfig
 from pan.xapi import PanXapiError
 from xmldiff import main as xmldiff_main
 
+from .candidate import CandidateConfig
 from .exceptions import LoginException
 from .exceptions import PanoplyException
 from .exceptions import SkilletLoaderException
 from .exceptions import TargetConnectionException
 from .exceptions import TargetGenericException
 from .exceptions import TargetLoginException
+from .skillet.base import Skillet
+from .skillet.handle import SkilletHandle
 from .skilletLoader import SkilletLoader
+from .snippet.template import SimpleTemplateSnippet
+from .throttle import ThrottledPanXapi
+from .throttle import configure_limiter
+from .throttle import get_limiter
 
 logger = logging.getLogger(__name__)
+
 logger.setLevel(logging.INFO)
 
 if not len(logger.handlers):
@@ -53,15 +79,68 @@ if not len(logger.handlers):
     handler.setLevel(logging.DEBUG)
     logger.addHandler(handler)
 
+# compiled baseline templates keyed by (skillet type dir, baseline dir). These are loaded on first use and shared by
+# all Panoply instances in this process, so generating baselines for many devices only renders the template
+_baseline_templates = dict()
+_baseline_templates_lock = threading.Lock()
+
+# every Panoply instance takes a new configuration generation from this counter when created and each time its running
+# configuration may have changed, so generations are never shared between devices or reused
+_config_generations = itertools.count(1)
+
+
+def _get_baseline_template(skillet_type_dir: str, skillet_dir: str) -> Template:
+    """
+    Returns the compiled template of the baseline skillet found in the assets directory, loading it if necessary
+
+    :param skillet_type_dir: 'panos' or 'panorama'
+    :param skillet_dir: name of the baseline skillet directory, i.e. 'baseline_91'
+    :return: compiled jinja2 Template
+    """
+    key = (skillet_type_dir, skillet_dir)
+
+    with _baseline_templates_lock:
+
+        if key not in _baseline_templates:
+            template_path = Path(__file__).parent.joinpath('assets', skillet_type_dir, skillet_dir)
+
+            if not template_path.exists():
+                raise PanoplyException(f'No baseline configuration found for {skillet_type_dir} {skillet_dir}')
+
+            sl = SkilletLoader()
+            baseline_skillet = sl.load_skillet_from_path(str(template_path.resolve()))
+            snippet = baseline_skillet.get_snippets()[0]
+
+            # compile using the snippet environment so all the usual filters are available
+            _baseline_templates[key] = snippet._env.from_string(snippet.template_str)
+
+        return _baseline_templates[key]
+
 
 class Panoply:
     """
     Panoply is a wrapper around pan-python PanXAPI class to provide additional, commonly used functions
     """
 
+    # Prisma Access device groups that are pushed to the cloud services with a commit-all by commit_gpcs
+    gpcs_device_groups = ('Service_Conn_Device_Group', 'Remote_Network_Device_Group', 'Mobile_User_Device_Group')
+
+    # read-only op cmds whose results may be reused, and for how many seconds. Any configuration change or commit
+    # clears all cached results, these cmds never do. Cmds are matched after normalizing the xml, so '<info/>' and
+    # '<info></info>' are equal
+    op_cache_ttls = {
+        '<show><system><info/></system></show>': 60,
+        '<show><jobs><all/></jobs></show>': 5,
+        '<show><devices><connected/></devices></show>': 30,
+        '<show><devices><all/></devices></show>': 30,
+        '<show><high-availability><state/></high-availability></show>': 30,
+        '<request><license><info/></license></request>': 300,
+    }
+
     def __init__(self, hostname: Optional[str] = None, api_username: Optional[str] = None,
                  api_password: Optional[str] = None, api_port: Optional[int] = 443,
-                 serial_number: Optional[str] = None, debug: Optional[bool] = False, api_key: Optional[str] = None):
+                 serial_number: Optional[str] = None, debug: Optional[bool] = False, api_key: Optional[str] = None,
+                 use_http: Optional[bool] = False):
         """
         Initialize a new panoply object. Passing in the authentication information will cause this class to attempt
         to connect to the device and set offline_mode to False. Otherwise, offline mode will be set to True
@@ -73,6 +152,7 @@ class Panoply:
         :param serial_number: Serial number of target device if proxy through panorama
         :param debug: Optional flag to log additional debug messages
         :param api_key: Optional api key to use instead of username / password auth
+        :param use_http: Optional flag to connect using plain http instead of https, i.e. for local test servers
         """
 
         if api_port is None:
@@ -85,6 +165,7 @@ class Panoply:
         self.serial_number = serial_number
         self.key = api_key
         self.debug = debug
+        self.use_http = use_http
 
         self.serial = serial_number
         self.connected = False
@@ -94,6 +175,24 @@ class Panoply:
         self.offline_mode = False
         self.xapi = None
 
+        # optional requests Session shared by the API connections of this device, see get_session
+        self.session = None
+
+        # in offline mode, configuration cmds are applied to this in-memory configuration instead of a device
+        self.offline_config = None
+
+        # parsed copy of the running configuration used to answer 'show' cmds when '__cache_config' is enabled
+        self.__config_cache = None
+        self.__config_cache_source = None
+        self.__config_generation = next(_config_generations)
+
+        # tuple of the generation and the running configuration last retrieved with get_configuration
+        self.__retrieved_config = None
+
+        # results of op cmds found in op_cache_ttls, keyed by normalized cmd
+        self.__op_cache = dict()
+        self.__op_cache_lock = threading.Lock()
+
         if debug:
             logger.setLevel(logging.DEBUG)
 
@@ -108,8 +207,9 @@ class Panoply:
         self.offline_mode = False
 
         try:
-            self.xapi = xapi.PanXapi(api_username=self.user, api_password=self.pw, hostname=self.hostname,
-                                     port=self.port, serial=self.serial_number, api_key=self.key)
+            self.xapi = ThrottledPanXapi(api_username=self.user, api_password=self.pw, hostname=self.hostname,
+                                         port=self.port, serial=self.serial_number, api_key=self.key,
+                                         use_http=self.use_http)
 
         except xapi.PanXapiError as pxe:
             err_msg = str(pxe)
@@ -140,11 +240,12 @@ class Panoply:
         try:
 
             if self.xapi is None:
-                self.xapi = xapi.PanXapi(api_username=self.user, api_password=self.pw, hostname=self.hostname,
-                                         port=self.port, serial=self.serial_number)
+                self.xapi = ThrottledPanXapi(api_username=self.user, api_password=self.pw, hostname=self.hostname,
+                                             port=self.port, serial=self.serial_number, use_http=self.use_http)
 
             self.key = self.xapi.keygen()
             self.facts = self.get_facts()
+            configure_limiter(self.hostname, self.port, self.facts.get('model', None))
 
         except PanXapiError as pxe:
             err_msg = str(pxe)
@@ -175,6 +276,9 @@ class Panoply:
         :return: String from the API indicating success or failure
         """
 
+        self.invalidate_config_cache()
+        self.invalidate_op_cache()
+
         try:
             self.xapi.commit(cmd='<commit></commit>', sync=force_sync, timeout=600)
             results = self.xapi.xml_result()
@@ -188,66 +292,61 @@ class Panoply:
             logger.error(pxe)
             raise PanoplyException('Could not commit configuration')
 
-    def commit_gpcs(self, force_sync=True) -> str:
+    def commit_gpcs(self, force_sync=True, timeout=600) -> str:
         """
         Perform a commit operation on this device instance specifically for gpcs remote networks
         Note - you must do a full commit to panorama before you invoke this commit!
 
+        Each Prisma Access device group is checked for with a small 'get' query rather than retrieving the entire
+        configuration. The commit-all for each existing device group is then issued at the same time, and all the
+        resulting jobs are tracked together, so this takes only as long as the slowest commit.
+
         :raises PanoplyException: if commit failed
         :param force_sync: Flag to enable sync commit or async
+        :param timeout: how long to wait for the commit jobs when force_sync is True
         :return: String from the API indicating success or failure
         """
-        try:
-
-            running_config = self.get_configuration(config_source='running')
-            config_doc = etree.fromstring(running_config)
-
-            sc = config_doc.xpath("/config/devices/entry[@name='localhost.localdomain']/"
-                                  "device-group/entry[@name='Service_Conn_Device_Group']")
-            rn = config_doc.xpath("/config/devices/entry[@name='localhost.localdomain']/"
-                                  "device-group/entry[@name='Remote_Network_Device_Group']")
-            mu = config_doc.xpath("/config/devices/entry[@name='localhost.localdomain']/"
-                                  "device-group/entry[@name='Mobile_User_Device_Groupp']")
+        self.invalidate_config_cache()
+        self.invalidate_op_cache()
 
-            if sc:
-                self.xapi.commit(action='all',
-                                 cmd='<commit-all><shared-policy><device-group>'
-                                     '<entry name="Service_Conn_Device_Group"/>'
-                                     '</device-group></shared-policy></commit-all>')
+        def probe(device_group: str) -> bool:
+            connection = self.clone_xapi()
+            connection.get(xpath="/config/devices/entry[@name='localhost.localdomain']/"
+                                 f"device-group/entry[@name='{device_group}']")
 
-                results = self.xapi.xml_result()
+            return connection.element_result is not None and len(connection.element_result) > 0
 
-                if not self.__check_commit_return(results, force_sync):
-                    raise PanoplyException(self.xapi.status_detail)
+        def commit_all(device_group: str) -> (str, None):
+            connection = self.clone_xapi()
+            connection.commit(action='all',
+                              cmd='<commit-all><shared-policy><device-group>'
+                                  f'<entry name="{device_group}"/>'
+                                  '</device-group></shared-policy></commit-all>')
 
-            if rn:
-                self.xapi.commit(action='all',
-                                 cmd='<commit-all><shared-policy><device-group>'
-                                     '<entry name="Remote_Network_Device_Group"/>'
-                                     '</device-group></shared-policy></commit-all>')
+            if not self.__check_commit_return(connection.xml_result(), force_sync):
+                raise PanoplyException(connection.status_detail)
 
-                results = self.xapi.xml_result()
+            job_element = connection.element_result.find('.//job') if connection.element_result is not None else None
 
-                if not self.__check_commit_return(results, force_sync):
-                    raise PanoplyException(self.xapi.status_detail)
+            return job_element.text if job_element is not None else None
 
-            if mu:
-                self.xapi.commit(action='all',
-                                 cmd='<commit-all><shared-policy><device-group>'
-                                     '<entry name="Mobile_User_Device_Group"/>'
-                                     '</device-group></shared-policy></commit-all>')
-
-                results = self.xapi.xml_result()
+        try:
 
-                if not self.__check_commit_return(results, force_sync):
-                    raise PanoplyException(self.xapi.status_detail)
+            with ThreadPoolExecutor(max_workers=len(self.gpcs_device_groups)) as executor:
+                device_groups = [dg for dg, exists in zip(self.gpcs_device_groups,
+                                                          executor.map(probe, self.gpcs_device_groups)) if exists]
 
-            return 'Prisma Access Committed Successfully'
+                job_ids = [job_id for job_id in executor.map(commit_all, device_groups) if job_id is not None]
 
         except PanXapiError as pxe:
             logger.error(pxe)
             raise PanoplyException('Could not commit configuration')
 
+        if force_sync and job_ids and not self.wait_for_jobs(job_ids, timeout=timeout):
+            raise PanoplyException('Could not commit configuration')
+
+        return 'Prisma Access Committed Successfully'
+
     @staticmethod
     def __check_commit_return(results: str, force_sync: bool) -> bool:
         """
@@ -303,7 +402,7 @@ class Panoply:
         except PanXapiError as pxe:
             raise PanoplyException(f'Could not push skillet {name} / snippet {xpath}! {pxe}')
 
-    def execute_op(self, cmd_str: str, cmd_xml=False, parse_result=True) -> str:
+    def execute_op(self, cmd_str: str, cmd_xml=False, parse_result=True, use_cache=True) -> str:
         """
         Executes an 'op' command on the NGFW
 
@@ -311,15 +410,24 @@ class Panoply:
         :param cmd_xml: Flag to determine if op command requires XML encoding
         :param parse_result: Optional flag to indicate whether to return parsed xml results (xml_result) from xapi - not
         all commands return valid XML. Setting this to 'false' will return the raw string from the API.
+        :param use_cache: Optional flag to allow a recent result of a read-only cmd to be reused. See op_cache_ttls
         :return: raw output from the device
         """
 
+        key = self.__op_cache_key(cmd_str, cmd_xml)
+
+        if key not in self.op_cache_ttls and not cmd_str.lstrip().startswith(('<show', 'show')):
+            # any other op cmd may change the running configuration, i.e. commit or load
+            self.invalidate_config_cache()
+            self.invalidate_op_cache()
+
         try:
-            self.xapi.op(cmd=cmd_str, cmd_xml=cmd_xml)
+            xml_result, xml_document = self.__op(cmd_str, cmd_xml, use_cache, key)
+
             if parse_result:
-                return self.xapi.xml_result()
+                return xml_result
             else:
-                return self.xapi.xml_document
+                return xml_document
 
         except PanXapiError as pxe:
             if 'ParseError' in str(pxe):
@@ -339,6 +447,59 @@ class Panoply:
 
             raise PanoplyException(pxe)
 
+    def __op(self, cmd_str: str, cmd_xml: bool, use_cache: bool = True, key: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Send an op cmd to the device, or return the cached results if this cmd was recently executed
+
+        :param cmd_str: op command to send
+        :param cmd_xml: Flag to determine if op command requires XML encoding
+        :param use_cache: Flag to allow cached results
+        :param key: normalized cmd if already known
+        :return: tuple of the xml_result and xml_document
+        """
+        if key is None:
+            key = self.__op_cache_key(cmd_str, cmd_xml)
+
+        ttl = self.op_cache_ttls.get(key, 0) if key is not None else 0
+
+        if ttl and use_cache:
+
+            with self.__op_cache_lock:
+                cached = self.__op_cache.get(key, None)
+
+            if cached is not None and time.monotonic() - cached[0] < ttl:
+                logger.debug(f'Using cached results for op cmd: {key}')
+                return cached[1], cached[2]
+
+        self.xapi.op(cmd=cmd_str, cmd_xml=cmd_xml)
+        results = (self.xapi.xml_result(), self.xapi.xml_document)
+
+        if ttl and self.xapi.status == 'success':
+
+            with self.__op_cache_lock:
+                self.__op_cache[key] = (time.monotonic(),) + results
+
+        return results
+
+    def __op_cache_key(self, cmd_str: str, cmd_xml: bool) -> (str, None):
+
+        try:
+            cmd = self.xapi.cmd_xml(cmd_str) if cmd_xml else cmd_str
+            parser = etree.XMLParser(remove_blank_text=True)
+            return etree.tostring(etree.fromstring(cmd, parser)).decode('UTF-8')
+
+        except (etree.XMLSyntaxError, ValueError):
+            return None
+
+    def invalidate_op_cache(self) -> None:
+        """
+        Clear all cached op cmd results. This is called automatically after any configuration change or commit.
+
+        :return: None
+        """
+        with self.__op_cache_lock:
+            self.__op_cache.clear()
+
     def execute_cli(self, cmd_str: str) -> str:
         """
         Short-cut to execute a simple CLI op cmd
@@ -361,6 +522,15 @@ class Panoply:
         if cmd not in ('op', 'set', 'edit', 'override', 'move', 'rename', 'clone', 'show', 'get', 'delete'):
             raise PanoplyException('Invalid cmd type given to execute_cmd')
 
+        if self.xapi is None and cmd != 'op':
+            return self.__execute_offline_cmd(cmd, params, context)
+
+        if cmd == 'show' and context and context.get('__cache_config', False):
+            output = self.show_from_config(params['xpath'], context.get('config', None))
+
+            if output is not None:
+                return output
+
         # this code happily borrowed from ansible-pan module
         # https://raw.githubusercontent.com/PaloAltoNetworks/ansible-pan/develop/library/panos_type_cmd.py
 
@@ -373,7 +543,10 @@ class Panoply:
             # fix for GL #79
             parse_result = params.get('parse_result', True)
 
-            return self.execute_op(cmd_str, cmd_xml=False, parse_result=parse_result)
+            # snippets may set 'cache: false' to always query the device
+            use_cache = params.get('cache', True) not in (False, 'false', 'False', 'no')
+
+            return self.execute_op(cmd_str, cmd_xml=False, parse_result=parse_result, use_cache=use_cache)
 
         # in all other cases, the xpath is a required attribute
         kwargs = {
@@ -405,6 +578,9 @@ class Panoply:
         except KeyError as ke:
             raise PanoplyException(f'Invalid parameters passed to execute_cmd: {ke}')
 
+        if cmd not in ('show', 'get'):
+            self.invalidate_op_cache()
+
         try:
             func(**kwargs)
 
@@ -413,6 +589,513 @@ class Panoply:
 
         return self.xapi.xml_result()
 
+    def show_from_config(self, xpath: str, config: (str, None)) -> (str, None):
+        """
+        Answer a 'show' cmd from the given running configuration instead of the device. The output is formatted the
+        same as the API response. The configuration is parsed once and reused for each query until it changes.
+
+        :param xpath: xpath to query
+        :param config: running configuration as last retrieved from this device with get_configuration, or a
+        LazyConfig that resolves to it, i.e. context['config']
+        :return: the xml found at the xpath, or None if the query must be sent to the device. This is the case when
+        nothing is found, as the device may hold dynamic or predefined data at that xpath, or when the running
+        configuration may have changed since it was retrieved
+        """
+
+        if config is None:
+            return None
+
+        # a LazyConfig is resolved here, retrieving the current configuration if it was not already retrieved
+        config = config.data if isinstance(config, UserString) else config
+        retrieved = self.__retrieved_config
+
+        # only the very same str returned by get_configuration is used, so it is never copied or compared
+        if retrieved is None or retrieved[0] != self.__config_generation or retrieved[1] is not config:
+            return None
+
+        if self.__config_cache is None or self.__config_cache_source is not config:
+            self.__config_cache = CandidateConfig(config)
+            self.__config_cache_source = config
+
+        xpath = ''.join(xpath.strip().split('\n'))
+
+        try:
+            output = self.__config_cache.show(xpath)
+
+        except PanoplyException:
+            return None
+
+        if not output:
+            return None
+
+        logger.debug(f'Answered show from cached configuration: {xpath}')
+        return output
+
+    def invalidate_config_cache(self) -> None:
+        """
+        Stop answering 'show' cmds from the cached running configuration. This is called automatically for any cmd
+        that may change the running configuration, i.e. commit or load.
+
+        :return: None
+        """
+
+        # any configuration retrieved before now may be out of date
+        self.__config_generation = next(_config_generations)
+        self.__retrieved_config = None
+        self.__config_cache = None
+        self.__config_cache_source = None
+
+    def execute_multi_config(self, commands: List[Tuple[str, dict]], strict: bool = False) -> List[Tuple[str, str]]:
+        """
+        Execute a list of configuration commands using a single PAN-OS 'multi-config' API request. This allows many
+        'set', 'edit', or 'delete' commands to be pushed in one round trip instead of one request per command.
+
+        :param commands: list of tuples containing the cmd type and the params for that cmd, as would be passed to
+        'execute_cmd'. Valid cmd types are: 'set', 'edit', 'delete'
+        :param strict: Flag to enable 'strict-transactional' mode. If any command fails, none will be applied
+        :return: list of tuples containing the output and status for each command in the same order as given. Status
+        will be either 'success' or 'error'
+        """
+
+        if not commands:
+            return list()
+
+        if self.xapi is None:
+            return self.__execute_offline_multi_config(commands, strict)
+
+        self.invalidate_op_cache()
+        actions = list()
+
+        for index, (cmd, params) in enumerate(commands, start=1):
+
+            if cmd not in ('set', 'edit', 'delete'):
+                raise PanoplyException(f'Invalid cmd type given to execute_multi_config: {cmd}')
+
+            try:
+                xpath = quoteattr(''.join(params['xpath'].strip().split('\n')))
+
+                if cmd == 'delete':
+                    actions.append(f'<delete id="{index}" xpath={xpath}/>')
+                    continue
+
+                element = params['element']
+
+                # cherry picked elements may be bytes here
+                if isinstance(element, bytes):
+                    element = element.decode(encoding='UTF-8')
+
+                actions.append(f'<{cmd} id="{index}" xpath={xpath}>{element.strip()}</{cmd}>')
+
+            except KeyError as ke:
+                raise PanoplyException(f'Invalid parameters passed to execute_multi_config: {ke}')
+
+        multi_config_element = f'<multi-configure-request>{"".join(actions)}</multi-configure-request>'
+        logger.debug(f'Executing multi-config request with {len(actions)} commands')
+
+        try:
+            self.xapi.multi_config(element=multi_config_element, strict=True if strict else None)
+
+        except PanXapiError as pxe:
+            # failed commands result in an error status, but we still want the per command results if present
+            if self.xapi.element_root is None:
+                raise PanoplyException(f'Could not execute multi-config request: {pxe}')
+
+            logger.debug(f'multi-config request returned an error: {pxe}')
+
+        return self.__parse_multi_config_results(self.xapi.element_root, len(commands), strict)
+
+    def __execute_offline_multi_config(self, commands: List[Tuple[str, dict]],
+                                       strict: bool) -> List[Tuple[str, str]]:
+        """
+        Apply a list of configuration commands to the offline configuration with the same semantics as a
+        multi-config request. Processing stops at the first failure, and in strict mode nothing is applied.
+
+        :param commands: list of tuples containing the cmd type and the params for that cmd
+        :param strict: Flag to enable 'strict-transactional' mode
+        :return: list of tuples containing the output and status for each command
+        """
+        offline_config = self.__get_offline_config()
+        backup = offline_config.copy() if strict else None
+
+        results = [('Command was not executed due to a previous failure', 'error')] * len(commands)
+
+        for index, (cmd, params) in enumerate(commands):
+
+            if cmd not in ('set', 'edit', 'delete'):
+                raise PanoplyException(f'Invalid cmd type given to execute_multi_config: {cmd}')
+
+            try:
+                results[index] = (offline_config.apply(cmd, params), 'success')
+
+            except PanoplyException as pe:
+                results[index] = (str(pe), 'error')
+
+                if strict:
+                    self.offline_config = backup
+                    rolled_back = ('Command was rolled back due to a failure in the transaction', 'error')
+                    results[:index] = [rolled_back] * index
+
+                break
+
+        return results
+
+    @staticmethod
+    def __parse_multi_config_results(response: ElementTree.Element, count: int, strict: bool) -> List[Tuple[str, str]]:
+        """
+        Parse the response from a multi-config request into a list of results for each command
+
+        :param response: root element of the multi-config api response
+        :param count: number of commands that were included in the request
+        :param strict: whether the request was strict-transactional, in which case a failure means nothing was applied
+        :return: list of tuples containing the output and status for each command
+        """
+
+        overall_status = response.attrib.get('status', 'error')
+
+        # default message for any command that has no response, i.e. a previous command failed and stopped execution
+        not_executed = ('Command was not executed due to a previous failure', 'error')
+        results = [not_executed] * count
+
+        for command_response in response.findall('./response'):
+
+            try:
+                index = int(command_response.attrib.get('id', 0)) - 1
+
+            except ValueError:
+                continue
+
+            if index < 0 or index >= count:
+                continue
+
+            msg = ''
+            msg_element = command_response.find('./msg')
+
+            if msg_element is not None:
+                line_element = msg_element.find('./line')
+                msg = line_element.text if line_element is not None else msg_element.text
+
+            if command_response.attrib.get('status', 'error') == 'success':
+
+                if strict and overall_status != 'success':
+                    # strict-transactional means nothing was actually applied
+                    results[index] = ('Command was rolled back due to a failure in the transaction', 'error')
+
+                else:
+                    results[index] = (msg or '', 'success')
+
+            else:
+                results[index] = (msg or 'Command failed', 'error')
+
+        if overall_status != 'success' and not response.findall('./response'):
+            # the entire request failed, use the top-level message for all the commands
+            msg_element = response.find('.//msg')
+            msg = ''.join(msg_element.itertext()) if msg_element is not None else 'multi-config request failed'
+            results = [(msg, 'error')] * count
+
+        return results
+
+    def load_offline_config(self, config: str) -> None:
+        """
+        Load the configuration to use in offline mode. Configuration cmds such as 'set', 'edit', or 'delete' executed
+        while offline will be applied to this configuration, and 'get_configuration' will return the result.
+
+        :param config: configuration xml as a str
+        :return: None
+        """
+        self.offline_config = CandidateConfig(config)
+
+    def load_offline_config_file(self, path: str) -> None:
+        """
+        Load the configuration to use in offline mode from a file. The file is parsed directly from disk the first
+        time it is required, so large configurations are never held in memory as a str unless explicitly requested.
+
+        :param path: path to the configuration file
+        :return: None
+        """
+        if not os.path.isfile(path):
+            raise PanoplyException(f'Configuration file {path} does not exist')
+
+        self.offline_config = CandidateConfig.from_file(path)
+
+    def __get_offline_config(self, context: Optional[dict] = None) -> CandidateConfig:
+
+        if self.offline_config is None:
+
+            if context and context.get('config_file', None):
+                self.load_offline_config_file(context['config_file'])
+                return self.offline_config
+
+            if not context or not context.get('config', None):
+                raise PanoplyException('Configuration cmds require a connected device or an offline configuration')
+
+            self.load_offline_config(str(context['config']))
+
+        return self.offline_config
+
+    def __execute_offline_cmd(self, cmd: str, params: dict, context: Optional[dict] = None) -> str:
+        """
+        Apply the given cmd to the offline configuration
+
+        :param cmd: Valid options are: 'show', 'get', 'delete', 'set', 'edit', 'override', 'move', 'rename', 'clone'
+        :param params: valid parameters for the given cmd type
+        :param context: skillet context, the 'config' variable will be used if no offline configuration is loaded
+        :return: the xml found at the xpath for 'show' or 'get' cmds, otherwise an empty str
+        """
+        offline_config = self.__get_offline_config(context)
+
+        try:
+            return offline_config.apply(cmd, params)
+
+        except PanoplyException as pe:
+            raise PanoplyException(f'Could not execute command: {cmd}: {pe}')
+
+    def clone_xapi(self) -> xapi.PanXapi:
+        """
+        Returns a new PanXapi object for this device using the existing API key. PanXapi objects keep the state of the
+        last response, so each thread that needs to talk to the device concurrently must use its own instance.
+
+        :return: PanXapi instance
+        """
+
+        if self.key is None:
+            raise PanoplyException('Could not create a new API connection without an API key!')
+
+        return ThrottledPanXapi(api_key=self.key, hostname=self.hostname, port=self.port, serial=self.serial_number,
+                                use_http=self.use_http, session=self.session)
+
+    def get_throttle_metrics(self) -> dict:
+        """
+        Returns the current request throttling metrics for this device. All API requests to a device are shared
+        across a single adaptive limiter, regardless of which thread or Panoply instance sends them.
+
+        :return: dict containing the current concurrency_limit, in_flight, requests, errors, overloads, avg_latency
+        and total_wait
+        """
+        return get_limiter(self.hostname, self.port).metrics()
+
+    def configure_throttle(self, **kwargs) -> None:
+        """
+        Override the request throttling limits for this device. By default, the limits are chosen based on the
+        model of the device.
+
+        :param kwargs: max_concurrency, rate, latency_target, min_concurrency, or burst
+        :return: None
+        """
+        configure_limiter(self.hostname, self.port, self.facts.get('model', None), **kwargs)
+
+    def bulk_load(self, xpath: str, entries: Optional[Iterable[str]] = None,
+                  element_template: Optional[str] = None, contexts: Optional[Iterable[dict]] = None,
+                  max_chunk_size: int = 256 * 1024, max_chunk_entries: int = 1000, max_workers: int = 4,
+                  retries: int = 3, progress_callback: Optional[Callable[[int, int], None]] = None) -> dict:
+        """
+        Load a very large number of entries, such as address objects or security rules, into the configuration at the
+        given xpath. Entries are streamed into chunks that are pushed using 'set' requests, limited both by size and
+        number of entries. Up to 'max_workers' chunks will be pushed concurrently.
+
+        Chunks that fail with a transient error, such as a timeout or a connection error, are retried with a backoff.
+        Chunks that are rejected by the device are split in half and retried until the offending entries are found.
+
+        Entries can either be given directly as XML strings, or rendered from a jinja 'element_template' using each
+        dict found in 'contexts'.
+
+        :param xpath: xpath where the entries will be set, for example: /config/shared/address
+        :param entries: iterable of XML strings, for example: '<entry name="a1"><ip-netmask>1.1.1.1</ip-netmask></entry>'
+        :param element_template: jinja template used to render each entry when 'contexts' are given
+        :param contexts: iterable of dicts used to render the element_template
+        :param max_chunk_size: maximum size in characters of each set request element
+        :param max_chunk_entries: maximum number of entries in each set request
+        :param max_workers: maximum number of concurrent requests to the device
+        :param retries: number of times to retry a chunk after a transient error
+        :param progress_callback: optional function called with the number of loaded and failed entries after each
+        chunk completes
+        :return: dict containing the following keys:
+            * loaded - number of entries successfully loaded
+            * failed - list of dicts with the 'entry' and 'error' for every entry that could not be loaded
+            * requests - number of set requests sent to the device, not including retries
+        """
+
+        if entries is None:
+
+            if element_template is None or contexts is None:
+                raise PanoplyException('Either entries or element_template and contexts are required for bulk_load')
+
+            entries = self.__render_entries(element_template, contexts)
+
+        xpath = ''.join(xpath.strip().split('\n'))
+        self.invalidate_op_cache()
+
+        results = {
+            'loaded': 0,
+            'failed': list(),
+            'requests': 0
+        }
+
+        lock = threading.Lock()
+
+        def load_chunk(chunk: List[str]) -> None:
+            # each worker gets its own connection
+            chunk_xapi = self.clone_xapi()
+            pending = [chunk]
+
+            while pending:
+                current = pending.pop()
+                element = self.sanitize_element(''.join(current))
+                error = self.__set_with_retry(chunk_xapi, xpath, element, retries)
+
+                with lock:
+                    results['requests'] += 1
+
+                if error is None:
+                    with lock:
+                        results['loaded'] += len(current)
+
+                elif len(current) > 1:
+                    # find the offending entries by splitting this chunk in half
+                    middle = len(current) // 2
+                    pending.append(current[middle:])
+                    pending.append(current[:middle])
+
+                else:
+                    logger.error(f'Could not load entry at {xpath}: {error}')
+
+                    with lock:
+                        results['failed'].append({'entry': current[0], 'error': error})
+
+            if progress_callback is not None:
+                with lock:
+                    loaded = results['loaded']
+                    failed = len(results['failed'])
+
+                progress_callback(loaded, failed)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = set()
+
+            for chunk in self.__chunk_entries(entries, max_chunk_size, max_chunk_entries):
+
+                # bound the number of queued chunks so large iterables are not read into memory all at once
+                if len(in_flight) >= max_workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        future.result()
+
+                in_flight.add(executor.submit(load_chunk, chunk))
+
+            for future in in_flight:
+                future.result()
+
+        logger.info(f'Bulk load complete: {results["loaded"]} loaded, {len(results["failed"])} failed in '
+                    f'{results["requests"]} requests')
+
+        return results
+
+    @staticmethod
+    def __render_entries(element_template: str, contexts: Iterable[dict]) -> Generator[str, None, None]:
+        """
+        Render the element template once for each context
+
+        :param element_template: jinja template string
+        :param contexts: iterable of dicts to use when rendering
+        :return: generator of rendered entries
+        """
+        template_snippet = SimpleTemplateSnippet(element_template)
+
+        for context in contexts:
+            yield template_snippet.template(context)
+
+    @staticmethod
+    def __chunk_entries(entries: Iterable[str], max_chunk_size: int,
+                        max_chunk_entries: int) -> Generator[List[str], None, None]:
+        """
+        Group entries into chunks limited by both the combined size and the number of entries. An entry larger than
+        max_chunk_size will be placed into a chunk by itself.
+
+        :param entries: iterable of XML strings
+        :param max_chunk_size: maximum combined size of each chunk
+        :param max_chunk_entries: maximum number of entries in each chunk
+        :return: generator of lists of entries
+        """
+        chunk = list()
+        chunk_size = 0
+
+        for entry in entries:
+            entry = entry.strip()
+
+            if not entry:
+                continue
+
+            if chunk and (chunk_size + len(entry) > max_chunk_size or len(chunk) >= max_chunk_entries):
+                yield chunk
+                chunk = list()
+                chunk_size = 0
+
+            chunk.append(entry)
+            chunk_size += len(entry)
+
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def __set_with_retry(set_xapi: xapi.PanXapi, xpath: str, element: str, retries: int) -> Optional[str]:
+        """
+        Perform a 'set' request, retrying with a backoff when a transient error is encountered
+
+        :param set_xapi: PanXapi instance to use for the request
+        :param xpath: xpath where to set the element
+        :param element: element to set
+        :param retries: number of times to retry after a transient error
+        :return: None on success, or the error message on failure
+        """
+        attempt = 0
+
+        while True:
+            try:
+                set_xapi.set(xpath=xpath, element=element)
+
+                if set_xapi.status_code == '7':
+                    return f'xpath {xpath} was NOT found'
+
+                return None
+
+            except PanXapiError as pxe:
+                err_msg = str(pxe)
+
+                if attempt >= retries or not Panoply.is_transient_error(err_msg):
+                    return err_msg
+
+                attempt += 1
+                backoff = min(2 ** attempt, 30)
+                logger.info(f'Transient error from device, retrying in {backoff} seconds: {err_msg}')
+                time.sleep(backoff)
+
+    @staticmethod
+    def is_transient_error(err_msg: str) -> bool:
+        """
+        Determine if an error message from the API indicates a transient condition that may succeed if retried, such
+        as a timeout, connection error, or the management plane being too busy to respond
+
+        :param err_msg: error message from a PanXapiError
+        :return: bool True if the request may be retried
+        """
+        transient_errors = (
+            'URLError',
+            'timed out',
+            'Errno',
+            'Connection reset',
+            'RemoteDisconnected',
+            'code: 502',
+            'code: 503',
+            'code: 504',
+            'code: 429',
+        )
+
+        for transient_error in transient_errors:
+            if transient_error in err_msg:
+                return True
+
+        return False
+
     def fetch_license(self, auth_code: str) -> bool:
         """
         Fetch and install licenses for PAN-OS NGFW
@@ -430,6 +1113,7 @@ class Panoply:
         try:
             cmd = f'<request><license><fetch><auth-code>{auth_code}</auth-code></fetch></license></request>'
             logger.debug(f'Using request cmd: {cmd}')
+            self.invalidate_op_cache()
             self.xapi.op(cmd=cmd)
             results = self.xapi.xml_result()
             logger.debug(f'fetch_license results: {results}')
@@ -590,12 +1274,11 @@ class Panoply:
         facts = {}
 
         # FIXME - add better error handling here
-        self.xapi.op(cmd='<show><system><info></info></system></show>')
+        results_xml_str, _ = self.__op('<show><system><info></info></system></show>', cmd_xml=False)
 
-        if self.xapi.status != 'success':
+        if results_xml_str is None:
             raise PanoplyException('Could not get facts from device!')
 
-        results_xml_str = self.xapi.xml_result()
         results = xmltodict.parse(results_xml_str)
 
         if 'system' in results:
@@ -715,50 +1398,100 @@ class Panoply:
         else:
             raise PanoplyException('Could not determine sw-version for baseline load')
 
-        template_path = Path(__file__).parent.joinpath('assets', skillet_type_dir, skillet_dir)
-        sl = SkilletLoader()
-        baseline_skillet = sl.load_skillet_from_path(str(template_path.resolve()))
-        snippets = baseline_skillet.get_snippets()
-        snippet = snippets[0]
-        output, status = snippet.execute(context)
+        template = _get_baseline_template(skillet_type_dir, skillet_dir)
 
-        if status == 'success':
-            return str(output)
+        try:
+            return str(template.render(context))
 
-        else:
+        except TemplateError as te:
+            logger.error(f'Could not render baseline config: {te}')
             raise PanoplyException('Could not generate baseline config!')
 
-    def import_file(self, filename: str, file_contents: (str, bytes), category: str) -> bool:
+    def import_file(self, filename: str, file_contents: (str, bytes, IO[bytes], Path), category: str,
+                    progress_callback: Optional[Callable[[int, int], None]] = None,
+                    timeout: Optional[float] = None) -> bool:
         """
-        Import the given file into this device
+        Import the given file into this device. The file is streamed to the device in chunks over the pooled session
+        connection, so passing an open file or a Path allows large configurations, software images, or content
+        packages to be imported without reading them into memory.
+
+        .. code-block:: python
 
-        :param filename:
-        :param file_contents:
-        :param category: 'configuration'
+            p.import_file('PanOS_vm-10.0.0', Path('PanOS_vm-10.0.0'), 'software',
+                          progress_callback=lambda sent, total: print(f'{sent}/{total}'))
+
+        :param filename: name of the file on the device
+        :param file_contents: contents of the file as a str or bytes, an open binary file object, or the Path of a file
+        :param category: 'configuration', 'software', 'content', 'anti-virus', etc
+        :param progress_callback: optional function called with the number of bytes sent and the total number of
+        bytes as the upload progresses
+        :param timeout: seconds to wait for the device, None to wait indefinitely
         :return: bool True on success
         """
+        self.invalidate_op_cache()
+
         params = {
             'type': 'import',
             'category': category,
             'key': self.key
         }
 
+        if self.serial_number is not None:
+            params['target'] = self.serial_number
+
+        if isinstance(file_contents, Path):
+
+            with file_contents.open('rb') as f:
+                return self.__upload(params, filename, f, progress_callback, timeout)
+
+        return self.__upload(params, filename, file_contents, progress_callback, timeout)
+
+    def __upload(self, params: dict, filename: str, file_contents: (str, bytes, IO[bytes]),
+                 progress_callback: Optional[Callable[[int, int], None]], timeout: Optional[float]) -> bool:
+        """
+        Send a multipart encoded file upload to the device
+
+        :param params: query parameters of the import request
+        :param filename: name of the file on the device
+        :param file_contents: contents of the file as a str or bytes, or an open binary file object
+        :param progress_callback: optional function called with the number of bytes sent and the total
+        :param timeout: seconds to wait for the device
+        :return: bool True on success
+        """
         mef = requests_toolbelt.MultipartEncoder(
             fields={
                 'file': (filename, file_contents, 'application/octet-stream')
             }
         )
 
-        r = requests.post(
-            f'https://{self.hostname}:{self.port}/api/',
-            verify=False,
-            params=params,
-            headers={'Content-Type': mef.content_type},
-            data=mef
-        )
+        if progress_callback is not None:
+            mef = requests_toolbelt.MultipartEncoderMonitor(mef, lambda m: progress_callback(m.bytes_read, m.len))
+
+        limiter = get_limiter(self.hostname, self.port)
+        limiter.acquire()
+
+        start = time.monotonic()
+        error = None
+
+        try:
+            r = self.get_session().post(
+                f'{"http" if self.use_http else "https"}://{self.hostname}:{self.port}/api/',
+                verify=False,
+                params=params,
+                headers={'Content-Type': mef.content_type},
+                data=mef,
+                timeout=timeout
+            )
 
-        # if something goes wrong just raise an exception
-        r.raise_for_status()
+            # if something goes wrong just raise an exception
+            r.raise_for_status()
+
+        except requests.exceptions.RequestException as re:
+            error = str(re)
+            raise
+
+        finally:
+            limiter.release(time.monotonic() - start, error)
 
         resp = ElementTree.fromstring(r.content)
 
@@ -777,6 +1510,7 @@ class Panoply:
         """
 
         cmd = f'<load><config><from>{filename}</from></config></load>'
+        self.invalidate_op_cache()
         self.xapi.op(cmd=cmd)
 
         if self.xapi.status == 'success':
@@ -792,8 +1526,7 @@ class Panoply:
         :return: bool True if there is currently a running job
         """
 
-        self.execute_cli('show jobs all')
-        jobs = self.xapi.xml_document
+        jobs = self.execute_op('show jobs all', cmd_xml=True, parse_result=False)
         jobs_element = etree.fromstring(jobs)
 
         running_jobs_list = jobs_element.xpath(".//jobs/status[text() != 'FIN']")
@@ -903,6 +1636,146 @@ class Panoply:
 
         return filtered_devices
 
+    def get_session(self, pool_size: int = 10) -> requests.Session:
+        """
+        Returns a requests Session for this device, creating one if necessary. API connections created after this,
+        i.e. via clone_xapi or get_managed_device, will share the session and reuse its pool of connections.
+        Requests sent using the session verify the device certificate against the CA bundle, set 'verify' on the
+        returned session to disable this or to use another bundle.
+
+        :param pool_size: maximum number of connections to keep open to the device
+        :return: requests Session
+        """
+
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+        return self.session
+
+    def get_managed_device(self, serial_number: str, facts: Optional[dict] = None) -> 'Panoply':
+        """
+        Returns a Panoply for a firewall managed by this Panorama. All requests are proxied through Panorama using
+        the serial number as the target, and use the API key and session of this Panorama instance, so no further
+        authentication is required.
+
+        :param serial_number: serial number of the managed device
+        :param facts: optional device facts, i.e. an entry returned from filter_connected_devices
+        :return: Panoply instance
+        """
+
+        if self.key is None:
+            raise PanoplyException('Panorama must be connected before managed devices can be reached')
+
+        device = Panoply(debug=self.debug)
+        device.hostname = self.hostname
+        device.port = self.port
+        device.user = self.user
+        device.pw = self.pw
+        device.key = self.key
+        device.use_http = self.use_http
+        device.serial_number = serial_number
+        device.serial = serial_number
+        device.session = self.session
+        device.offline_mode = False
+        device.xapi = device.clone_xapi()
+        device.facts = dict(facts) if facts is not None else dict()
+        device.connected = True
+        device.connected_message = f'connected via {self.hostname}'
+
+        return device
+
+    def fan_out(self, func: Callable[['Panoply'], Any], filter_terms: Optional[dict] = None,
+                max_workers: int = 8) -> Dict[str, dict]:
+        """
+        Call func concurrently for each connected device managed by this Panorama that matches the filter terms.
+        Requests to all the devices share one API key and pool of connections, and are throttled together as they
+        all pass through Panorama.
+
+        .. code-block:: python
+
+            results = panorama.fan_out(lambda d: d.execute_cli('show session info'), {'model': 'PA-VM'})
+
+        :param func: function to call with the Panoply of each managed device
+        :param filter_terms: dict of terms as used by filter_connected_devices
+        :param max_workers: maximum number of devices to work on at once
+        :return: dict keyed by serial number. Each value is a dict containing 'success', the 'result' returned from
+        func, and the 'error' message if an exception was raised
+        """
+        devices = self.filter_connected_devices(filter_terms)
+
+        # filter_connected_devices returns a dict instead of a list when only a single device is connected
+        if isinstance(devices, dict):
+            devices = [devices]
+
+        self.get_session(pool_size=max_workers)
+
+        def run(device_facts: dict) -> dict:
+            try:
+                device = self.get_managed_device(device_facts['serial'], device_facts)
+                return {'success': True, 'result': func(device), 'error': ''}
+
+            except (PanoplyException, Exception) as e:
+                logger.error(f'Exception caught on device {device_facts.get("serial", "")}: {e}')
+                return {'success': False, 'result': None, 'error': str(e)}
+
+        results = dict()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(run, d): d.get('serial', '') for d in devices if 'serial' in d}
+
+            for future, serial in futures.items():
+                results[serial] = future.result()
+
+        return results
+
+    def execute_skillet_on_devices(self, skillet: Skillet, context: Optional[dict] = None,
+                                   filter_terms: Optional[dict] = None, max_workers: int = 8,
+                                   read_only: bool = True) -> Dict[str, dict]:
+        """
+        Execute a panos or pan_validation skillet concurrently against each connected device managed by this Panorama
+        that matches the filter terms. Each device gets its own copy of the skillet.
+
+        :param skillet: skillet to execute, or a SkilletHandle as loaded by a lazy SkilletLoader
+        :param context: initial context to use for each execution
+        :param filter_terms: dict of terms as used by filter_connected_devices
+        :param max_workers: maximum number of devices to work on at once
+        :param read_only: refuse to execute skillets that contain configuration or op cmds
+        :return: dict keyed by serial number. Each value is a dict containing 'success', the skillet results as
+        'result', and the 'error' message if the execution failed
+        """
+
+        if isinstance(skillet, SkilletHandle):
+            # the copy for each device is created from the class of the skillet itself
+            skillet = skillet.skillet
+
+        if skillet.type not in ('panos', 'pan_validation'):
+            raise PanoplyException(f'Cannot execute skillets of type {skillet.type} on managed devices')
+
+        if read_only:
+            read_only_cmds = ('show', 'get', 'parse', 'validate', 'validate_xml', 'noop')
+
+            for snippet_def in skillet.snippet_stack:
+                cmd = snippet_def.get('cmd', 'set')
+                cmd_str = str(snippet_def.get('cmd_str', '')).strip()
+
+                if cmd in read_only_cmds or (cmd == 'op' and cmd_str.startswith('<show')) or \
+                        (cmd == 'cli' and cmd_str.startswith('show')):
+                    continue
+
+                raise PanoplyException(f'Snippet {snippet_def.get("name", "")} is not read-only')
+
+        if context is None:
+            context = dict()
+
+        def run(device: Panoply) -> dict:
+            device_skillet = skillet.__class__(copy.deepcopy(skillet.skillet_dict), device)
+            return device_skillet.execute(dict(context))
+
+        return self.fan_out(run, filter_terms, max_workers)
+
     def update_dynamic_content(self, content_type: str) -> bool:
         """
         Check for newer dynamic content and install if found
@@ -922,6 +1795,7 @@ class Panoply:
                   f'<{content_type}><upgrade><download><latest/></download></upgrade></{content_type}>' \
                   f'</request>'
 
+            self.invalidate_op_cache()
             self.xapi.op(cmd=cmd)
             results_element = self.xapi.element_result
             job_element = results_element.find('.//job')
@@ -936,6 +1810,7 @@ class Panoply:
             install_cmd = f'<request><{content_type}><upgrade><install>' \
                           f'<version>latest</version><commit>no</commit></install></upgrade></{content_type}></request>'
 
+            self.invalidate_op_cache()
             self.xapi.op(cmd=install_cmd)
             results_element = self.xapi.element_result
             job_element = results_element.find('.//job')
@@ -949,12 +1824,32 @@ class Panoply:
             else:
                 logger.info('No job returned to track')
 
+            # the installed content versions in the facts only change once the install job completes
+            self.invalidate_op_cache()
             return True
 
         except PanXapiError:
             logger.error('Could not check for updated dynamic content')
             return False
 
+    def update_all_dynamic_content(self, content_types: Optional[List[str]] = None, timeout=600) -> dict:
+        """
+        Check for newer dynamic content of all the given types and install if found. Unlike update_dynamic_content,
+        all content types are downloaded at the same time and each is installed as soon as its download completes.
+        Use skilletlib.jobs.update_dynamic_content to update many devices at once.
+
+        :param content_types: list of content types to update, defaults to 'content', 'anti-virus', and 'wildfire'
+        :param timeout: how long to wait for each job before we give up
+        :return: dict keyed by content type containing the 'version', 'status' ('current', 'installed', or
+        'failed'), 'success', and 'details' keys
+        """
+        from .jobs import dynamic_content_types
+        from .jobs import update_dynamic_content
+
+        results = update_dynamic_content([self], content_types or dynamic_content_types, timeout=timeout)
+
+        return next(iter(results.values()))
+
     def check_content_updates(self, content_type: str) -> (str, None):
         """
         Iterate through all available content of the specified type, locate and return the version with the highest
@@ -1051,9 +1946,78 @@ class Panoply:
 
             time.sleep(interval)
 
+    def get_job_status(self, job_id: str, job_xapi: Optional[xapi.PanXapi] = None) -> dict:
+        """
+        Query the device once for the current status of the given job id
+
+        :param job_id: id of the job to check
+        :param job_xapi: optional PanXapi instance to use for the request, useful when polling from another thread
+        :return: dict containing the following keys:
+            * status - job status, for example 'ACT', 'PEND', or 'FIN'
+            * result - job result, for example 'PEND', 'OK', or 'FAIL'
+            * progress - job progress as reported by the device
+            * details - any detail messages reported for this job
+        """
+
+        if job_xapi is None:
+            job_xapi = self.xapi
+
+        try:
+            job_xapi.op(cmd=f'<show><jobs><id>{job_id}</id></jobs></show>')
+
+        except PanXapiError as pxe:
+            raise PanoplyException(f'Could not get status of job {job_id}: {pxe}')
+
+        job_status = {
+            'status': '',
+            'result': '',
+            'progress': '',
+            'details': ''
+        }
+
+        if job_xapi.element_result is None:
+            return job_status
+
+        job_element = job_xapi.element_result.find('.//job')
+
+        if job_element is None:
+            return job_status
+
+        for k in ('status', 'result', 'progress'):
+            el = job_element.find(f'./{k}')
+
+            if el is not None and el.text is not None:
+                job_status[k] = el.text.strip()
+
+        details = [line.text.strip() for line in job_element.findall('./details/line') if line.text]
+        job_status['details'] = '\n'.join(details)
+
+        return job_status
+
+    def wait_for_jobs(self, job_ids: List[str], timeout=600) -> bool:
+        """
+        Wait for all of the given job ids on this device to complete. All jobs are tracked together, so this will
+        return as soon as the slowest job has finished.
+
+        :param job_ids: list of job ids to wait for
+        :param timeout: how long to wait for each job before we give up
+        :return: bool True if all jobs completed successfully, False otherwise
+        """
+        from .jobs import JobTracker
+
+        tracker = JobTracker(timeout=timeout)
+
+        for job_id in job_ids:
+            tracker.add_job(self, job_id)
+
+        results = tracker.wait()
+
+        return all(r['success'] for r in results.values())
+
     def get_configuration(self, config_source='running') -> str:
         """
-        Get the configuration from the device.
+        Get the configuration from the device. In offline mode, this returns the offline configuration including any
+        changes applied to it.
 
         :return: configuration xml as a string or a blank string if not connected
         """
@@ -1061,6 +2025,9 @@ class Panoply:
         if config_source == 'baseline':
             return self.generate_baseline()
 
+        if self.offline_config is not None and not self.connected:
+            return self.offline_config.to_xml()
+
         elif config_source == 'candidate':
             cmd = 'show config candidate'
 
@@ -1070,8 +2037,14 @@ class Panoply:
         try:
 
             if self.connected:
+                generation = self.__config_generation
                 self.xapi.op(cmd=cmd, cmd_xml=True)
-                return self.xapi.xml_result()
+                config = self.xapi.xml_result()
+
+                if config_source == 'running' and config is not None:
+                    self.__retrieved_config = (generation, config)
+
+                return config
 
             else:
                 return ''
@@ -1080,11 +2053,13 @@ class Panoply:
             logger.error('Could not get configuration from device')
             raise PanoplyException('Could not get configuration from the device')
 
-    def get_saved_configuration(self, configuration_name: str) -> str:
+    def get_saved_configuration(self, configuration_name: str, pretty_print: bool = True) -> str:
         """
         Returns a saved configuration on the device. Use 'list_saved_configuration' to get a list of available options
 
         :param configuration_name: name of the saved configuration to export
+        :param pretty_print: re-format the configuration with indentation. Set to False to return the document as
+        received from the device, which is much faster for large configurations
         :return: configuration as an XML encoded string
         """
 
@@ -1098,6 +2073,9 @@ class Panoply:
 
                 doc_str = self.xapi.xml_result()
 
+                if not pretty_print:
+                    return doc_str
+
                 doc = etree.fromstring(doc_str)
                 return etree.tostring(doc, pretty_print=True).decode(encoding='UTF-8')
 
@@ -1108,6 +2086,108 @@ class Panoply:
             logger.error('Could not get saved configuration from device')
             raise PanoplyException('Could not get saved configuration from the device')
 
+    def export_configuration(self, destination: (str, Path, IO[bytes]), configuration_name: Optional[str] = None,
+                             chunk_size: int = 1024 * 1024) -> int:
+        """
+        Export a configuration from the device and stream it directly to a file or file-like object. The response is
+        written to the destination as it is received and never held in memory or re-serialized, which makes this the
+        preferred way to retrieve large configurations.
+
+        .. code-block:: python
+
+            p.export_configuration('running-config.xml')
+            results = skillet.execute({'config_file': 'running-config.xml'})
+
+        :param destination: path of the file to write, or a binary file-like object. Files are written to a temporary
+        file first and then moved into place, so a failed export never leaves a partial file behind
+        :param configuration_name: name of a saved configuration to export. Defaults to the running configuration
+        :param chunk_size: number of bytes to read from the device at once
+        :return: number of bytes written
+        """
+
+        if not self.connected:
+            raise PanoplyException('Not connected to a device')
+
+        params = {
+            'type': 'export',
+            'category': 'configuration',
+            'key': self.key
+        }
+
+        if configuration_name is not None:
+            params['from'] = configuration_name
+
+        if self.serial_number is not None:
+            params['target'] = self.serial_number
+
+        if hasattr(destination, 'write'):
+            return self.__stream_export(params, destination, chunk_size)
+
+        path = Path(destination)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent.absolute()), prefix=f'.{path.name}.')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                written = self.__stream_export(params, f, chunk_size)
+
+            os.replace(tmp_path, str(path))
+            return written
+
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def __stream_export(self, params: dict, output: IO[bytes], chunk_size: int) -> int:
+        """
+        Send the export request and copy the response body to output
+
+        :param params: query parameters of the export request
+        :param output: binary file-like object to write to
+        :param chunk_size: number of bytes to read at once
+        :return: number of bytes written
+        """
+        limiter = get_limiter(self.hostname, self.port)
+        limiter.acquire()
+
+        start = time.monotonic()
+        error = None
+        written = 0
+
+        try:
+            r = self.get_session().get(
+                f'{"http" if self.use_http else "https"}://{self.hostname}:{self.port}/api/',
+                verify=False,
+                params=params,
+                stream=True,
+            )
+
+            with r:
+
+                if r.status_code >= 400:
+                    error = f'code: {r.status_code} reason: {r.reason}'
+                    raise PanoplyException(f'Could not export configuration: {error}')
+
+                chunks = r.iter_content(chunk_size=chunk_size)
+
+                for chunk in chunks:
+
+                    if written == 0 and chunk.lstrip().startswith(b'<response') and b'status="error"' in chunk:
+                        # errors are returned as a normal api response rather than the exported file
+                        error = b''.join([chunk, *chunks]).decode('UTF-8', errors='replace')
+                        raise PanoplyException(f'Could not export configuration: {error}')
+
+                    output.write(chunk)
+                    written += len(chunk)
+
+            return written
+
+        except requests.exceptions.RequestException as re:
+            error = str(re)
+            raise PanoplyException(f'Could not export configuration: {re}')
+
+        finally:
+            limiter.release(time.monotonic() - start, error)
+
     def list_saved_configurations(self) -> list:
         """
         Returns a list of saved configuration files on this device
@@ -1889,9 +2969,9 @@ class Panos(Panoply):
 
     def __init__(self, hostname: Optional[str], api_username: Optional[str], api_password: Optional[str],
                  api_port: Optional[int] = 443, serial_number: Optional[str] = None,
-                 debug: Optional[bool] = False, api_key: Optional[str] = None):
+                 debug: Optional[bool] = False, api_key: Optional[str] = None, use_http: Optional[bool] = False):
 
-        super().__init__(hostname, api_username, api_password, api_port, serial_number, debug, api_key)
+        super().__init__(hostname, api_username, api_password, api_port, serial_number, debug, api_key, use_http)
 
         if self.connected:
             return
@@ -17,12 +17,27 @@
 import logging
 import os
 import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Optional
 
 from git import Repo
+from git.cmd import Git as GitCommand
 from git.exc import GitCommandError
 
 from skilletlib.exceptions import SkilletLoaderException
 
+try:
+    import fcntl
+
+except ImportError:
+    # file locking is not available on this platform
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,29 +45,41 @@ class Git:
     """
     Git remote
     This class provides an interface to Github repositories containing Skillets or XML snippets.
+
+    Repositories are cloned with only the most recent commit of the requested branch by default. When sparse is
+    enabled, file contents are only fetched for the directories that contain skillets or the snippet files they
+    reference. Before updating an existing
+    clone, the remote is queried with 'ls-remote' and nothing is fetched if the branch has not changed. The store may
+    be shared by multiple processes, each clone is locked while it is being created or updated.
     """
 
-    def __init__(self, repo_url, store=os.getcwd()):
+    def __init__(self, repo_url, store=os.getcwd(), depth: Optional[int] = 1, sparse: bool = False):
         """
         Initialize a new Git repo object
         :param repo_url: URL path to repository.
         :param store: Directory to store repository in. Defaults to the current directory.
+        :param depth: number of commits to fetch, or None to fetch the complete history
+        :param sparse: only checkout the directories containing skillets or their snippet files, and only fetch the
+        files within them
         """
 
         if not self.check_git_exists():
             raise SkilletLoaderException('A git client must be installed to use this remote!')
 
         self.repo_url = repo_url
-        self.store = store
+        self.store = os.path.expanduser(store)
+        self.depth = depth
+        self.sparse = sparse
         self.Repo = None
         self.name = ''
         self.path = ''
         self.update = ''
 
-    def clone(self, name: str) -> str:
+    def clone(self, name: str, branch_name: Optional[str] = None) -> str:
         """
-        Clone a remote directory into the store.
+        Clone a remote directory into the store, or update the existing clone if the remote has changed.
         :param name: Name of repository
+        :param branch_name: Branch to checkout, defaults to the default branch of the remote
         :return: (string): Path to cloned repository
         """
         if not name:
@@ -62,65 +89,509 @@ class Git:
         path = self.store + os.sep + name
         self.path = path
 
-        if os.path.exists(path):
-            self.Repo = Repo(path)
+        with self.__lock():
+
+            if self.__open_existing():
+                logger.debug("Updating repository...")
+                self.__update(branch_name)
+
+            else:
+                self.__clone(branch_name)
+
+        return path
+
+    def fetch(self, name: str, branch_name: Optional[str] = None) -> str:
+        """
+        Fetch the given branch, tag, or commit into the store without changing the working tree, i.e. to read the
+        skillets of that commit using a GitTree. Nothing is fetched if the commit is already found locally.
+        :param name: Name of repository
+        :param branch_name: Branch, tag, or commit, defaults to the default branch of the remote
+        :return: commit sha
+        """
+        if not name:
+            raise ValueError("Missing or bad name passed to Fetch command.")
+
+        self.name = name
+        self.path = self.store + os.sep + name
+
+        with self.__lock():
 
-            # FIX for #56
-            if self.repo_url not in self.Repo.remotes.origin.urls:
-                logger.info('Found new remote URL for this named repo')
+            if not self.__open_existing():
+                self.__clone(branch_name, checkout=False)
 
-                try:
-                    # only recourse is to remove the .git directory
-                    if os.path.exists(os.path.join(path, '.git')):
-                        shutil.rmtree(path)
+            remote_commit, ref_name = self.__ls_remote(branch_name)
+            commit = remote_commit if remote_commit is not None else branch_name
 
-                    else:
-                        raise SkilletLoaderException('Refusing to remove non-git directory')
+            if commit and self.__local_commit(commit) is not None:
+                return self.__local_commit(commit)
 
-                except OSError:
-                    raise SkilletLoaderException('Repo directory exists!')
+            fetch_args = ['origin']
 
-                logger.debug("Cloning into {}".format(path))
+            if self.depth and self.Repo.git.rev_parse('--is-shallow-repository') == 'true':
+                fetch_args.append(f'--depth={self.depth}')
 
-                try:
-                    self.Repo = Repo.clone_from(self.repo_url, path)
+            if ref_name is not None and ref_name.startswith('refs/heads/'):
+                fetch_args.append(f'+{ref_name}:refs/remotes/origin/{branch_name}')
 
-                except GitCommandError as gce:
-                    raise SkilletLoaderException(f'Could not clone repository {gce}')
+            elif ref_name is not None and ref_name.startswith('refs/tags/'):
+                fetch_args.append(f'+{ref_name}:{ref_name}')
 
             else:
-                logger.debug("Updating repository...")
+                fetch_args.append(branch_name if branch_name else 'HEAD')
 
-                try:
-                    self.Repo.remotes.origin.pull()
+            try:
+                self.Repo.git.fetch(*fetch_args)
+                return self.Repo.git.rev_parse('FETCH_HEAD^{commit}')
 
-                except GitCommandError as gce:
-                    logger.error('Could not clone repository!')
-                    raise SkilletLoaderException(f'Error Cloning repository {gce}')
+            except GitCommandError as gce:
+                raise SkilletLoaderException(f'Could not fetch {branch_name} from repository {gce}')
 
-            return path
+    def __open_existing(self) -> bool:
+        """
+        Open the existing clone in the store, removing it if it was cloned from a different URL
 
-        else:
-            logger.debug("Cloning into {}".format(path))
-            self.Repo = Repo.clone_from(self.repo_url, path)
+        :return: bool True if the existing clone may be used
+        """
+        if not os.path.exists(self.path):
+            return False
 
-        self.path = path
-        return path
+        self.Repo = Repo(self.path)
+
+        # FIX for #56
+        if self.repo_url in self.Repo.remotes.origin.urls:
+            return True
+
+        logger.info('Found new remote URL for this named repo')
+
+        try:
+            # only recourse is to remove the .git directory
+            if os.path.exists(os.path.join(self.path, '.git')):
+                shutil.rmtree(self.path)
+
+            else:
+                raise SkilletLoaderException('Refusing to remove non-git directory')
+
+        except OSError:
+            raise SkilletLoaderException('Repo directory exists!')
+
+        self.Repo = None
+        return False
 
     def branch(self, branch_name: str) -> None:
         """
-        Checkout the specified branch.
+        Checkout the specified branch, fetching it from the remote if it is not found locally, or if update is set and
+        the branch has changed on the remote.
         :param branch_name: Branch to checkout.
         :return: None
         """
         logger.debug("Checking out: " + branch_name)
 
-        if self.update:
-            logger.debug("Updating branch.")
-            self.Repo.remotes.origin.pull()
+        with self.__lock():
+
+            if self.update or self.__local_commit(branch_name) is None:
+                logger.debug("Updating branch.")
+                self.__update(branch_name)
+
+            else:
+                self.__checkout(branch_name)
+
+    def remote_commit(self, branch_name: Optional[str] = None) -> Optional[str]:
+        """
+        Query the remote for the commit at the head of the given branch or tag without fetching anything
+        :param branch_name: Branch or tag name, defaults to the default branch of the remote
+        :return: commit sha or None if the branch is not found on the remote
+        """
+        return self.__ls_remote(branch_name)[0]
+
+    def __ls_remote(self, branch_name: Optional[str]) -> tuple:
+        """
+        Returns the commit sha and full ref name of the given branch or tag on the remote, or None, None if not found
+        """
+        ref = branch_name if branch_name else 'HEAD'
+        git_cmd = self.Repo.git if self.Repo is not None else GitCommand()
+
+        try:
+            output = git_cmd.ls_remote(self.repo_url, ref)
+
+        except GitCommandError as gce:
+            raise SkilletLoaderException(f'Could not query remote repository {gce}')
+
+        refs = dict(reversed(line.split('\t', 1)) for line in output.splitlines() if '\t' in line)
+
+        # annotated tags are peeled to the commit they point to
+        for candidate, ref_name in ((ref, ref), (f'refs/heads/{ref}', f'refs/heads/{ref}'),
+                                    (f'refs/tags/{ref}^{{}}', f'refs/tags/{ref}'),
+                                    (f'refs/tags/{ref}', f'refs/tags/{ref}')):
+
+            if candidate in refs:
+                return refs[candidate], ref_name
+
+        return None, None
+
+    def __clone(self, branch_name: Optional[str], checkout: bool = True) -> None:
+        """
+        Clone the repository into self.path, fetching only the requested depth of history
+        """
+        logger.debug("Cloning into {}".format(self.path))
+
+        kwargs = dict()
+
+        if self.depth:
+            kwargs['depth'] = self.depth
+
+        # clone can only checkout branches and tags, anything else is fetched once the clone is complete
+        checkout_after_clone = branch_name and self.__ls_remote(branch_name)[1] is None
+
+        if branch_name and not checkout_after_clone:
+            kwargs['branch'] = branch_name
+
+        if self.sparse and checkout:
+            # file contents are fetched on demand during checkout so only those in the skillet dirs are downloaded
+            kwargs['filter'] = 'blob:none'
+
+        if self.sparse or not checkout:
+            kwargs['no_checkout'] = True
+
+        try:
+            self.Repo = Repo.clone_from(self.repo_url, self.path, **kwargs)
+
+            if self.sparse and checkout:
+                self.__prepare_worktree('HEAD')
+                self.Repo.git.checkout()
+
+        except GitCommandError as gce:
+            raise SkilletLoaderException(f'Could not clone repository {gce}')
+
+        if checkout_after_clone and checkout:
+            self.__update(branch_name)
+
+    def __update(self, branch_name: Optional[str]) -> None:
+        """
+        Fetch and checkout the given branch, tag, or commit. Nothing is fetched if it has not changed on the remote.
+        """
+        remote_commit, ref_name = self.__ls_remote(branch_name)
+        local_ref = branch_name if branch_name else 'HEAD'
+
+        if ref_name is not None and ref_name != 'HEAD':
+            local_ref = ref_name
+
+        if self.__local_commit(local_ref) is not None and self.__local_commit(local_ref) == remote_commit:
+            logger.debug(f'Remote has not changed, skipping fetch of {self.name}')
+            self.__checkout(branch_name)
+            return
+
+        fetch_args = ['origin']
+
+        if self.depth and self.Repo.git.rev_parse('--is-shallow-repository') == 'true':
+            fetch_args.append(f'--depth={self.depth}')
+
+        try:
+            if ref_name is not None and ref_name.startswith('refs/heads/'):
+                self.Repo.git.fetch(*fetch_args, f'+{ref_name}:refs/remotes/origin/{branch_name}')
+                self.__prepare_worktree(f'origin/{branch_name}')
+                self.Repo.git.checkout('--force', '-B', branch_name, f'origin/{branch_name}')
+
+            elif ref_name is not None and ref_name.startswith('refs/tags/'):
+                self.Repo.git.fetch(*fetch_args, f'+{ref_name}:{ref_name}')
+                self.__prepare_worktree(ref_name)
+                self.Repo.git.checkout('--force', '--detach', ref_name)
+
+            elif branch_name:
+                # most likely a commit sha, which is only fetched when not found locally
+                if self.__local_commit(branch_name) is None:
+                    self.Repo.git.fetch(*fetch_args, branch_name)
+
+                self.__checkout(branch_name)
+
+            else:
+                self.Repo.git.fetch(*fetch_args, 'HEAD')
+                self.__prepare_worktree('FETCH_HEAD')
+                self.Repo.git.reset('--hard', 'FETCH_HEAD')
+
+        except GitCommandError as gce:
+            logger.error('Could not update repository!')
+            raise SkilletLoaderException(f'Error updating repository {gce}')
+
+    def __checkout(self, branch_name: Optional[str]) -> None:
+        """
+        Checkout a branch, tag, or commit that has already been fetched
+        """
+        if not branch_name or branch_name == self.__current_branch():
+            return
+
+        try:
+            if self.__local_commit(f'refs/heads/{branch_name}') is None and \
+                    self.__local_commit(f'refs/remotes/origin/{branch_name}') is not None:
+                self.__prepare_worktree(f'origin/{branch_name}')
+                self.Repo.git.checkout('-B', branch_name, f'origin/{branch_name}')
+
+            else:
+                self.__prepare_worktree(branch_name)
+                self.Repo.git.checkout(branch_name)
+
+        except GitCommandError as gce:
+            raise SkilletLoaderException(f'Could not checkout branch {branch_name}: {gce}')
+
+    def __prepare_worktree(self, tree_ish: str) -> None:
+        """
+        Limit the working tree to the directories containing skillets or their snippet files in the given commit when
+        sparse is enabled, or restore the full working tree of a clone that was previously sparse
+        """
+        if not self.sparse:
+
+            if self.Repo.config_reader().get_value('core', 'sparseCheckout', False):
+                self.Repo.git.sparse_checkout('disable')
+
+            return
+
+        skillet_dirs = find_skillet_dirs(self.Repo, tree_ish)
+
+        if skillet_dirs == ['']:
+            # a skillet at the root of the repository requires every file
+            self.Repo.git.sparse_checkout('disable')
+            return
+
+        # snippet files may be shared between skillets, i.e. 'file: ../common/snippet.xml'
+        snippet_dirs = [d for d in find_snippet_dirs(self.Repo, tree_ish) if d not in skillet_dirs]
+
+        logger.debug(f'Using sparse checkout for {len(skillet_dirs)} skillet dirs and {len(snippet_dirs)} snippet dirs')
+        self.Repo.git.sparse_checkout('init', '--cone')
+        self.Repo.git.sparse_checkout('set', *skillet_dirs, *snippet_dirs)
 
-        self.Repo.git.checkout(branch_name)
+    def __local_commit(self, ref: str) -> Optional[str]:
+        try:
+            return self.Repo.git.rev_parse('--verify', '--quiet', f'{ref}^{{commit}}')
+
+        except GitCommandError:
+            return None
+
+    def __current_branch(self) -> Optional[str]:
+        try:
+            return self.Repo.active_branch.name
+
+        except TypeError:
+            # detached HEAD
+            return None
+
+    @contextmanager
+    def __lock(self) -> Generator[None, None, None]:
+        """
+        Hold an exclusive lock on this clone so it may be shared by multiple processes
+        """
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(self.store, exist_ok=True)
+
+        with open(os.path.join(self.store, f'.{self.name}.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                yield
+
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
     @staticmethod
     def check_git_exists():
         return shutil.which("git")
+
+
+class GitTree:
+    """
+    GitTree provides read only access to the files of a single commit directly from the git object database, so
+    skillets may be loaded from any branch or tag without checking it out. Many GitTrees may be used concurrently,
+    even for the same repository.
+
+    Files are addressed using paths below a virtual root, which includes the commit id and does not exist on disk.
+    """
+
+    def __init__(self, repo_path: str, ref: str = 'HEAD'):
+        """
+        Initialize a new GitTree
+
+        :param repo_path: path to a local clone or bare repository
+        :param ref: branch, tag, or commit to read
+        """
+        try:
+            self.repo = Repo(repo_path)
+            self.commit = self.repo.commit(ref).hexsha
+            output = self.repo.git.ls_tree('-r', '-z', '--full-tree', self.commit)
+
+        except (GitCommandError, ValueError) as e:
+            raise SkilletLoaderException(f'Could not read {ref} from repository {repo_path}: {e}')
+
+        self.ref = ref
+        self.root = os.path.join(os.path.realpath(self.repo.git_dir), 'skilletlib-trees', self.commit)
+
+        # relative path to blob id of every regular file in the commit
+        self.blobs = dict()
+
+        for entry in output.split('\0'):
+
+            if not entry:
+                continue
+
+            info, path = entry.split('\t', 1)
+            mode, object_type, sha = info.split()
+
+            if object_type == 'blob' and mode != '120000':
+                self.blobs[path] = sha
+
+        self._lock = threading.Lock()
+
+    def metadata_files(self) -> List[str]:
+        """
+        Returns the path of every skillet metadata file in this commit below the virtual root
+
+        :return: list of metadata file paths
+        """
+        return [os.path.join(self.root, *f.split('/')) for f in find_metadata_paths(self.blobs)]
+
+    def contains(self, path: (str, Path)) -> bool:
+        """
+        Determine if the path is below the virtual root of this tree
+
+        :param path: absolute path
+        :return: bool True if the path is within this tree
+        """
+        return str(path).startswith(self.root + os.sep)
+
+    def exists(self, path: (str, Path)) -> bool:
+        """
+        Determine if a file exists in this tree
+
+        :param path: absolute path below the virtual root
+        :return: bool True if the file exists
+        """
+        return self.blob_id(path) is not None
+
+    def blob_id(self, path: (str, Path)) -> Optional[str]:
+        """
+        Returns the git object id of a file in this tree
+
+        :param path: absolute path below the virtual root
+        :return: blob id or None if the file is not found
+        """
+        if not self.contains(path):
+            return None
+
+        relative = os.path.relpath(os.path.normpath(str(path)), self.root)
+        return self.blobs.get(relative.replace(os.sep, '/'), None)
+
+    def read(self, path: (str, Path)) -> str:
+        """
+        Read the contents of a file in this tree
+
+        :param path: absolute path below the virtual root
+        :return: contents of the file
+        """
+        blob_id = self.blob_id(path)
+
+        if blob_id is None:
+            raise FileNotFoundError(f'{path} not found in {self.ref}')
+
+        # the object database reads from a single git process
+        with self._lock:
+            contents = self.repo.odb.stream(bytes.fromhex(blob_id)).read()
+
+        # the same newline handling as reading the file in text mode
+        return contents.decode('UTF-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    def close(self) -> None:
+        """
+        Stop any git processes used to read this tree
+
+        :return: None
+        """
+        self.repo.close()
+
+
+def find_metadata_paths(paths: Iterable[str]) -> List[str]:
+    """
+    Returns the skillet metadata files from the given list of file paths relative to the root of a repository. As
+    when loading skillets from a directory, skillets nested below another skillet and those within '.git', '.venv',
+    and '.terraform' dirs are skipped.
+
+    :param paths: relative file paths using '/' as separator
+    :return: sorted list of metadata file paths
+    """
+    skillet_dirs = set()
+    found = list()
+
+    # shallower skillets are found first so nested skillets can be skipped
+    for parts in sorted((p.split('/') for p in paths), key=lambda p: (len(p), p)):
+
+        if not parts[-1].startswith('.meta-cnc.y'):
+            continue
+
+        if any('.git' in d or '.venv' in d or '.terraform' in d for d in parts[:-1]):
+            continue
+
+        skillet_dir = tuple(parts[:-1])
+
+        if any(skillet_dir[:i] in skillet_dirs for i in range(len(skillet_dir))):
+            continue
+
+        skillet_dirs.add(skillet_dir)
+        found.append('/'.join(parts))
+
+    return sorted(found)
+
+
+def find_skillet_dirs(repo: Repo, tree_ish: str = 'HEAD') -> List[str]:
+    """
+    Returns the directories of the given commit that contain a skillet, using only the trees of the commit so no file
+    contents need to be fetched.
+
+    :param repo: Repo to search
+    :param tree_ish: commit, branch, or tag name
+    :return: list of directory paths relative to the root of the repository, [''] for a skillet at the root
+    """
+    files = repo.git.ls_tree('-r', '--name-only', tree_ish).splitlines()
+    skillet_dirs = list()
+
+    for f in find_metadata_paths(files):
+        skillet_dir = f.rpartition('/')[0]
+
+        if not skillet_dir:
+            return ['']
+
+        if skillet_dir not in skillet_dirs:
+            skillet_dirs.append(skillet_dir)
+
+    return skillet_dirs
+
+
+def find_snippet_dirs(repo: Repo, tree_ish: str = 'HEAD') -> List[str]:
+    """
+    Returns the directories of the given commit that contain snippet files referenced by a skillet. Only the skillet
+    metadata files are read to find them.
+
+    :param repo: Repo to search
+    :param tree_ish: commit, branch, or tag name
+    :return: sorted list of directory paths relative to the root of the repository
+    """
+    from skilletlib.skilletLoader import _parse_metadata
+    from skilletlib.skilletLoader import _referenced_files
+
+    root = os.path.realpath(repo.working_tree_dir)
+    files = repo.git.ls_tree('-r', '--name-only', tree_ish).splitlines()
+    snippet_dirs = set()
+
+    for f in find_metadata_paths(files):
+        skillet_dict, error = _parse_metadata(repo.git.show(f'{tree_ish}:{f}'), os.path.join(root, *f.split('/')))
+
+        if error is not None:
+            # reported when the skillets are loaded
+            continue
+
+        for snippet_file in _referenced_files(skillet_dict):
+            snippet_dir = os.path.relpath(os.path.dirname(snippet_file), root)
+
+            # files at the root are always included, and those outside the repository can not be checked out
+            if snippet_dir != '.' and not snippet_dir.startswith('..'):
+                snippet_dirs.add(snippet_dir.replace(os.sep, '/'))
+
+    return sorted(snippet_dirs)
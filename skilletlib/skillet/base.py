@@ -29,6 +29,8 @@ from typing import List
 import yaml
 from yaml.scanner import ScannerError
 
+from skilletlib.cache import file_exists
+from skilletlib.cache import read_file
 from skilletlib.exceptions import SkilletLoaderException
 from skilletlib.exceptions import SkilletValidationException
 from skilletlib.snippet.base import Snippet
@@ -64,7 +66,7 @@ class Skillet(ABC):
         self.snippet_stack = self.skillet_dict['snippets']
         self.type = self.skillet_dict['type']
         self.supported_versions = 'not implemented'
-        self.variables = self.__initialize_variables(s['variables'])
+        self.variables = initialize_variables(s['variables'])
         # path is needed only when snippets are held in a relative file path
         self.path = self.skillet_dict.get('snippet_path', '')
         self.labels = self.skillet_dict['labels']
@@ -113,9 +115,8 @@ class Skillet(ABC):
         skillet_path = Path(self.path)
         template_file = skillet_path.joinpath(template_path).resolve()
 
-        if template_file.exists():
-            with template_file.open() as sf:
-                return html.unescape(sf.read())
+        if file_exists(template_file):
+            return html.unescape(read_file(template_file))
 
         else:
             # Add the snippet name here as well to allow for more context
@@ -152,39 +153,6 @@ class Skillet(ABC):
         self.update_context(initial_context)
         return self.context
 
-    @staticmethod
-    def __initialize_variables(vars_dict: dict) -> dict:
-        """
-        Ensure the proper default values are configured for each type of variable that may be present in the skillet
-
-        :param vars_dict: Skillet 'variables' stanza
-        :return: variables stanza with default values correctly parsed
-        """
-
-        for variable in vars_dict:
-            default = variable.get('default', '')
-            type_hint = variable.get('type_hint', 'text')
-            if type_hint == "dropdown" and "dd_list" in variable:
-                for item in variable.get('dd_list', []):
-                    if 'key' in item and 'value' in item:
-                        if default == item['key'] and default != item['value']:
-                            # user set the key as the default and not the value, just fix it for them here
-                            variable['default'] = item['value']
-            elif type_hint == "radio" and "rad_list" in variable:
-                rad_list = variable['rad_list']
-                for item in rad_list:
-                    if 'key' in item and 'value' in item:
-                        if default == item['key'] and default != item['value']:
-                            variable['default'] = item['value']
-            elif type_hint == "checkbox" and "cbx_list" in variable:
-                cbx_list = variable['cbx_list']
-                for item in cbx_list:
-                    if 'key' in item and 'value' in item:
-                        if default == item['key'] and default != item['value']:
-                            variable['default'] = item['value']
-
-        return vars_dict
-
     def cleanup(self):
         pass
 
@@ -228,17 +196,7 @@ class Skillet(ABC):
                             output = full_output
 
                         # capture all outputs
-                        snippet_outputs = snippet.get_default_output(output, status)
-                        captured_outputs = snippet.capture_outputs(output, status)
-
-                        if captured_outputs:
-                            logger.debug(f'{snippet.name} - captured_outputs: {captured_outputs}')
-
-                        self.snippet_outputs.update(snippet_outputs)
-                        self.captured_outputs.update(captured_outputs)
-
-                        context.update(snippet_outputs)
-                        context.update(captured_outputs)
+                        self._capture_snippet_outputs(snippet, output, status, context)
 
                 except SkilletLoaderException as sle:
                     logger.error(f'Caught Exception during execution: {sle}')
@@ -297,17 +255,7 @@ class Skillet(ABC):
                                 raise SkilletLoaderException('Snippet took too long to execute!')
 
                         # capture all outputs
-                        snippet_outputs = snippet.get_default_output(output, status)
-                        captured_outputs = snippet.capture_outputs(output, status)
-
-                        if captured_outputs:
-                            logger.debug(f'{snippet.name} - captured_outputs: {captured_outputs}')
-
-                        self.snippet_outputs.update(snippet_outputs)
-                        self.captured_outputs.update(captured_outputs)
-
-                        context.update(snippet_outputs)
-                        context.update(captured_outputs)
+                        self._capture_snippet_outputs(snippet, output, status, context)
 
                 except SkilletLoaderException as sle:
                     logger.error(f'Caught Exception during execution: {sle}')
@@ -325,6 +273,29 @@ class Skillet(ABC):
 
         return self.get_results()
 
+    def _capture_snippet_outputs(self, snippet: Snippet, output: str, status: str, context: dict) -> None:
+        """
+        Capture the default output and any defined outputs from a snippet execution. These are stored on this skillet
+        and also added to the context for use in subsequent snippets
+
+        :param snippet: Snippet that has been executed
+        :param output: raw output from the snippet execution
+        :param status: status of the snippet execution
+        :param context: the current execution context to update
+        :return: None
+        """
+        snippet_outputs = snippet.get_default_output(output, status)
+        captured_outputs = snippet.capture_outputs(output, status)
+
+        if captured_outputs:
+            logger.debug(f'{snippet.name} - captured_outputs: {captured_outputs}')
+
+        self.snippet_outputs.update(snippet_outputs)
+        self.captured_outputs.update(captured_outputs)
+
+        context.update(snippet_outputs)
+        context.update(captured_outputs)
+
     def get_results(self) -> dict:
         """
         Returns the results from the skillet execution. This must be called manually if using 'execute_async'. The
@@ -502,3 +473,36 @@ class Skillet(ABC):
 
         except (ScannerError, ValueError) as err:
             raise SkilletValidationException(f'Could not dump Skillet as YAML: {err}')
+
+
+def initialize_variables(vars_dict: dict) -> dict:
+    """
+    Ensure the proper default values are configured for each type of variable that may be present in the skillet
+
+    :param vars_dict: Skillet 'variables' stanza
+    :return: variables stanza with default values correctly parsed
+    """
+
+    for variable in vars_dict:
+        default = variable.get('default', '')
+        type_hint = variable.get('type_hint', 'text')
+        if type_hint == "dropdown" and "dd_list" in variable:
+            for item in variable.get('dd_list', []):
+                if 'key' in item and 'value' in item:
+                    if default == item['key'] and default != item['value']:
+                        # user set the key as the default and not the value, just fix it for them here
+                        variable['default'] = item['value']
+        elif type_hint == "radio" and "rad_list" in variable:
+            rad_list = variable['rad_list']
+            for item in rad_list:
+                if 'key' in item and 'value' in item:
+                    if default == item['key'] and default != item['value']:
+                        variable['default'] = item['value']
+        elif type_hint == "checkbox" and "cbx_list" in variable:
+            cbx_list = variable['cbx_list']
+            for item in cbx_list:
+                if 'key' in item and 'value' in item:
+                    if default == item['key'] and default != item['value']:
+                        variable['default'] = item['value']
+
+    return vars_dict
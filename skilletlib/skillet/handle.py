@@ -0,0 +1,106 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+import logging
+import threading
+from typing import Callable
+
+from .base import Skillet
+from .base import initialize_variables
+
+logger = logging.getLogger(__name__)
+
+# attributes that are available directly from the skillet metadata without creating the Skillet
+_metadata_attributes = {'skillet_dict', 'name', 'label', 'description', 'type', 'path', 'labels', 'collections',
+                        'variables'}
+
+
+class SkilletHandle:
+    """
+    SkilletHandle is a lightweight stand-in for a Skillet that exposes the metadata of the skillet, such as the name,
+    label, type, labels, and variables, directly from the skillet dict. The Skillet itself, including all of its
+    snippets and their template environments, is only created the first time any other attribute or method is used,
+    for example 'get_snippets', 'execute', or 'declared_variables'.
+
+    This allows applications to list many skillets cheaply and only pay the cost of building the ones that are
+    actually used. Any error creating the Skillet is raised on first use rather than while loading.
+    """
+
+    def __init__(self, skillet_dict: dict, factory: Callable[[dict], Skillet]):
+        """
+        Initialize a new SkilletHandle
+
+        :param skillet_dict: normalized skillet dict as loaded from the .meta-cnc.yaml file
+        :param factory: function that creates the Skillet from the skillet dict, i.e. SkilletLoader.create_skillet
+        """
+        self.skillet_dict = skillet_dict
+        self.name = skillet_dict.get('name', 'Unknown Skillet')
+        self.label = skillet_dict.get('label', 'Unknown Skillet')
+        self.description = skillet_dict.get('description', 'Unknown Skillet')
+        self.type = skillet_dict.get('type', 'template')
+        self.path = skillet_dict.get('snippet_path', '')
+        self.labels = skillet_dict.get('labels', dict())
+        self.collections = self.labels.get('collection', list())
+        self.variables = initialize_variables(skillet_dict.get('variables', list()))
+
+        self._factory = factory
+        self._skillet = None
+        self._lock = threading.Lock()
+
+    @property
+    def skillet(self) -> Skillet:
+        """
+        Returns the Skillet, creating it if necessary
+
+        :return: Skillet of the correct type
+        """
+
+        if self._skillet is None:
+
+            with self._lock:
+
+                if self._skillet is None:
+                    logger.debug(f'Creating skillet {self.name} on first use')
+                    self._skillet = self._factory(self.skillet_dict)
+
+        return self._skillet
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Determine if the Skillet has already been created
+
+        :return: bool True if the Skillet has been created
+        """
+        return self._skillet is not None
+
+    def __setattr__(self, key, value):
+        # metadata and internal attributes live on the handle, anything else is set on the Skillet
+        if key.startswith('_') or key in _metadata_attributes:
+            object.__setattr__(self, key, value)
+
+        else:
+            setattr(self.skillet, key, value)
+
+    def __getattr__(self, item):
+        # only called for attributes not found on the handle itself
+        if item.startswith('__') or item in ('_skillet', '_factory', '_lock'):
+            raise AttributeError(item)
+
+        return getattr(self.skillet, item)
+
+    def __repr__(self):
+        return f'<SkilletHandle {self.name} type: {self.type} loaded: {self.loaded}>'
@@ -16,20 +16,101 @@
 
 import html
 import logging
+from collections import UserString
 from pathlib import Path
+from typing import Any
+from typing import Callable
 from typing import List
 from typing import Optional
+from typing import Union
 
 import skilletlib
+from skilletlib.cache import file_exists
+from skilletlib.cache import read_file
 from skilletlib.panoply import Panoply
 from skilletlib.snippet.panos import PanosSnippet
 from .base import Skillet
+from ..exceptions import PanoplyException
 from ..exceptions import SkilletLoaderException
 from ..exceptions import SkilletValidationException
 
 logger = logging.getLogger(__name__)
 
 
+class LazyConfig(UserString):
+    """
+    LazyConfig is a str like object that defers retrieving the configuration from the device until the first time it
+    is actually used. Once resolved, the configuration is cached for the lifetime of this object, which is a single
+    skillet execution. Skillets that never reference the 'config' variable, for example those that only contain 'op'
+    or 'set' snippets, will never download the configuration at all.
+
+    Any access that requires the value, such as str(), len(), 'in', or rendering '{{ config }}' in a template will
+    trigger the resolution.
+
+    When cache is False, the value is resolved on every access instead. This is used in offline mode, where
+    configuration snippets modify the configuration as the skillet executes.
+
+    An optional tree_resolver may return an already parsed document, allowing consumers such as 'validate_xml'
+    snippets to query the configuration without serializing and parsing it again.
+    """
+
+    def __init__(self, seq: Union[str, Callable[[], str]], cache: bool = True,
+                 tree_resolver: Optional[Callable[[], Any]] = None):
+        # do not call super().__init__ here as that would immediately resolve the value
+        self._cache = cache
+        self._tree_resolver = tree_resolver
+
+        if callable(seq):
+            self._resolver = seq
+            self._data = None
+
+        else:
+            # UserString methods will create new instances using the resolved str value
+            self._resolver = None
+            self._data = str(seq)
+
+    @property
+    def data(self) -> str:
+        if not self._cache and self._resolver is not None:
+            value = self._resolver()
+            return value if value is not None else ''
+
+        if self._data is None:
+            logger.debug('Retrieving configuration on first access')
+            value = self._resolver()
+            self._data = value if value is not None else ''
+
+        return self._data
+
+    @data.setter
+    def data(self, value: str) -> None:
+        self._data = value
+
+    @property
+    def resolved(self) -> bool:
+        """
+        Determine if the configuration has already been retrieved
+
+        :return: bool True if the configuration has been retrieved
+        """
+        return self._data is not None
+
+    def get_element_tree(self) -> Optional[Any]:
+        """
+        Returns the parsed configuration document if one is available without parsing the str value
+
+        :return: root Element of the configuration or None
+        """
+        if self._tree_resolver is None:
+            return None
+
+        return self._tree_resolver()
+
+    def __reduce__(self):
+        # copies and pickles of the context should contain a plain str and not the resolver or device connection
+        return str, (self.data,)
+
+
 class PanosSkillet(Skillet):
     panoply = None
 
@@ -39,6 +120,17 @@ class PanosSkillet(Skillet):
 
     allow_snippet_cache = False
 
+    # when greater than 1, consecutive configuration snippets will be pushed to the device in 'multi-config' requests
+    # of up to this many snippets. This may also be set via the '__batch_size' key in the context
+    batch_size = 0
+
+    # cmd types that may be combined into a single multi-config request
+    batch_cmds = ('set', 'edit', 'delete')
+
+    # when True, 'show' snippets are answered from the already retrieved running configuration in the context instead
+    # of a request to the device. This may also be set via the '__cache_config' key in the context
+    cache_config = False
+
     def __init__(self, metadata: dict, panoply: Panoply = None):
         """
         Initialize a new PanosSkillet class.
@@ -57,7 +149,8 @@ class PanosSkillet(Skillet):
     def initialize_context(self, initial_context: dict) -> dict:
         """
         In this panos case, we want to stash the current configuration of the panos device in question in the
-        context, check for online mode, offline mode, or an existing panoply object
+        context, check for online mode, offline mode, or an existing panoply object. In online mode, the configuration
+        is added as a LazyConfig and will only be retrieved from the device the first time it is accessed
 
         :param initial_context: dict to use to initialize the context
         :return: context with additional initialized items
@@ -79,11 +172,15 @@ class PanosSkillet(Skillet):
         # support for offline mode requires at least the 'config' variable to be present
         offline_required_fields = {'config'}
 
+        # or the path to a configuration file, which will be parsed directly from disk
+        offline_file_required_fields = {'config_file'}
+
         context = super().initialize_context(initial_context)
 
         if self.panoply is None:
             if not online_required_fields.issubset(initial_context) \
                     and not offline_required_fields.issubset(initial_context) \
+                    and not offline_file_required_fields.issubset(initial_context) \
                     and not legacy_required_fields.issubset(initial_context) \
                     and not provider_required_fields.issubset(initial_context) \
                     and not api_key_required_fields.issubset(initial_context):
@@ -97,7 +194,7 @@ class PanosSkillet(Skillet):
 
                 self.panoply = self.__init_panoply(hostname, username, password, port)
 
-                context['config'] = self.panoply.get_configuration()
+                context['config'] = LazyConfig(self.panoply.get_configuration)
 
             elif legacy_required_fields.issubset(initial_context):
                 hostname = initial_context.get('TARGET_IP', None)
@@ -107,7 +204,7 @@ class PanosSkillet(Skillet):
 
                 self.panoply = self.__init_panoply(hostname, username, password, port)
 
-                context['config'] = self.panoply.get_configuration()
+                context['config'] = LazyConfig(self.panoply.get_configuration)
 
             elif provider_required_fields.issubset(initial_context):
                 hostname = initial_context['ip_address']
@@ -117,7 +214,7 @@ class PanosSkillet(Skillet):
 
                 self.panoply = self.__init_panoply(hostname, username, password, port)
 
-                context['config'] = self.panoply.get_configuration()
+                context['config'] = LazyConfig(self.panoply.get_configuration)
 
             elif api_key_required_fields.issubset(initial_context):
                 hostname = initial_context['hostname']
@@ -128,24 +225,144 @@ class PanosSkillet(Skillet):
 
                 self.panoply = self.__init_panoply(hostname=hostname, api_key=api_key, port=port)
 
-                context['config'] = self.panoply.get_configuration()
+                context['config'] = LazyConfig(self.panoply.get_configuration)
 
             else:
                 logger.info(f'offline mode detected for {__name__}')
                 # init panoply in offline mode
                 self.panoply = self.__init_panoply()
 
+                # configuration snippets will be applied to an in-memory copy of the configuration, and any later
+                # snippets will see the result
+                if initial_context.get('config_file', None):
+                    self.panoply.load_offline_config_file(initial_context['config_file'])
+
+                else:
+                    self.panoply.load_offline_config(str(initial_context['config']))
+
+                context['config'] = LazyConfig(self.panoply.get_configuration, cache=False,
+                                               tree_resolver=lambda: self.panoply.offline_config.root)
+
         else:
             # we were passed in a panoply object already, check if we are connected and grab the configuration if so
             if self.panoply.connected:
-                context['config'] = self.panoply.get_configuration()
+                context['config'] = LazyConfig(self.panoply.get_configuration)
 
             else:
                 raise SkilletLoaderException('Could not get configuration! Not connected to PAN-OS Device')
 
+        if self.cache_config:
+            context.setdefault('__cache_config', True)
+
         self.initialized = True
         return context
 
+    def execute(self, initial_context: dict) -> dict:
+        """
+        Execute this skillet. When a batch_size greater than 1 is configured, either on this skillet or via the
+        '__batch_size' key in the context, consecutive 'set', 'edit', and 'delete' snippets are grouped together and
+        pushed using PAN-OS 'multi-config' requests. The results of each snippet are still recorded individually.
+
+        :param initial_context: context of key values pairs to use for the execution
+        :return: a dict containing the updated context containing the output of each of the snippets
+        """
+        try:
+            batch_size = int(initial_context.get('__batch_size', self.batch_size))
+
+        except (TypeError, ValueError):
+            raise SkilletValidationException('__batch_size must be an integer!')
+
+        if batch_size <= 1:
+            return super().execute(initial_context)
+
+        try:
+            context = self.initialize_context(initial_context)
+            logger.debug(f'Executing Skillet: {self.name} with batch size: {batch_size}')
+
+            batch = list()
+
+            for snippet in self.get_snippets():
+                try:
+
+                    if 'when' in snippet.metadata or snippet.cmd not in self.batch_cmds:
+                        # conditionals and snippets executed in order may depend on the results of snippets still
+                        # waiting in the batch, so always push any pending configuration before rendering them
+                        self.__execute_batch(batch, context)
+
+                    snippet.render_metadata(context)
+
+                    if not snippet.should_execute(context):
+                        continue
+
+                    if snippet.cmd in self.batch_cmds:
+                        batch.append(snippet)
+
+                        if len(batch) >= batch_size:
+                            self.__execute_batch(batch, context)
+
+                        continue
+
+                    (output, status) = snippet.execute(context)
+                    logger.debug(f'{snippet.name} - status: {status}')
+
+                    self._capture_snippet_outputs(snippet, output, status, context)
+
+                except SkilletLoaderException as sle:
+                    logger.error(f'Caught Exception during execution: {sle}')
+                    snippet_outputs = snippet.get_default_output(str(sle), 'error')
+                    logger.error(snippet_outputs)
+                    self.snippet_outputs.update(snippet_outputs)
+
+                except Exception as e:
+                    logger.error(f'Exception caught: {e}')
+                    snippet_outputs = snippet.get_default_output(str(e), 'error')
+                    self.snippet_outputs.update(snippet_outputs)
+
+            self.__execute_batch(batch, context)
+
+        finally:
+            self.cleanup()
+
+        return self.get_results()
+
+    def __execute_batch(self, batch: List[PanosSnippet], context: dict) -> None:
+        """
+        Push all the snippets in the batch using a single multi-config request and record the results of each one.
+        The batch is emptied once complete.
+
+        :param batch: list of PanosSnippets that have already been rendered and checked for execution
+        :param context: current execution context
+        :return: None
+        """
+
+        if not batch:
+            return
+
+        logger.info(f'  Executing batch of {len(batch)} snippets')
+
+        commands = [(snippet.cmd, snippet.metadata) for snippet in batch]
+
+        try:
+            results = self.panoply.execute_multi_config(commands)
+
+        except (PanoplyException, Exception) as e:
+            # i.e. the device could not be reached, every snippet in the batch is reported as failed
+            logger.error(f'Exception caught executing batch: {e}')
+            results = [(str(e), 'error')] * len(batch)
+
+        for snippet, (output, status) in zip(batch, results):
+            # These cmds may modify the configuration
+            snippet.destructive = True
+
+            if status == 'success':
+                self._capture_snippet_outputs(snippet, output, status, context)
+
+            else:
+                logger.error(f'{snippet.name} - {output}')
+                self.snippet_outputs.update(snippet.get_default_output(output, status))
+
+        batch.clear()
+
     @staticmethod
     def __init_panoply(hostname: Optional[str] = None,
                        username: Optional[str] = None,
@@ -218,9 +435,8 @@ class PanosSkillet(Skillet):
 
             snippet_file = snippet_path.joinpath(snippet_def['file']).resolve()
 
-            if snippet_file.exists():
-                with snippet_file.open() as sf:
-                    snippet_def['element'] = sf.read()
+            if file_exists(snippet_file):
+                snippet_def['element'] = read_file(snippet_file)
 
             else:
                 # raise SkilletLoaderException('Could not load "file" attribute!')
@@ -294,4 +510,8 @@ class PanosSkillet(Skillet):
         results['result'] = skillet_result
         results['changed'] = changed
 
+        # in offline mode, include the resulting candidate configuration if any snippets modified it
+        if self.panoply is not None and self.panoply.offline_config is not None and self.panoply.offline_config.changed:
+            results['candidate_config'] = self.panoply.offline_config.to_xml()
+
         return self._parse_output_template(results)
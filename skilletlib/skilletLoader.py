@@ -14,20 +14,36 @@
 
 # Authors: Nathan Embery
 
+import functools
 import logging
 import os
 import sys
 from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Callable
+from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
 import oyaml
 from yaml.error import YAMLError
 
+from skilletlib.cache import MetadataCache
+from skilletlib.cache import use_file_source
 from skilletlib.exceptions import SkilletLoaderException
 from skilletlib.exceptions import SkilletNotFoundException
-from skilletlib.remotes.git import Git
 from skilletlib.skillet.base import Skillet
+from skilletlib.skillet.handle import SkilletHandle
+
+if TYPE_CHECKING:
+    from skilletlib.bundle import SkilletBundle
+    from skilletlib.remotes.git import GitTree
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -45,19 +61,34 @@ class SkilletLoader:
     or from a git repository URL
 
     :param path: local relative path to search for all Skillet meta-data files
+    :param max_workers: number of processes used to parse the meta-data files found in path
+    :param cache_dir: optional directory in which to keep a persistent cache of parsed meta-data and snippet files
+    :param lazy: return SkilletHandles that only create each Skillet and its snippets on first use
     """
-    skillets = List[Skillet]
     skillet_errors = list()
+    cache = None
+    lazy = False
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, max_workers: int = 1, cache_dir: (str, Path, None) = None, lazy: bool = False):
         debug = os.environ.get('SKILLET_DEBUG', False)
 
         if debug:
             logger.setLevel(logging.DEBUG)
             logger.debug('Debugging output enabled')
 
+        if cache_dir is not None:
+            self.cache = MetadataCache(cache_dir)
+
+        self.lazy = lazy
+        self.skillets = list()
+
+        # directories passed to load_all_skillets_from_dir and the metadata file of each loaded skillet, used to
+        # reload only the skillets affected by changes on disk
+        self._skillet_dirs = list()
+        self._skillet_files = dict()
+
         if path is not None:
-            self.load_all_skillets_from_dir(path)
+            self.load_all_skillets_from_dir(path, max_workers)
 
     def load_skillet_dict_from_path(self, skillet_path: str) -> dict:
         """
@@ -162,28 +193,7 @@ class SkilletLoader:
             if not found_meta:
                 raise SkilletNotFoundException('Could not find .meta-cnc file at this location')
 
-        snippet_path = str(meta_cnc_file.parent.absolute())
-        try:
-
-            with meta_cnc_file.open(mode='r') as sc:
-                raw_service_config = oyaml.safe_load(sc.read())
-                skillet = self.normalize_skillet_dict(raw_service_config)
-                skillet['snippet_path'] = snippet_path
-                return skillet
-
-        except IOError:
-            logger.error('Could not open metadata file in dir %s' % meta_cnc_file.parent)
-            raise SkilletLoaderException('IOError: Could not parse metadata file in dir %s' % meta_cnc_file.parent)
-
-        except YAMLError as ye:
-            logger.error(ye)
-            raise SkilletLoaderException(
-                'YAMLError: Could not parse metadata file in dir %s' % meta_cnc_file.parent)
-
-        except Exception as ex:
-            logger.error(ex)
-            raise SkilletLoaderException(
-                'Exception: Could not parse metadata file in dir %s' % meta_cnc_file.parent)
+        return _load_metadata_file(meta_cnc_file)
 
     @staticmethod
     def normalize_skillet_dict(skillet: dict) -> dict:
@@ -347,6 +357,55 @@ class SkilletLoader:
 
         return errs
 
+    @property
+    def skillets(self) -> List[Skillet]:
+        """
+        List of all loaded skillets. Setting this rebuilds the indexes used by the lookup and query methods
+
+        :return: list of Skillets
+        """
+        return self._skillets
+
+    @skillets.setter
+    def skillets(self, skillets: List[Skillet]) -> None:
+        self._skillets = skillets if skillets is not None else list()
+        self.__build_indexes()
+
+    def __build_indexes(self) -> None:
+        """
+        Index the loaded skillets by name, and by the value of each of their labels. Values of list labels, such as
+        'collection', are indexed individually.
+
+        :return: None
+        """
+        self._indexed_count = len(self._skillets)
+        self._name_index = dict()
+        self._label_index = dict()
+
+        for skillet in self._skillets:
+            # the first skillet found with a name wins
+            self._name_index.setdefault(skillet.name, skillet)
+
+            for label_name, label_value in (skillet.labels or dict()).items():
+                values = self._label_index.setdefault(label_name, dict())
+
+                for value in label_value if isinstance(label_value, list) else [label_value]:
+
+                    try:
+                        values.setdefault(value, list()).append(skillet)
+
+                    except TypeError:
+                        # unhashable values such as dicts are not indexed
+                        continue
+
+    def __check_indexes(self) -> None:
+        """
+        Rebuild the indexes if skillets have been added to or removed from the skillets list in place
+        """
+
+        if self._indexed_count != len(self._skillets):
+            self.__build_indexes()
+
     def get_skillet_with_name(self, skillet_name: str) -> (Skillet, None):
         """
         Returns a single skillet from the loaded skillets list that has the matching 'name' attribute
@@ -358,18 +417,93 @@ class SkilletLoader:
         if not self.skillets:
             raise SkilletLoaderException('No Skillets have been loaded!')
 
-        for skillet in self.skillets:
-            if skillet.name == skillet_name:
-                return skillet
+        self.__check_indexes()
+        skillet = self._name_index.get(skillet_name, None)
+
+        if skillet is not None and skillet.name != skillet_name:
+            # a skillet has been replaced in place, fall back to rebuilding the indexes
+            self.__build_indexes()
+            skillet = self._name_index.get(skillet_name, None)
+
+        return skillet
 
-        return None
+    def get_skillets_with_label(self, label_name: str, label_value=None) -> List[Skillet]:
+        """
+        Returns all loaded skillets that define the given label, optionally with the given value. For list labels
+        such as 'collection', skillets with the value anywhere in the list are returned.
 
-    def load_all_skillets_from_dir(self, directory: (str, Path)) -> List[Skillet]:
+        :param label_name: name of the label
+        :param label_value: optional value of the label
+        :return: list of Skillets in the order they were loaded
+        """
+        self.__check_indexes()
+        values = self._label_index.get(label_name, dict())
+
+        if label_value is not None:
+
+            try:
+                return list(values.get(label_value, list()))
+
+            except TypeError:
+                return list()
+
+        found = set()
+
+        for skillets in values.values():
+            found.update(id(s) for s in skillets)
+
+        return [s for s in self._skillets if id(s) in found]
+
+    def get_skillets_in_collection(self, collection: str) -> List[Skillet]:
+        """
+        Returns all loaded skillets in the given collection
+
+        :param collection: name of the collection
+        :return: list of Skillets in the order they were loaded
+        """
+        return self.get_skillets_with_label('collection', collection)
+
+    def query(self, collection: Optional[str] = None, skillet_type: Optional[str] = None,
+              labels: Optional[dict] = None) -> List[Skillet]:
+        """
+        Returns all loaded skillets that match all of the given terms
+
+        .. code-block:: python
+
+            skillets = sl.query(collection='Example Skillets', labels={'help_link': None})
+
+        :param collection: name of a collection the skillets must be in
+        :param skillet_type: type of skillet, i.e. 'panos' or 'template'
+        :param labels: dict of label names and values the skillets must have. A value of None matches any skillet
+        that defines the label
+        :return: list of Skillets in the order they were loaded
+        """
+        candidates = list()
+
+        if collection is not None:
+            candidates.append(self.get_skillets_in_collection(collection))
+
+        for label_name, label_value in (labels or dict()).items():
+            candidates.append(self.get_skillets_with_label(label_name, label_value))
+
+        if not candidates:
+            candidates.append(self.skillets)
+
+        # filter the smallest candidate list by all the others
+        candidates.sort(key=len)
+        others = [set(id(s) for s in c) for c in candidates[1:]]
+
+        return [s for s in candidates[0]
+                if all(id(s) in o for o in others) and (skillet_type is None or s.type == skillet_type)]
+
+    def load_all_skillets_from_dir(self, directory: (str, Path), max_workers: int = 1) -> List[Skillet]:
         """
         Recursively iterate through all sub-directories and locate all found skillets
-        Returns a list of Loaded Skillets
+        Returns a list of Loaded Skillets, or SkilletHandles if this loader is lazy
 
         :param directory: parent directory in which to start iterating
+        :param max_workers: number of processes used to parse the metadata files. Parsing YAML is CPU bound, so
+        repositories containing many skillets load much faster when this is set to the number of available cores
         :return: list of skillets
         """
         if type(directory) is str:
@@ -380,91 +514,546 @@ class SkilletLoader:
 
         # reset skillet errors list here
         self.skillet_errors = list()
-        self.skillets = self._check_dir(d, list())
+        self._skillet_dirs = [str(d.absolute())]
+        self._skillet_files = dict()
+        self.skillets = self._check_dir(d, list(), max_workers)
 
         return self.skillets
 
-    def _check_dir(self, directory: Path, skillet_list: list) -> list:
+    def _check_dir(self, directory: Path, skillet_list: list, max_workers: int = 1) -> list:
         """
-        Recursive function to look for all files in the current directory with a name matching '.meta-cnc.yaml'
-        otherwise, iterate through all sub-dirs and skip dirs with name that match '.git', '.venv', and '.terraform'
-        will descend into all other dirs and call itself again.
+        Look for all files in this directory and all sub-dirs with a name matching '.meta-cnc.yaml'. Sub-dirs with
+        names that match '.git', '.venv', and '.terraform', and the sub-dirs of any dir that contains a skillet are
+        skipped. All found metadata files are then parsed, using a pool of processes if max_workers is greater than 1.
+        When a cache is configured, only files that are new or have changed since the last load are parsed.
         Returns a list of compiled skillets
 
         :param directory: PosixPath of directory to begin searching
         :param skillet_list: combined list of all loaded skillets
+        :param max_workers: number of processes used to parse the metadata files
         :return: list of Skillets
         """
-        logger.debug(f'Checking dir: {directory}')
-        err_condition = False
+        meta_cnc_files = _find_metadata_files(str(directory))
 
-        for d in directory.glob('.meta-cnc.y*'):
+        return self.__load_metadata_files(meta_cnc_files, skillet_list, self._skillet_files, max_workers)
 
-            try:
-                skillet = self.load_skillet_from_path(d)
+    def __load_metadata_files(self, meta_cnc_files: List[str], skillet_list: list, skillet_files: dict,
+                              max_workers: int = 1) -> list:
+        """
+        Parse the given metadata files, using the cache if configured, and create a skillet for each
+
+        :param meta_cnc_files: list of metadata file paths
+        :param skillet_list: list to which the skillets are added
+        :param skillet_files: dict to which the absolute metadata file path of each skillet is added
+        :param max_workers: number of processes used to parse the metadata files
+        :return: list of Skillets
+        """
+        parsed = dict()
+
+        if self.cache is not None:
+
+            for meta_cnc_file in meta_cnc_files:
+                skillet_dict = self.cache.get_skillet(meta_cnc_file)
+
+                if skillet_dict is not None:
+                    parsed[meta_cnc_file] = (skillet_dict, None)
+
+        to_parse = [f for f in meta_cnc_files if f not in parsed]
+
+        if max_workers > 1 and len(to_parse) > 1:
+
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                chunk_size = max(1, len(to_parse) // (max_workers * 4))
+                parsed.update(zip(to_parse, executor.map(_parse_metadata_file, to_parse, chunksize=chunk_size)))
+
+        else:
+            parsed.update((f, _parse_metadata_file(f)) for f in to_parse)
+
+        if self.cache is not None:
+
+            for meta_cnc_file in to_parse:
+                skillet_dict, error = parsed[meta_cnc_file]
+
+                if error is None:
+                    self.cache.put_skillet(meta_cnc_file, skillet_dict)
+
+            with self.cache.activate():
+                return self.__create_skillets(meta_cnc_files, parsed, skillet_list, skillet_files)
+
+        return self.__create_skillets(meta_cnc_files, parsed, skillet_list, skillet_files)
+
+    def __create_skillets(self, meta_cnc_files: List[str], parsed: dict, skillet_list: list,
+                          skillet_files: dict, factory: Optional[Callable[[dict], Skillet]] = None) -> list:
+        """
+        Create a skillet for each parsed metadata file, recording any errors in skillet_errors
+
+        :param meta_cnc_files: list of metadata file paths in the order the skillets should be returned
+        :param parsed: dict of metadata file path to a tuple of the skillet dict and error message
+        :param skillet_list: combined list of all loaded skillets
+        :param skillet_files: dict to which the absolute metadata file path of each skillet is added
+        :param factory: function used by SkilletHandles to create each skillet on first use
+        :return: list of Skillets
+        """
+
+        for meta_cnc_file in meta_cnc_files:
+            skillet_dict, error = parsed[meta_cnc_file]
+
+            if error is not None:
+                # for panhandler gl #19 - keep track of loader errors and associated directory
+                err_dict = dict()
+                err_dict['path'] = str(Path(meta_cnc_file).absolute())
+                err_dict['error'] = error
+                self.skillet_errors.append(err_dict)
+                logger.warning(f'Loader Error for dir {err_dict["path"]} - {error}')
+                continue
+
+            if self.lazy:
+                skillet = SkilletHandle(skillet_dict, factory if factory is not None else self.__create_cached_skillet)
                 skillet_list.append(skillet)
+                skillet_files[os.path.abspath(meta_cnc_file)] = skillet
+                continue
 
-            except SkilletNotFoundException:
-                err_condition = f'Skillet not found in dir {d.name}'
+            try:
+                skillet = self.create_skillet(skillet_dict)
+                skillet_list.append(skillet)
+                skillet_files[os.path.abspath(meta_cnc_file)] = skillet
 
             except SkilletLoaderException as sle:
-                # for panhandler gl #19 - keep track of loader errors and associated directory
                 err_dict = dict()
-                err_dict['path'] = str(d.absolute())
+                err_dict['path'] = str(Path(meta_cnc_file).absolute())
                 err_dict['error'] = str(sle)
                 self.skillet_errors.append(err_dict)
-                err_condition = f'Loader Error for dir {d.absolute()} - {sle}'
+                logger.warning(f'Loader Error for dir {err_dict["path"]} - {sle}')
 
-        # Do not descend into sub dirs after a .meta-cnc file has already been found
-        if skillet_list:
-            return skillet_list
+        return skillet_list
 
-        if err_condition:
-            logger.warning(err_condition)
-            return skillet_list
+    def reload_paths(self, paths: Iterable[Union[str, Path]]) -> dict:
+        """
+        Reload only the skillets affected by the given changed paths, i.e. the files reported as changed by a
+        'git pull' or a SkilletWatcher. Paths may be metadata files, snippet files, or directories, and may have been
+        added, modified, or removed. The skillets list and its indexes are replaced in a single step once all
+        affected skillets have been loaded.
 
-        for d in directory.iterdir():
+        :param paths: list of changed paths
+        :return: dict containing lists of the 'added', 'updated', and 'removed' skillet names
+        """
+        changed = {os.path.abspath(str(p)) for p in paths}
+        skillet_files = dict(self._skillet_files)
+
+        to_load = set()
+        removed = set()
+
+        for path in changed:
+
+            if os.path.basename(path).startswith('.meta-cnc.y'):
+
+                if os.path.isfile(path):
+
+                    if self.__in_skillet_dirs(path):
+                        to_load.add(path)
+
+                elif path in skillet_files:
+                    removed.add(path)
 
-            if d.is_file():
                 continue
 
-            if '.git' in d.name:
+            if os.path.isdir(path):
+
+                # new or moved directories may contain new skillets
+                if self.__in_skillet_dirs(path):
+                    to_load.update(f for f in (os.path.abspath(f) for f in _find_metadata_files(path))
+                                   if self.__in_skillet_dirs(f))
+
                 continue
 
-            if '.venv' in d.name:
+            for meta_cnc_file, skillet in skillet_files.items():
+                skillet_dir = os.path.dirname(meta_cnc_file)
+
+                if not os.path.isfile(meta_cnc_file):
+                    # the skillet has been removed along with its directory
+                    removed.add(meta_cnc_file)
+
+                elif path.startswith(skillet_dir + os.sep) or path in _referenced_files(skillet.skillet_dict):
+                    to_load.add(meta_cnc_file)
+
+        # errors are recorded again for any metadata file that still cannot be loaded
+        loaded_files = dict()
+        skillet_errors = [e for e in self.skillet_errors
+                          if e['path'] not in to_load and os.path.isfile(e['path'])]
+
+        previous_errors = self.skillet_errors
+        self.skillet_errors = skillet_errors
+
+        try:
+            self.__load_metadata_files(sorted(to_load), list(), loaded_files)
+
+        except Exception:
+            self.skillet_errors = previous_errors
+            raise
+
+        # metadata files that can no longer be loaded are removed
+        removed.update(f for f in to_load if f not in loaded_files)
+
+        results = {'added': list(), 'updated': list(), 'removed': list()}
+        skillets = list()
+        files_by_skillet = {id(skillet): f for f, skillet in skillet_files.items()}
+
+        for skillet in self.skillets:
+            meta_cnc_file = files_by_skillet.get(id(skillet), None)
+
+            if meta_cnc_file in removed:
+                skillet_files.pop(meta_cnc_file)
+                results['removed'].append(skillet.name)
+
+            elif meta_cnc_file in loaded_files:
+                skillets.append(loaded_files[meta_cnc_file])
+                skillet_files[meta_cnc_file] = loaded_files[meta_cnc_file]
+                results['updated'].append(skillet.name)
+
+            else:
+                skillets.append(skillet)
+
+        for meta_cnc_file, skillet in loaded_files.items():
+
+            if meta_cnc_file not in files_by_skillet.values():
+                skillets.append(skillet)
+                skillet_files[meta_cnc_file] = skillet
+                results['added'].append(skillet.name)
+
+        self._skillet_files = skillet_files
+        self.skillets = skillets
+
+        logger.debug(f'Reloaded skillets: {results}')
+
+        return results
+
+    def __in_skillet_dirs(self, path: str) -> bool:
+        """
+        Determine if the path would be found when loading the skillet directories, applying the same rules as
+        _check_dir to skip '.git', '.venv', and '.terraform' dirs and the sub-dirs of any dir that contains a skillet
+
+        :param path: absolute path of a metadata file or directory
+        :return: bool True if the path is within the skillet directories and not skipped
+        """
+        for skillet_dir in self._skillet_dirs:
+
+            if path != skillet_dir and not path.startswith(skillet_dir + os.sep):
                 continue
 
-            if '.terraform' in d.name:
+            parts = Path(path).relative_to(skillet_dir).parts
+
+            if any('.git' in d or '.venv' in d or '.terraform' in d for d in parts[:-1]):
                 continue
 
-            if d.is_dir():
-                skillet_list.extend(self._check_dir(d, list()))
+            if parts and not parts[-1].startswith('.meta-cnc.y') and \
+                    any(n in parts[-1] for n in ('.git', '.venv', '.terraform')):
+                continue
 
-        return skillet_list
+            # sub-dirs of any dir containing a skillet are never searched, a metadata file is only checked against
+            # the dirs above the one containing it
+            ancestors = [Path(skillet_dir)]
+
+            for d in parts[:-1]:
+                ancestors.append(ancestors[-1].joinpath(d))
+
+            if parts and parts[-1].startswith('.meta-cnc.y'):
+                ancestors.pop()
+
+            pruned = any(any(a.glob('.meta-cnc.y*')) for a in ancestors)
+
+            if not pruned:
+                return True
+
+        return False
+
+    def __create_cached_skillet(self, skillet_dict: dict, source: Optional['GitTree'] = None) -> Skillet:
+        """
+        Create a skillet on first use of a SkilletHandle, reading any snippet files through the cache if configured,
+        or from the given GitTree
+        """
+
+        if source is not None:
+
+            with use_file_source(source):
+                return self.__create_cached_skillet(skillet_dict)
+
+        if self.cache is None:
+            return self.create_skillet(skillet_dict)
+
+        with self.cache.activate():
+            return self.create_skillet(skillet_dict)
 
     def load_skillets_from_git(self, repo_url, repo_name, repo_branch,
-                               local_dir='~/.pan_cnc/skilletlib') -> List[Skillet]:
+                               local_dir='~/.pan_cnc/skilletlib', depth: Optional[int] = 1,
+                               sparse: bool = False) -> List[Skillet]:
 
-        return self.load_from_git(repo_url, repo_name, repo_branch, local_dir)
+        return self.load_from_git(repo_url, repo_name, repo_branch, local_dir, depth=depth, sparse=sparse)
 
-    def load_from_git(self, repo_url, repo_name, repo_branch, local_dir='~/.pan_cnc/skilletlib') -> List[Skillet]:
+    def load_from_git(self, repo_url, repo_name, repo_branch, local_dir='~/.pan_cnc/skilletlib',
+                      depth: Optional[int] = 1, sparse: bool = False) -> List[Skillet]:
         """
         Performs a local clone of the given Git repository URL and returns a list of all found skillets defined
-        therein.
+        therein. An existing clone is only updated if the branch has changed on the remote.
 
         :param repo_url: Repository URL
         :param repo_name: name given to the repository
         :param repo_branch: branch to checkout
         :param local_dir: local directory where to clone the git repository into
+        :param depth: number of commits to fetch, or None to fetch the complete history
+        :param sparse: only checkout and fetch the directories of the repository that contain skillets
         :return: List of Skillets
         """
-        g = Git(repo_url, local_dir)
-        d = g.clone(repo_name)
-        g.branch(repo_branch)
+        from skilletlib.remotes.git import Git
+
+        g = Git(repo_url, local_dir, depth=depth, sparse=sparse)
+        d = g.clone(repo_name, repo_branch)
 
         self.skillets = self.load_all_skillets_from_dir(d)
         return self.skillets
 
+    def load_from_git_repos(self, repositories: List[dict], local_dir='~/.pan_cnc/skilletlib', max_workers: int = 4,
+                            resolve_depends: bool = True, depth: Optional[int] = 1,
+                            sparse: bool = False) -> List[Skillet]:
+        """
+        Clone or update several Git repositories concurrently and load all of their skillets into this loader. Each
+        repository is a dict with the same 'url', 'name', and optional 'branch' attributes as a skillet 'depends'
+        stanza. When resolve_depends is set, the repositories listed in the 'depends' of every loaded skillet are
+        fetched as well, as soon as the skillet that depends on them is loaded.
+
+        Each repository is only fetched once. A repository whose name is already used by a different url or branch is
+        skipped and reported in skillet_errors, as is any repository that cannot be fetched.
+
+        The skillets are returned in the order the repositories were given, followed by their dependencies in the
+        order they were found, regardless of the order in which the fetches complete.
+
+        :param repositories: list of dicts with 'url', 'name', and optional 'branch' attributes
+        :param local_dir: local directory where to clone the git repositories into
+        :param max_workers: maximum number of repositories fetched at the same time
+        :param resolve_depends: also fetch the repositories listed in the 'depends' of each loaded skillet
+        :param depth: number of commits to fetch, or None to fetch the complete history
+        :param sparse: only checkout and fetch the directories of each repository that contain skillets
+        :return: List of Skillets
+        """
+        # repository name to (url, branch) of every repository submitted so far, in the order they were found
+        submitted = OrderedDict()
+        loaders = dict()
+        errors = list()
+
+        from skilletlib.remotes.git import Git
+
+        def fetch(url: str, name: str, branch: Optional[str]) -> SkilletLoader:
+            g = Git(url, local_dir, depth=depth, sparse=sparse)
+            repo_dir = g.clone(name, branch)
+
+            loader = SkilletLoader(lazy=self.lazy)
+            loader.cache = self.cache
+            loader.load_all_skillets_from_dir(repo_dir)
+            return loader
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict()
+
+            def submit(repo: dict) -> None:
+
+                if not isinstance(repo, dict) or not repo.get('url', '') or not repo.get('name', ''):
+                    logger.warning(f'Skipping invalid repository definition: {repo}')
+                    return
+
+                name = repo['name']
+                key = (repo['url'], repo.get('branch', None) or None)
+
+                if name in submitted:
+
+                    if submitted[name] != key:
+                        errors.append({'path': name, 'error': f'Repository {name} is already loaded from '
+                                                              f'{submitted[name][0]} {submitted[name][1] or ""}'})
+                    return
+
+                if key in submitted.values():
+                    # the same repository already requested under another name
+                    return
+
+                submitted[name] = key
+                futures[executor.submit(fetch, key[0], name, key[1])] = name
+
+            for repository in repositories:
+                submit(repository)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name = futures.pop(future)
+
+                    try:
+                        loaders[name] = future.result()
+
+                    except (SkilletLoaderException, Exception) as e:
+                        # i.e. GitPython errors for an existing dir that is not a git repository
+                        logger.error(f'Could not load repository {name}: {e}')
+                        errors.append({'path': name, 'error': str(e)})
+                        continue
+
+                    if resolve_depends:
+
+                        for skillet in loaders[name].skillets:
+
+                            for depends in skillet.skillet_dict.get('depends', list()):
+                                submit(depends)
+
+        # merge in a stable order so the registry is the same no matter which fetch finished first
+        skillets = list()
+        self.skillet_errors = list()
+        self._skillet_dirs = list()
+        self._skillet_files = dict()
+
+        for name in submitted:
+
+            if name in loaders:
+                skillets.extend(loaders[name].skillets)
+                self.skillet_errors.extend(loaders[name].skillet_errors)
+                self._skillet_dirs.extend(loaders[name]._skillet_dirs)
+                self._skillet_files.update(loaders[name]._skillet_files)
+
+        self.skillet_errors.extend(errors)
+        self.skillets = skillets
+
+        return self.skillets
+
+    def load_from_git_ref(self, repo_url, repo_name, ref: Optional[str] = None, local_dir='~/.pan_cnc/skilletlib',
+                          depth: Optional[int] = 1) -> List[Skillet]:
+        """
+        Fetches the given branch, tag, or commit of the Git repository URL into a local clone and returns a list of
+        all skillets found in that commit. The skillets are read directly from the git objects, so the working tree
+        of the clone is never changed and several refs of the same repository may be loaded concurrently using one
+        SkilletLoader per ref.
+
+        :param repo_url: Repository URL
+        :param repo_name: name given to the repository
+        :param ref: branch, tag, or commit to load, defaults to the default branch of the repository
+        :param local_dir: local directory where to clone the git repository into
+        :param depth: number of commits to fetch, or None to fetch the complete history
+        :return: List of Skillets
+        """
+        from skilletlib.remotes.git import Git
+
+        g = Git(repo_url, local_dir, depth=depth)
+        commit = g.fetch(repo_name, ref)
+
+        return self.load_all_skillets_from_tree(g.path, commit)
+
+    def load_all_skillets_from_tree(self, repo_path: (str, Path), ref: str = 'HEAD') -> List[Skillet]:
+        """
+        Locate and load all skillets found in the given commit of a local git repository, reading the metadata and
+        snippet files from the git object database rather than the filesystem. When a cache is configured, parsed
+        metadata files are stored by their git object id.
+
+        :param repo_path: path to a local clone or bare repository
+        :param ref: branch, tag, or commit to load
+        :return: list of skillets
+        """
+        from skilletlib.remotes.git import GitTree
+
+        tree = GitTree(str(Path(repo_path).expanduser()), ref)
+
+        self.skillet_errors = list()
+        self._skillet_dirs = list()
+        self._skillet_files = dict()
+
+        meta_cnc_files = tree.metadata_files()
+        parsed = dict()
+
+        for meta_cnc_file in meta_cnc_files:
+            blob_id = tree.blob_id(meta_cnc_file)
+            skillet_dict = self.cache.get_blob_skillet(blob_id) if self.cache is not None else None
+
+            if skillet_dict is None:
+                skillet_dict, error = _parse_metadata(tree.read(meta_cnc_file), meta_cnc_file)
+
+                if error is not None:
+                    parsed[meta_cnc_file] = (None, error)
+                    continue
+
+                if self.cache is not None:
+                    self.cache.put_blob_skillet(blob_id, skillet_dict)
+
+            # the same file contents may be found at different paths in other commits
+            skillet_dict['snippet_path'] = os.path.dirname(meta_cnc_file)
+            parsed[meta_cnc_file] = (skillet_dict, None)
+
+        if self.cache is not None:
+            self.cache.commit()
+
+        with use_file_source(tree):
+            self.skillets = self.__create_skillets(meta_cnc_files, parsed, list(), self._skillet_files,
+                                                   functools.partial(self.__create_cached_skillet, source=tree))
+
+        if not self.lazy:
+            tree.close()
+
+        return self.skillets
+
+    def build_bundle(self, destination: (str, Path), skillets: Optional[List[Skillet]] = None) -> int:
+        """
+        Write a single file bundle containing the normalized metadata, snippet files, and compiled templates of the
+        given skillets, which may be loaded later using load_from_bundle without any YAML parsing, file reads, or
+        template compilation
+
+        :param destination: path of the bundle file to write
+        :param skillets: list of skillets to include, defaults to all loaded skillets
+        :return: number of skillets written to the bundle
+        """
+        files_by_skillet = {id(skillet): f for f, skillet in self._skillet_files.items()}
+        skillet_dicts = list()
+
+        for skillet in self.skillets if skillets is None else skillets:
+            meta_cnc_file = files_by_skillet.get(id(skillet), None)
+
+            # executing a skillet renders its snippets in place, so use the metadata file when it is known
+            if meta_cnc_file is not None and os.path.isfile(meta_cnc_file):
+                skillet_dicts.append(_load_metadata_file(Path(meta_cnc_file)))
+
+            else:
+                skillet_dicts.append(skillet.skillet_dict)
+
+        from skilletlib.bundle import build_bundle
+
+        return build_bundle(skillet_dicts, destination, self.create_skillet)
+
+    def load_from_bundle(self, path: (str, Path)) -> List[Skillet]:
+        """
+        Load all skillets from a bundle written by build_bundle. Only the index of the bundle is read here, skillets
+        from a bundle are always returned as SkilletHandles and each is read from the bundle on first use. The bundle
+        stays open until skilletlib.bundle.close_bundle is called with the same path.
+
+        :param path: path to the bundle file
+        :return: list of SkilletHandles
+        """
+        from skilletlib.bundle import open_bundle
+
+        bundle = open_bundle(path)
+
+        self.skillet_errors = list()
+        self._skillet_dirs = list()
+        self._skillet_files = dict()
+        self.skillets = [SkilletHandle(metadata, functools.partial(self.__create_bundled_skillet, bundle=bundle,
+                                                                   member=member))
+                         for metadata, member in bundle.skillets]
+
+        return self.skillets
+
+    def __create_bundled_skillet(self, skillet_dict: dict, bundle: 'SkilletBundle', member: str) -> Skillet:
+        """
+        Create a skillet from a bundle on first use of a SkilletHandle. The snippets are added to the skillet dict of
+        the SkilletHandle, which holds only the metadata until then
+        """
+        skillet_dict['snippets'] = bundle.read_snippets(member)
+
+        with use_file_source(bundle):
+            return self.create_skillet(skillet_dict)
+
     def load_all_label_values(self, label_name: str) -> list:
         """
         Returns a list of label values defined across all snippets with a given label
@@ -473,21 +1062,150 @@ class SkilletLoader:
         labels:
             label_name: label_value
 
-        will add 'label_value' to the list
+        will add 'label_value' to the list. Each item of a list value, such as 'collection', is added individually
 
         :param label_name: name of the label to search for
         :return: list of strings representing all found label values for given key
         """
-        labels_list = list()
-        for skillet in self.skillets:
+        self.__check_indexes()
+
+        # values are indexed in the order they were first found
+        return list(self._label_index.get(label_name, dict()))
+
+
+def _referenced_files(skillet_dict: dict) -> set:
+    """
+    Returns the absolute paths of all snippet files referenced by the skillet
+
+    :param skillet_dict: skillet dict including the 'snippet_path'
+    :return: set of absolute file paths
+    """
+    snippet_path = skillet_dict.get('snippet_path', '')
+    files = set()
+
+    for snippet_def in skillet_dict.get('snippets', list()):
+
+        if isinstance(snippet_def, dict) and snippet_def.get('file', ''):
+            files.add(os.path.abspath(os.path.join(snippet_path, snippet_def['file'])))
+
+    return files
+
+
+def _load_metadata_file(meta_cnc_file: Path) -> dict:
+    """
+    Read, parse, and normalize a single skillet metadata file
+
+    :param meta_cnc_file: path to the .meta-cnc.yaml file
+    :return: skillet dictionary
+    """
+    try:
+
+        with meta_cnc_file.open(mode='r') as sc:
+            contents = sc.read()
+
+    except IOError:
+        logger.error('Could not open metadata file in dir %s' % meta_cnc_file.parent)
+        raise SkilletLoaderException('IOError: Could not parse metadata file in dir %s' % meta_cnc_file.parent)
+
+    return _load_metadata(contents, meta_cnc_file)
+
+
+def _load_metadata(contents: str, meta_cnc_file: Path) -> dict:
+    """
+    Parse and normalize the contents of a skillet metadata file
+
+    :param contents: contents of the .meta-cnc.yaml file
+    :param meta_cnc_file: path to the .meta-cnc.yaml file
+    :return: skillet dictionary
+    """
+    snippet_path = str(meta_cnc_file.parent.absolute())
+    try:
+        raw_service_config = oyaml.safe_load(contents)
+        skillet = SkilletLoader.normalize_skillet_dict(raw_service_config)
+        skillet['snippet_path'] = snippet_path
+        return skillet
+
+    except YAMLError as ye:
+        logger.error(ye)
+        raise SkilletLoaderException(
+            'YAMLError: Could not parse metadata file in dir %s' % meta_cnc_file.parent)
+
+    except Exception as ex:
+        logger.error(ex)
+        raise SkilletLoaderException(
+            'Exception: Could not parse metadata file in dir %s' % meta_cnc_file.parent)
+
+
+def _parse_metadata(contents: str, meta_cnc_file: str) -> Tuple[dict, str]:
+    """
+    Parse the contents of a metadata file, returning any error rather than raising it
+
+    :param contents: contents of the .meta-cnc.yaml file
+    :param meta_cnc_file: path to the .meta-cnc.yaml file
+    :return: tuple of the skillet dictionary and None, or None and the error message
+    """
+    try:
+        return _load_metadata(contents, Path(meta_cnc_file)), None
+
+    except SkilletLoaderException as sle:
+        return None, str(sle)
+
+
+def _parse_metadata_file(meta_cnc_file: str) -> Tuple[dict, str]:
+    """
+    Parse a single metadata file, returning any error rather than raising it so this may be used from a process pool
+
+    :param meta_cnc_file: path to the .meta-cnc.yaml file
+    :return: tuple of the skillet dictionary and None, or None and the error message
+    """
+    try:
+        return _load_metadata_file(Path(meta_cnc_file)), None
+
+    except SkilletLoaderException as sle:
+        return None, str(sle)
+
+
+def _find_metadata_files(directory: str) -> List[str]:
+    """
+    Walk the directory tree and return the path of every skillet metadata file. Once a metadata file is found in a
+    directory, the sub-dirs of that directory are not searched. Dirs with names that match '.git', '.venv', and
+    '.terraform' are skipped.
+
+    :param directory: directory to begin searching
+    :return: list of metadata file paths
+    """
+    logger.debug(f'Checking dir: {directory}')
+
+    found = list()
+    sub_dirs = list()
+
+    try:
+        with os.scandir(directory) as it:
+
+            for entry in it:
+
+                if entry.name.startswith('.meta-cnc.y'):
+
+                    if entry.is_file():
+                        found.append(entry.path)
+
+                    continue
+
+                if '.git' in entry.name or '.venv' in entry.name or '.terraform' in entry.name:
+                    continue
 
-            for label_key in skillet.labels:
+                if entry.is_dir():
+                    sub_dirs.append(entry.path)
 
-                if label_key == label_name:
+    except OSError as oe:
+        logger.warning(f'Could not read dir {directory} - {oe}')
+        return found
 
-                    for label_list_value in skillet.labels[label_name]:
+    # Do not descend into sub dirs after a .meta-cnc file has already been found
+    if found:
+        return found
 
-                        if label_list_value not in labels_list:
-                            labels_list.append(label_list_value)
+    for sub_dir in sub_dirs:
+        found.extend(_find_metadata_files(sub_dir))
 
-        return labels_list
+    return found
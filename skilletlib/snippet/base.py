@@ -14,33 +14,109 @@
 
 # Authors: Nathan Embery
 
+import hashlib
 import json
 import logging
 import re
+import threading
 import xml.etree.ElementTree as elementTree
 from abc import ABC
 from abc import abstractmethod
 from base64 import urlsafe_b64encode
+from types import CodeType
+from typing import Callable
+from typing import Optional
 from typing import Tuple
 from xml.etree.ElementTree import ParseError
 
-import xmltodict
 from jinja2 import BaseLoader
 from jinja2 import Environment
+from jinja2 import Template
 from jinja2 import meta
 from jinja2.exceptions import TemplateAssertionError
 from jinja2.exceptions import UndefinedError
-from jsonpath_ng import parse
-from lxml import etree
-from passlib.hash import md5_crypt
-
-from jinja2_ansible_filters import AnsibleCoreFiltersExtension
 
 from skilletlib.exceptions import SkilletLoaderException
 from skilletlib.exceptions import SkilletValidationException
 
 logger = logging.getLogger(__name__)
 
+# compiled jinja2 template code shared by all snippets, keyed by the sha256 of the template source. Every snippet
+# environment is created with the same options, so the same code may be used to create a template in any of them
+_template_code = dict()
+_template_code_limit = 4096
+_template_code_lock = threading.Lock()
+
+# functions that return precompiled template code for the sha256 of a template source or None, keyed by the name of
+# the source of the code, i.e. the path of a SkilletBundle
+template_code_providers = dict()
+
+
+def register_template_code_provider(name: str, provider: Callable[[str], Optional[CodeType]]) -> None:
+    """
+    Use precompiled template code from the given provider whenever a template is first compiled. Any provider already
+    registered with the same name is replaced.
+
+    :param name: name of the source of the code, i.e. the path of a SkilletBundle
+    :param provider: function that returns the compiled code for the sha256 of a template source or None
+    :return: None
+    """
+    template_code_providers[name] = provider
+
+
+def unregister_template_code_provider(name: str, provider: Optional[Callable[[str], Optional[CodeType]]] = None) -> None:
+    """
+    Stop using precompiled template code from the provider registered with the given name
+
+    :param name: name the provider was registered with
+    :param provider: only remove the registered provider if it is this one
+    :return: None
+    """
+    if provider is None or template_code_providers.get(name, None) == provider:
+        template_code_providers.pop(name, None)
+
+
+def template_key(template_str: str) -> str:
+    """
+    Returns the key used to store the compiled code of a template
+
+    :param template_str: jinja2 template source
+    :return: sha256 hex digest of the template source
+    """
+    return hashlib.sha256(template_str.encode('UTF-8')).hexdigest()
+
+
+def get_template(env: Environment, template_str: str) -> Template:
+    """
+    Returns a template for the given environment, compiling the template source only the first time it is seen
+
+    :param env: jinja2 environment of the snippet
+    :param template_str: jinja2 template source
+    :return: jinja2 Template
+    """
+    key = template_key(template_str)
+    code = _template_code.get(key, None)
+
+    if code is None:
+
+        for provider in list(template_code_providers.values()):
+            code = provider(key)
+
+            if code is not None:
+                break
+
+        else:
+            code = env.compile(template_str)
+
+        with _template_code_lock:
+
+            if len(_template_code) >= _template_code_limit:
+                _template_code.clear()
+
+            _template_code[key] = code
+
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
 
 class Snippet(ABC):
     """
@@ -437,7 +513,7 @@ class Snippet(ABC):
         """
         if context is None:
             context = self.context
-        t = self._env.from_string(template_str)
+        t = get_template(self._env, template_str)
         return t.render(context)
 
     def get_variables_from_template(self, template_str: str) -> list:
@@ -554,6 +630,9 @@ class Snippet(ABC):
         in the configurations
         """
 
+        # passlib is only imported when the filter is used
+        from passlib.hash import md5_crypt
+
         return md5_crypt.hash(txt)
 
     def __init_env(self) -> None:
@@ -562,6 +641,8 @@ class Snippet(ABC):
 
         :return: Jinja2 environment object
         """
+        from jinja2_ansible_filters import AnsibleCoreFiltersExtension
+
         self._env = Environment(loader=BaseLoader, extensions=[AnsibleCoreFiltersExtension])
         self._env.filters["md5_hash"] = self.__md5_hash
         self.add_filters()
@@ -666,6 +747,10 @@ class Snippet(ABC):
                 # there are unique tags in this list
                 return True
 
+        # only needed for snippets with xml outputs
+        import xmltodict
+        from lxml import etree
+
         try:
             xml_doc = etree.XML(results)
 
@@ -849,6 +934,8 @@ class Snippet(ABC):
                     captured_output[var_name] = json_object
                     continue
 
+                from jsonpath_ng import parse
+
                 jsonpath_expr = parse(capture_pattern)
                 result = jsonpath_expr.find(json_object)
                 if len(result) == 1:
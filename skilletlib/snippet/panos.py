@@ -18,11 +18,13 @@
 import logging
 import xml.etree.ElementTree as elementTree
 from collections import OrderedDict
+from collections import UserString
 from typing import Any
 from typing import Tuple
 from uuid import uuid4
 from xml.etree.ElementTree import ParseError
 
+from lxml import etree
 from xmldiff import main as xmldiff_main
 
 from skilletlib.exceptions import NodeNotFoundException
@@ -77,6 +79,7 @@ class PanosSnippet(TemplateSnippet):
 
         elif self.cmd == 'validate_xml':
             logger.info(f'  Validating XML Snippet: {self.name}')
+            # config may be a LazyConfig, which may also hold an already parsed document
             output = self.compare_element_at_xpath(context['config'], self.metadata['element'],
                                                    self.metadata['xpath'], context)
 
@@ -84,6 +87,10 @@ class PanosSnippet(TemplateSnippet):
             logger.info(f'  Parsing Variable: {self.metadata["variable"]}')
             output = context.get(self.metadata['variable'], '')
 
+            # lazily retrieved values such as the configuration must be resolved before parsing
+            if isinstance(output, UserString):
+                output = str(output)
+
         elif self.cmd in ('op', 'set', 'edit', 'override', 'move', 'rename', 'clone', 'delete'):
             logger.info(f'  Executing Snippet: {self.name}')
 
@@ -221,11 +228,12 @@ class PanosSnippet(TemplateSnippet):
         return meta
 
     @staticmethod
-    def compare_element_at_xpath(config: str, element: str, xpath: str, context: dict) -> bool:
+    def compare_element_at_xpath(config: (str, UserString), element: str, xpath: str, context: dict) -> bool:
         """
         Grab an xml fragment from the config given at xpath and compare it to this element
 
-        :param config: XML document string from which to pull the XML element to compare
+        :param config: XML document string from which to pull the XML element to compare. If this object provides
+        an already parsed document via 'get_element_tree', that document is used instead of parsing the string
 
         :param element: element to check against
         :param xpath: xpath to grab an xml fragment from the config for comparison
@@ -240,11 +248,22 @@ class PanosSnippet(TemplateSnippet):
             logger.warning('Element was blank for validate_xml test!')
             return False
 
-        config_doc = elementTree.fromstring(config)
+        config_doc = None
+
+        if hasattr(config, 'get_element_tree'):
+            config_doc = config.get_element_tree()
+
         relative_xpath = xpath.replace('/config/', './')
-        config_element = config_doc.find(relative_xpath)
 
-        config_element_str = elementTree.tostring(config_element).strip()
+        if config_doc is not None:
+            config_element = config_doc.find(relative_xpath)
+            config_element_str = etree.tostring(config_element).strip()
+
+        else:
+            config_doc = elementTree.fromstring(str(config))
+            config_element = config_doc.find(relative_xpath)
+            config_element_str = elementTree.tostring(config_element).strip()
+
         diffs = xmldiff_main.diff_texts(config_element_str, element)
         if len(diffs) == 0:
             return True
@@ -0,0 +1,441 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+import logging
+import ssl
+import threading
+import time
+from typing import Callable
+from typing import Optional
+from urllib.parse import urlencode
+
+import requests
+from pan import xapi
+
+logger = logging.getLogger(__name__)
+
+# guards mounting adapters on sessions shared between threads
+_session_lock = threading.Lock()
+
+# Default limits per device model. The management plane of the smaller platforms is easily overwhelmed, while the
+# larger appliances and Panorama can sustain many more concurrent API requests. Keys are matched as a prefix of the
+# model reported by 'show system info'. Entries may be added or modified to tune the limits for a specific environment
+model_profiles = {
+    'default': {'max_concurrency': 4, 'rate': 10, 'latency_target': 2.0},
+    'PA-2': {'max_concurrency': 2, 'rate': 4, 'latency_target': 3.0},
+    'PA-8': {'max_concurrency': 2, 'rate': 4, 'latency_target': 3.0},
+    'PA-VM': {'max_concurrency': 4, 'rate': 10, 'latency_target': 2.0},
+    'PA-3': {'max_concurrency': 6, 'rate': 15, 'latency_target': 2.0},
+    'PA-5': {'max_concurrency': 12, 'rate': 30, 'latency_target': 1.5},
+    'PA-7': {'max_concurrency': 12, 'rate': 30, 'latency_target': 1.5},
+    'Panorama': {'max_concurrency': 8, 'rate': 20, 'latency_target': 2.0},
+    'M-': {'max_concurrency': 8, 'rate': 20, 'latency_target': 2.0},
+}
+
+# pan-python has no public hook for sending requests, so ThrottledPanXapi overrides the private method used by every
+# api call. This is known to work with the pan-python versions allowed in setup.py
+if not hasattr(xapi.PanXapi, '_PanXapi__api_request'):
+    logger.warning('Unsupported version of pan-python, API requests will not be throttled')
+
+# errors returned from the XML API that indicate the device is overloaded rather than the request being invalid
+overload_signals = ('code: 429', 'code: 502', 'code: 503', 'code: 504', 'timed out', 'Connection reset',
+                    'RemoteDisconnected', 'Errno 104', 'Errno 111')
+
+
+def get_profile(model: Optional[str]) -> dict:
+    """
+    Returns the limiter settings for the given device model
+
+    :param model: model as found in the device facts, i.e. 'PA-VM' or 'Panorama'
+    :return: dict of AdaptiveLimiter settings
+    """
+    if not model:
+        return dict(model_profiles['default'])
+
+    # longest matching prefix wins
+    for prefix in sorted(model_profiles, key=len, reverse=True):
+
+        if prefix != 'default' and model.startswith(prefix):
+            return dict(model_profiles[prefix])
+
+    return dict(model_profiles['default'])
+
+
+class AdaptiveLimiter:
+    """
+    Limits the rate and concurrency of API requests to a single device.
+
+    Requests are first admitted by a token bucket to cap the request rate, then by an AIMD (additive increase,
+    multiplicative decrease) concurrency window. Each request that completes successfully within the latency target
+    slowly grows the window towards max_concurrency. Errors that indicate an overloaded management plane, or requests
+    that take much longer than the latency target, halve the window. Under sustained load this settles on the
+    highest concurrency the device can handle.
+    """
+
+    def __init__(self, max_concurrency: int = 4, rate: Optional[float] = 10, latency_target: float = 2.0,
+                 min_concurrency: int = 1, burst: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize a new AdaptiveLimiter
+
+        :param max_concurrency: maximum number of concurrent requests allowed
+        :param rate: maximum number of requests per second, None to disable rate limiting
+        :param latency_target: expected latency in seconds of a healthy device
+        :param min_concurrency: the window will never shrink below this number of requests
+        :param burst: number of requests that may be sent at once before the rate limit applies, defaults to
+        max_concurrency
+        :param clock: function returning the current time in seconds, used to refill tokens and space out decreases
+        """
+        self._condition = threading.Condition()
+        self._clock = clock
+
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.latency_target = latency_target
+        self.burst = burst or max_concurrency
+
+        # start with a conservative window and grow as the device proves it can keep up
+        self.limit = float(max(min_concurrency, min(2, max_concurrency)))
+        self.in_flight = 0
+
+        self.tokens = float(self.burst)
+        self.last_refill = clock()
+        self.last_decrease = 0.0
+
+        self.requests = 0
+        self.errors = 0
+        self.overloads = 0
+        self.total_latency = 0.0
+        self.total_wait = 0.0
+
+    def configure(self, max_concurrency: int = None, rate: Optional[float] = None, latency_target: float = None,
+                  min_concurrency: int = None, burst: int = None) -> None:
+        """
+        Update the limits of this limiter, for example once the model of the device is known
+
+        :param max_concurrency: maximum number of concurrent requests allowed
+        :param rate: maximum number of requests per second
+        :param latency_target: expected latency in seconds of a healthy device
+        :param min_concurrency: the window will never shrink below this number of requests
+        :param burst: number of requests that may be sent at once before the rate limit applies
+        :return: None
+        """
+        with self._condition:
+
+            if max_concurrency is not None:
+                self.max_concurrency = max_concurrency
+
+            if rate is not None:
+                self.rate = rate
+
+            if latency_target is not None:
+                self.latency_target = latency_target
+
+            if min_concurrency is not None:
+                self.min_concurrency = min_concurrency
+
+            self.burst = burst or self.max_concurrency
+            self.limit = max(self.min_concurrency, min(self.limit, self.max_concurrency))
+            self.tokens = min(self.tokens, self.burst)
+            self._condition.notify_all()
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be sent to the device
+
+        :return: None
+        """
+        start = self._clock()
+
+        with self._condition:
+
+            while True:
+                now = self._clock()
+                self.__refill(now)
+
+                if self.in_flight < int(self.limit) and (self.rate is None or self.tokens >= 1):
+                    break
+
+                if self.rate is not None and self.tokens < 1:
+                    self._condition.wait(timeout=(1 - self.tokens) / self.rate)
+
+                else:
+                    self._condition.wait()
+
+            if self.rate is not None:
+                self.tokens -= 1
+
+            self.in_flight += 1
+            self.total_wait += self._clock() - start
+
+    def release(self, latency: float, error: Optional[str] = None) -> None:
+        """
+        Record the outcome of a request and adjust the concurrency window
+
+        :param latency: time in seconds the request took
+        :param error: error message if the request failed, None otherwise
+        :return: None
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            self.total_latency += latency
+
+            overloaded = False
+
+            if error is not None:
+                self.errors += 1
+                overloaded = any(s in error for s in overload_signals)
+
+            elif latency > self.latency_target * 2:
+                overloaded = True
+
+            if overloaded:
+                self.overloads += 1
+                now = self._clock()
+
+                # only back off once per latency window, requests that were already in flight will report
+                # the same condition
+                if now - self.last_decrease > self.latency_target:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self.last_decrease = now
+                    logger.debug(f'Device overloaded, reducing concurrency to {int(self.limit)}')
+
+            elif error is None and latency <= self.latency_target:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        """
+        Returns the current state and counters of this limiter
+
+        :return: dict of metrics
+        """
+        with self._condition:
+            return {
+                'concurrency_limit': int(self.limit),
+                'max_concurrency': self.max_concurrency,
+                'rate': self.rate,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'errors': self.errors,
+                'overloads': self.overloads,
+                'avg_latency': round(self.total_latency / self.requests, 3) if self.requests else 0.0,
+                'total_wait': round(self.total_wait, 3),
+            }
+
+    def __refill(self, now: float) -> None:
+
+        if self.rate is not None:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.last_refill) * self.rate)
+
+        self.last_refill = now
+
+
+_limiters = dict()
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(hostname: str, port: int = 443) -> AdaptiveLimiter:
+    """
+    Returns the shared limiter for the given device. All PanXapi instances talking to the same device, from any
+    thread or Panoply instance, share the same limiter.
+
+    :param hostname: hostname or ip address of the device
+    :param port: port of the device
+    :return: AdaptiveLimiter instance
+    """
+    key = f'{hostname}:{port}'
+
+    with _limiters_lock:
+
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter(**get_profile(None))
+
+        return _limiters[key]
+
+
+def configure_limiter(hostname: str, port: int = 443, model: Optional[str] = None, **kwargs) -> AdaptiveLimiter:
+    """
+    Configure the limiter for the given device using the defaults for the device model, with any keyword arguments
+    overriding those defaults
+
+    :param hostname: hostname or ip address of the device
+    :param port: port of the device
+    :param model: model of the device
+    :param kwargs: any AdaptiveLimiter.configure arguments
+    :return: AdaptiveLimiter instance
+    """
+    profile = get_profile(model)
+    profile.update(kwargs)
+
+    limiter = get_limiter(hostname, port)
+    limiter.configure(**profile)
+
+    return limiter
+
+
+def get_metrics() -> dict:
+    """
+    Returns the metrics for all known devices
+
+    :return: dict keyed by 'hostname:port' with the limiter metrics as the value
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+
+    return {key: limiter.metrics() for key, limiter in limiters.items()}
+
+
+class _SessionResponse:
+    """
+    Adapts a requests Response to the interface pan-python expects from a urllib response
+    """
+
+    closed = True
+
+    def __init__(self, response: requests.Response):
+        self.pan_body = response.content
+        self.headers = response.headers
+
+    def getheader(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.headers.get(name, default)
+
+    def info(self):
+        return self.headers
+
+
+class _SSLContextAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter that verifies connections using the trusted certificates and verification mode of an SSLContext
+    rather than the CA bundle of requests
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        # do not load the requests CA bundle into the context
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+
+
+class ThrottledPanXapi(xapi.PanXapi):
+    """
+    PanXapi that sends every request through the limiter for its device. When a requests Session is given, requests
+    are sent using that session, so that many PanXapi instances, i.e. one per thread or per managed device proxied
+    through Panorama, can reuse the same pool of connections.
+    """
+
+    def __init__(self, *args, session: Optional[requests.Session] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = session
+
+    def _PanXapi__api_request(self, query, *args, **kwargs):
+        limiter = get_limiter(self.hostname, self.port)
+        limiter.acquire()
+
+        start = time.monotonic()
+        error = None
+
+        try:
+            if self.session is not None:
+                response = self.__session_request(query, *args, **kwargs)
+
+            else:
+                # older versions of pan-python only accept the query
+                response = super()._PanXapi__api_request(query, *args, **kwargs)
+
+            if response is False:
+                error = self.status_detail or 'request failed'
+
+            return response
+
+        except Exception as e:
+            error = str(e)
+            raise
+
+        finally:
+            limiter.release(time.monotonic() - start, error)
+
+    def __session_request(self, query, body=None, headers={}):
+        """
+        Send the request using the shared session. Errors are reported the same way as pan-python does for urllib
+        """
+
+        # type=keygen request will urlencode key if needed so don't double encode, same as pan-python
+        if 'key' in query:
+            query2 = query.copy()
+            key = query2.pop('key')
+            data = urlencode(query2) + '&key=' + key
+
+        else:
+            data = urlencode(query)
+
+        kwargs = {
+            'timeout': self.timeout,
+        }
+
+        # without an ssl_context the session decides, by default the certificate is verified against the CA bundle
+        if self.ssl_context is not None:
+
+            if self.ssl_context.verify_mode == ssl.CERT_NONE:
+                kwargs['verify'] = False
+
+            else:
+                self.__mount_ssl_context()
+
+        try:
+            if body is not None:
+                r = self.session.post(f'{self.uri}?{data}', data=body, headers=headers, **kwargs)
+
+            elif self.use_get:
+                r = self.session.get(f'{self.uri}?{data}', **kwargs)
+
+            else:
+                r = self.session.post(self.uri, data=data,
+                                      headers={'Content-Type': 'application/x-www-form-urlencoded'}, **kwargs)
+
+        except requests.exceptions.RequestException as re:
+            self.status_detail = f'URLError: reason: {re}'
+            return False
+
+        if r.status_code >= 400:
+            self.status_detail = f'URLError: code: {r.status_code} reason: {r.reason}'
+            return False
+
+        return _SessionResponse(r)
+
+    def __mount_ssl_context(self) -> None:
+        """
+        Mount an adapter on the shared session so requests to this device are verified using the ssl_context
+        """
+
+        with _session_lock:
+            adapter = self.session.get_adapter(self.uri)
+
+            if isinstance(adapter, _SSLContextAdapter) and adapter.ssl_context is self.ssl_context:
+                return
+
+            self.session.mount(self.uri, _SSLContextAdapter(self.ssl_context, pool_connections=1,
+                                                            pool_maxsize=getattr(adapter, '_pool_maxsize', 10)))
@@ -0,0 +1,732 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+"""
+A local stand-in for the PAN-OS XML API. This is useful for testing and benchmarking Panoply without a real device.
+
+.. code-block:: python
+
+    with MockPanosServer(latency=0.05) as server:
+        p = server.panoply()
+        p.execute_cmd('set', {'xpath': xpath, 'element': element})
+        p.commit()
+
+The stand-in keeps an in-memory running and candidate configuration and supports keygen, op commands, config
+show / get / set / edit / delete / multi-config, commit jobs, content updates, and file import and export. It is not a complete
+implementation of the API; only enough to drive realistic workloads.
+"""
+
+import email.parser
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from typing import List
+from typing import Optional
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+from skilletlib.candidate import CandidateConfig
+from skilletlib.exceptions import PanoplyException
+
+logger = logging.getLogger(__name__)
+
+default_config = """<config version="9.1.0" urldb="paloaltonetworks">
+  <mgt-config>
+    <users>
+      <entry name="admin">
+        <phash>*</phash>
+        <permissions><role-based><superuser>yes</superuser></role-based></permissions>
+      </entry>
+    </users>
+  </mgt-config>
+  <shared/>
+  <devices>
+    <entry name="localhost.localdomain">
+      <deviceconfig>
+        <system>
+          <hostname>mock-panos</hostname>
+          <timezone>US/Pacific</timezone>
+          <dns-setting><servers><primary>1.1.1.1</primary><secondary>1.0.0.1</secondary></servers></dns-setting>
+        </system>
+      </deviceconfig>
+      <network/>
+      <vsys>
+        <entry name="vsys1">
+          <address/>
+          <rulebase/>
+        </entry>
+      </vsys>
+    </entry>
+  </devices>
+</config>
+"""
+
+default_system_info = {
+    'hostname': 'mock-panos',
+    'ip-address': '127.0.0.1',
+    'netmask': '255.255.255.0',
+    'default-gateway': '127.0.0.1',
+    'is-dhcp': 'no',
+    'model': 'PA-VM',
+    'family': 'vm',
+    'vm-license': 'VM-100',
+    'serial': '007000000000001',
+    'sw-version': '9.1.0',
+    'app-version': '8000-1000',
+    'av-version': '3000-1000',
+    'wildfire-version': '400000-1000',
+}
+
+
+class MockApiError(Exception):
+    """
+    Raised internally to return an error response to the client
+    """
+
+    def __init__(self, msg: str, code: str = '', http_status: int = 200):
+        super().__init__(msg)
+        self.msg = msg
+        self.code = code
+        self.http_status = http_status
+
+
+class MockDevice:
+    """
+    In-memory state of the stand-in device. Each request is handled against this object under a single lock, as the
+    real management plane serializes configuration changes.
+    """
+
+    def __init__(self, config: str = default_config, username: str = 'admin', password: str = 'admin',
+                 system_info: Optional[dict] = None, job_duration: float = 0.0):
+        self.username = username
+        self.password = password
+        self.api_key = 'LUFRPT1' + 'mock' * 10 + '=='
+        self.job_duration = job_duration
+
+        self.system_info = dict(default_system_info)
+
+        if system_info is not None:
+            self.system_info.update(system_info)
+
+        self.running = CandidateConfig(config)
+        self.candidate = CandidateConfig(config)
+
+        self.saved_configs = dict()
+        self.imported_files = dict()
+        self.managed_devices = dict()
+        self.jobs = dict()
+        self.job_counter = 0
+
+        self.content_versions = {
+            'content': '8000-1000',
+            'anti-virus': '3000-1000',
+            'wildfire': '400000-1000',
+        }
+
+        # newest version of each content type offered by 'upgrade check', defaults to one newer than installed
+        self.content_available = dict()
+
+        self.lock = threading.RLock()
+
+    def handle(self, params: dict, files: dict) -> str:
+        """
+        Handle a single API request
+
+        :param params: dict of query parameters
+        :param files: dict of uploaded file names and contents
+        :return: xml response body
+        """
+        request_type = params.get('type', '')
+
+        with self.lock:
+            self.__advance_jobs()
+
+            if request_type == 'keygen':
+                return self.__keygen(params)
+
+            if params.get('key', '') != self.api_key:
+                raise MockApiError('Invalid credentials.', '403', 403)
+
+            target = params.get('target', None)
+
+            if target is not None and target != self.system_info['serial']:
+
+                if target not in self.managed_devices:
+                    raise MockApiError(f'Device {target} is not connected', '403')
+
+                return self.managed_devices[target].handle(params, files)
+
+            if request_type == 'op':
+                if params.get('action', '') == 'complete':
+                    return self.__complete(params)
+
+                return self.__op(params.get('cmd', ''))
+
+            if request_type == 'config':
+                return self.__config(params)
+
+            if request_type == 'commit':
+                return self.__commit(params)
+
+            if request_type == 'import':
+                return self.__import(params, files)
+
+            if request_type == 'export':
+                return self.__export(params)
+
+            raise MockApiError(f'Unsupported request type: {request_type}', '12', 400)
+
+    def add_managed_device(self, system_info: dict, config: str = default_config) -> 'MockDevice':
+        """
+        Add a firewall managed by this device. Requests with the serial number of the managed device as the 'target'
+        will be handled by the managed device, as they are when proxied through Panorama
+
+        :param system_info: 'show system info' of the managed device, must include the 'serial'
+        :param config: initial configuration of the managed device
+        :return: the managed MockDevice
+        """
+        device = MockDevice(config, self.username, self.password, system_info, self.job_duration)
+        device.api_key = self.api_key
+        self.managed_devices[device.system_info['serial']] = device
+
+        return device
+
+    def __keygen(self, params: dict) -> str:
+
+        if params.get('user', '') != self.username or params.get('password', '') != self.password:
+            raise MockApiError('Invalid Credential', '403', 403)
+
+        return _success(f'<key>{self.api_key}</key>')
+
+    def __op(self, cmd: str) -> str:
+
+        try:
+            cmd_element = etree.fromstring(cmd)
+
+        except etree.XMLSyntaxError:
+            raise MockApiError('Malformed command', '17')
+
+        path, text = _op_path(cmd_element)
+
+        if path == 'show/system/info':
+            info = ''.join(f'<{k}>{escape(v)}</{k}>' for k, v in self.system_info.items())
+            return _success(f'<system>{info}</system>')
+
+        if path == 'request/license/info':
+            return _success('<licenses><entry><feature>PA-VM</feature><description>Standard VM-100</description>'
+                            '<expired>no</expired></entry></licenses>')
+
+        if path == 'show/jobs/id':
+            job_id = text.strip('"')
+
+            if job_id not in self.jobs:
+                raise MockApiError(f'job {job_id} not found', '17')
+
+            return _success(f'<job>{self.__job_xml(job_id)}</job>')
+
+        if path in ('show/devices/connected', 'show/devices/all'):
+            entries = list()
+
+            for serial, device in self.managed_devices.items():
+                info = ''.join(f'<{k}>{escape(v)}</{k}>' for k, v in device.system_info.items())
+                entries.append(f'<entry name="{escape(serial)}">{info}<connected>yes</connected></entry>')
+
+            return _success(f'<devices>{"".join(entries)}</devices>')
+
+        if path in ('show/jobs/all', 'show/jobs/processed', 'show/jobs/pending'):
+            jobs = ''.join(f'<job>{self.__job_xml(job_id)}</job>' for job_id in self.jobs)
+            return _success(jobs)
+
+        if path == 'show/config/running':
+            return _success(self.running.to_xml())
+
+        if path == 'show/config/candidate':
+            return _success(self.candidate.to_xml())
+
+        if path == 'show/config/saved':
+
+            if text not in self.saved_configs:
+                raise MockApiError(f'{text} not found', '17')
+
+            return _success(self.saved_configs[text])
+
+        if path == 'load/config/from':
+
+            if text not in self.saved_configs:
+                raise MockApiError(f'{text} not found', '17')
+
+            self.candidate = CandidateConfig(self.saved_configs[text])
+            return _success(f'<msg><line>Config loaded from {escape(text)}</line></msg>')
+
+        if path == 'save/config/to':
+            self.saved_configs[text] = self.candidate.to_xml()
+            return _success(f'<msg>Config saved to {escape(text)}</msg>')
+
+        content_match = re.match(r'^request/(content|anti-virus|wildfire)/upgrade/(check|download|install)',
+                                 path)
+
+        if content_match:
+            return self.__content(content_match.group(1), content_match.group(2))
+
+        raise MockApiError(f'Unknown command: {path}', '17')
+
+    def __content(self, content_type: str, action: str) -> str:
+
+        current = self.content_versions[content_type]
+        first, second = current.split('-')
+        latest = self.content_available.setdefault(content_type, f'{int(first) + 1}-{int(second) + 1}')
+
+        if action == 'check':
+            entries = f'<entry><version>{current}</version><current>yes</current></entry>'
+
+            if latest != current:
+                entries += f'<entry><version>{latest}</version><current>no</current></entry>'
+
+            return _success(f'<content-updates last-updated-at="now">{entries}</content-updates>')
+
+        if action == 'download':
+            job_id = self.__add_job('Downld')
+            return _success(f'<msg><line>Download job enqueued with jobid {job_id}</line></msg><job>{job_id}</job>')
+
+        def install():
+            self.content_versions[content_type] = latest
+            self.system_info[_content_fact(content_type)] = latest
+
+        job_id = self.__add_job('Content', install)
+        return _success(f'<msg><line>Content install job enqueued with jobid {job_id}</line></msg><job>{job_id}</job>')
+
+    def __complete(self, params: dict) -> str:
+        completions = ''.join(f'<completion value="{escape(name)}"/>' for name in self.saved_configs)
+        return f'<response status="success"><completions>{completions}</completions></response>'
+
+    def __config(self, params: dict) -> str:
+        action = params.get('action', '')
+        xpath = params.get('xpath', '')
+
+        if action == 'multi-config':
+            return self.__multi_config(params.get('element', ''), params.get('strict-transactional', 'no') == 'yes')
+
+        if action == 'show':
+            nodes = self.__find(self.running, xpath)
+
+            if not nodes:
+                raise MockApiError('No such node', '7')
+
+            return _success(''.join(etree.tostring(n).decode('UTF-8') for n in nodes))
+
+        if action == 'get':
+            nodes = self.__find(self.candidate, xpath)
+            elements = ''.join(etree.tostring(n).decode('UTF-8') for n in nodes)
+            return (f'<response status="success" code="19"><result total-count="{len(nodes)}" count="{len(nodes)}">'
+                    f'{elements}</result></response>')
+
+        if action in ('set', 'edit', 'override', 'delete', 'move', 'rename', 'clone'):
+            self.__apply(action, params)
+            return '<response status="success" code="20"><msg>command succeeded</msg></response>'
+
+        raise MockApiError(f'Unsupported config action: {action}', '12')
+
+    def __apply(self, action: str, params: dict) -> None:
+
+        try:
+            self.candidate.apply(action, {
+                'xpath': params.get('xpath', ''),
+                'element': params.get('element', ''),
+                'where': params.get('where', ''),
+                'dst': params.get('dst', None),
+                'newname': params.get('newname', None),
+                'xpath_from': params.get('from', ''),
+            })
+
+        except PanoplyException as pe:
+            raise MockApiError(str(pe), '12')
+
+    @staticmethod
+    def __find(config: CandidateConfig, xpath: str) -> list:
+
+        try:
+            return config.find(xpath)
+
+        except PanoplyException as pe:
+            raise MockApiError(str(pe), '7')
+
+    def __multi_config(self, element: str, strict: bool) -> str:
+
+        try:
+            request = etree.fromstring(element.encode('UTF-8'))
+
+        except etree.XMLSyntaxError:
+            raise MockApiError('Malformed multi-config request', '18')
+
+        backup = self.candidate.copy()
+        responses = list()
+
+        for command in request:
+            command_id = command.get('id', '')
+            inner = ''.join(etree.tostring(c).decode('UTF-8') for c in command)
+
+            try:
+                self.__apply(command.tag, {'xpath': command.get('xpath', ''), 'element': inner})
+                responses.append(f'<response status="success" code="20" id="{command_id}">'
+                                 f'<msg>command succeeded</msg></response>')
+
+            except MockApiError as mae:
+                responses.append(f'<response status="error" code="{mae.code}" id="{command_id}">'
+                                 f'<msg><line>{escape(mae.msg)}</line></msg></response>')
+
+                # processing stops at the first failure, strict-transactional requests are rolled back entirely
+                if strict:
+                    self.candidate = backup
+
+                return f'<response status="error" code="12">{"".join(responses)}</response>'
+
+        return f'<response status="success" code="20">{"".join(responses)}</response>'
+
+    def __commit(self, params: dict) -> str:
+        snapshot = self.candidate.copy()
+
+        def apply():
+            self.running = snapshot
+
+        job_type = 'CommitAll' if params.get('action', '') == 'all' else 'Commit'
+        job_id = self.__add_job(job_type, apply)
+
+        return (f'<response status="success" code="19"><result><msg><line>Commit job enqueued with jobid {job_id}'
+                f'</line></msg><job>{job_id}</job></result></response>')
+
+    def __import(self, params: dict, files: dict) -> str:
+
+        if not files:
+            raise MockApiError('No file uploaded', '18')
+
+        for filename, contents in files.items():
+
+            if params.get('category', '') == 'configuration':
+                self.saved_configs[filename] = contents.decode('UTF-8')
+
+            else:
+                self.imported_files[filename] = contents
+
+        return f'<response status="success"><msg>{escape(", ".join(files))} saved</msg></response>'
+
+    def __export(self, params: dict) -> str:
+
+        if params.get('category', '') != 'configuration':
+            raise MockApiError(f'Unsupported export category: {params.get("category", "")}', '18')
+
+        name = params.get('from', None)
+
+        if name is None:
+            return self.running.to_xml()
+
+        if name not in self.saved_configs:
+            raise MockApiError(f'{name} not present', '17')
+
+        return self.saved_configs[name]
+
+    def __add_job(self, job_type: str, on_complete=None) -> str:
+        self.job_counter += 1
+        job_id = str(self.job_counter)
+        self.jobs[job_id] = {
+            'type': job_type,
+            'started': time.time(),
+            'on_complete': on_complete,
+            'status': 'ACT',
+        }
+
+        self.__advance_jobs()
+
+        return job_id
+
+    def __advance_jobs(self) -> None:
+        now = time.time()
+
+        for job in self.jobs.values():
+
+            if job['status'] == 'ACT' and now >= job['started'] + self.job_duration:
+                job['status'] = 'FIN'
+
+                if job['on_complete'] is not None:
+                    job['on_complete']()
+
+    def __job_xml(self, job_id: str) -> str:
+        job = self.jobs[job_id]
+
+        if job['status'] == 'FIN':
+            return (f'<id>{job_id}</id><type>{job["type"]}</type><status>FIN</status><result>OK</result>'
+                    f'<progress>100</progress><details><line>Job completed successfully</line></details>')
+
+        elapsed = time.time() - job['started']
+        progress = min(99, int(elapsed / self.job_duration * 100)) if self.job_duration else 99
+
+        return (f'<id>{job_id}</id><type>{job["type"]}</type><status>ACT</status><result>PEND</result>'
+                f'<progress>{progress}</progress><details/>')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockPanosServer:
+    """
+    Serves a MockDevice over HTTP on localhost. Latency and errors can be injected to simulate a busy management
+    plane.
+    """
+
+    def __init__(self, config: str = default_config, username: str = 'admin', password: str = 'admin',
+                 system_info: Optional[dict] = None, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, max_concurrent: int = 0, job_duration: float = 0.0, port: int = 0):
+        """
+        Initialize a new stand-in server. Call start() or use as a context manager to begin serving requests.
+
+        :param config: initial running and candidate configuration
+        :param username: username accepted for keygen
+        :param password: password accepted for keygen
+        :param system_info: overrides for the 'show system info' output, i.e. {'model': 'Panorama'}
+        :param latency: time in seconds added to each response
+        :param jitter: random additional time in seconds, up to this value, added to each response
+        :param error_rate: fraction of requests, between 0 and 1, that fail with an HTTP 503
+        :param max_concurrent: requests beyond this number of concurrent requests fail with an HTTP 503, 0 to disable
+        :param job_duration: time in seconds commit and content jobs take to complete
+        :param port: port to listen on, 0 to choose a free port
+        """
+        self.device = MockDevice(config, username, password, system_info, job_duration)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+
+        self.hostname = '127.0.0.1'
+        self.port = port
+
+        self.requests = Counter()
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._injected_errors = list()
+        self._stats_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self) -> 'MockPanosServer':
+        """
+        Begin serving requests in a background thread
+
+        :return: this server
+        """
+        self._server = _ThreadingHTTPServer((self.hostname, self.port), self.__handler_class())
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-panos', daemon=True)
+        self._thread.start()
+        logger.debug(f'Mock PAN-OS API listening on {self.url}')
+
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving requests
+
+        :return: None
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.hostname}:{self.port}/api/'
+
+    def panoply(self, **kwargs):
+        """
+        Returns a Panoply instance connected to this server
+
+        :param kwargs: any additional Panoply arguments
+        :return: Panoply instance
+        """
+        from skilletlib.panoply import Panoply
+
+        return Panoply(hostname=self.hostname, api_port=self.port, api_username=self.device.username,
+                       api_password=self.device.password, use_http=True, **kwargs)
+
+    def inject_errors(self, codes: List[int]) -> None:
+        """
+        Fail the next requests with the given HTTP status codes, one code per request
+
+        :param codes: list of HTTP status codes, i.e. [503, 503, 429]
+        :return: None
+        """
+        with self._stats_lock:
+            self._injected_errors.extend(codes)
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self.requests.clear()
+            self.errors = 0
+            self.max_in_flight = 0
+
+    def _handle(self, params: dict, files: dict) -> (int, str):
+        """
+        Apply latency and error injection, then pass the request to the device
+
+        :return: tuple of HTTP status code and response body
+        """
+        with self._stats_lock:
+            self.requests[params.get('type', 'unknown')] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+            injected = self._injected_errors.pop(0) if self._injected_errors else None
+
+            if injected is None and self.max_concurrent and self.in_flight > self.max_concurrent:
+                injected = 503
+
+        try:
+            delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+            if delay:
+                time.sleep(delay)
+
+            if injected is None and self.error_rate and random.random() < self.error_rate:
+                injected = 503
+
+            if injected is not None:
+                with self._stats_lock:
+                    self.errors += 1
+
+                return injected, _error('Service Unavailable', str(injected))
+
+            try:
+                return 200, self.device.handle(params, files)
+
+            except MockApiError as mae:
+
+                if mae.http_status != 200:
+                    with self._stats_lock:
+                        self.errors += 1
+
+                return mae.http_status, _error(mae.msg, mae.code)
+
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+
+    def __handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.__respond(_parse_qs(urlparse(self.path).query), dict())
+
+            def do_POST(self):
+                params = _parse_qs(urlparse(self.path).query)
+                files = dict()
+
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+
+                if content_type.startswith('multipart/form-data'):
+                    files = _parse_multipart(content_type, body)
+
+                elif body:
+                    params.update(_parse_qs(body.decode('UTF-8')))
+
+                self.__respond(params, files)
+
+            def __respond(self, params: dict, files: dict):
+                status, body = server._handle(params, files)
+                payload = body.encode('UTF-8')
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/xml; charset=UTF-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt % args)
+
+        return Handler
+
+
+def _success(result: str) -> str:
+    return f'<response status="success"><result>{result}</result></response>'
+
+
+def _error(msg: str, code: str) -> str:
+    return f'<response status="error" code="{code}"><msg><line>{escape(msg)}</line></msg></response>'
+
+
+def _content_fact(content_type: str) -> str:
+    return {'content': 'app-version', 'anti-virus': 'av-version', 'wildfire': 'wildfire-version'}[content_type]
+
+
+def _parse_qs(qs: str) -> dict:
+    return {k: v[-1] for k, v in parse_qs(qs, keep_blank_values=True).items()}
+
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    message = email.parser.BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode('UTF-8') + b'\r\n\r\n' + body
+    )
+
+    files = dict()
+
+    for part in message.get_payload():
+        filename = part.get_filename()
+
+        if filename:
+            files[filename] = part.get_payload(decode=True)
+
+    return files
+
+
+def _op_path(element: etree.Element) -> (str, str):
+    """
+    Follow the chain of single child elements of an op command, i.e. <show><system><info/></system></show> becomes
+    'show/system/info'. The text of the last element is returned as well, i.e. the job id of 'show/jobs/id'
+    """
+    tags = [element.tag]
+
+    while len(element) == 1:
+        element = element[0]
+        tags.append(element.tag)
+
+    # commands like <request><content><upgrade><install>... have multiple options on the last element
+    if len(element):
+        tags.append(element[0].tag)
+
+    return '/'.join(tags), (element.text or '').strip()
@@ -0,0 +1,162 @@
+# Copyright (c) 2020, Palo Alto Networks
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+# Authors: Nathan Embery
+
+"""
+Watch the skillet directories of a SkilletLoader and reload only the skillets affected by each change.
+
+.. code-block:: python
+
+    sl = SkilletLoader('skillets')
+
+    with SkilletWatcher(sl, callback=lambda results: print(results)):
+        ...
+
+"""
+
+import logging
+import os
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from .skilletLoader import SkilletLoader
+
+logger = logging.getLogger(__name__)
+
+
+class SkilletWatcher:
+    """
+    SkilletWatcher polls the directories loaded by a SkilletLoader from a background thread. Each pass compares the
+    modification time and size of every file against the previous pass, and passes any added, modified, or removed
+    paths to SkilletLoader.reload_paths. Polling is used so no additional dependencies are required and the same
+    behavior is seen on all platforms and on network or container mounted volumes.
+    """
+
+    def __init__(self, loader: SkilletLoader, interval: float = 2.0,
+                 callback: Optional[Callable[[dict], None]] = None):
+        """
+        Initialize a new SkilletWatcher
+
+        :param loader: SkilletLoader with skillets loaded from a directory
+        :param interval: number of seconds to wait between each pass
+        :param callback: function called with the results of reload_paths after each change
+        """
+        self.loader = loader
+        self.interval = interval
+        self.callback = callback
+
+        self._snapshot = dict()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Take an initial snapshot of the skillet directories and begin watching for changes
+
+        :return: None
+        """
+        if self._thread is not None:
+            return
+
+        self._snapshot = self.snapshot()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.__run, name='skillet-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop watching for changes and wait for the current pass to finish
+
+        :return: None
+        """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def check(self) -> dict:
+        """
+        Compare the skillet directories against the previous snapshot and reload any affected skillets
+
+        :return: dict containing lists of the 'added', 'updated', and 'removed' skillet names
+        """
+        snapshot = self.snapshot()
+        previous = self._snapshot
+
+        changed = [path for path in snapshot.keys() | previous.keys() if snapshot.get(path) != previous.get(path)]
+
+        if not changed:
+            return {'added': list(), 'updated': list(), 'removed': list()}
+
+        logger.debug(f'Found {len(changed)} changed files')
+        results = self.loader.reload_paths(changed)
+
+        # the snapshot is only updated once the reload succeeds so any failed changes are retried on the next pass
+        self._snapshot = snapshot
+
+        if self.callback is not None and any(results.values()):
+            self.callback(results)
+
+        return results
+
+    def snapshot(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the modification time and size of every file in the skillet directories. Dirs with names that match
+        '.git', '.venv', and '.terraform' are skipped.
+
+        :return: dict of file path to a tuple of modification time and size
+        """
+        snapshot = dict()
+
+        for skillet_dir in self.loader._skillet_dirs:
+
+            for root, dirs, files in os.walk(skillet_dir):
+                dirs[:] = [d for d in dirs if '.git' not in d and '.venv' not in d and '.terraform' not in d]
+
+                for f in files:
+                    path = os.path.join(root, f)
+
+                    try:
+                        st = os.stat(path)
+
+                    except OSError:
+                        # removed while walking the tree
+                        continue
+
+                    snapshot[path] = (st.st_mtime_ns, st.st_size)
+
+        return snapshot
+
+    def __run(self) -> None:
+
+        while not self._stop.wait(self.interval):
+
+            try:
+                self.check()
+
+            except Exception as e:
+                logger.warning(f'Could not reload skillets: {e}')
+
+    def __enter__(self) -> 'SkilletWatcher':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
@@ -0,0 +1,219 @@
+# This script will clone and update local bare repositories and verify only the requested history and skillet
+# directories are fetched, and that nothing is fetched when the remote has not changed
+
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from skilletlib import SkilletLoader
+from skilletlib.remotes.git import Git
+from skilletlib.remotes.git import find_skillet_dirs
+from skilletlib.remotes.git import find_snippet_dirs
+from skilletlib.utils.testing_utils import setup_dir
+
+setup_dir()
+
+skillet_yaml = '''
+name: {name}
+label: {name}
+type: template
+snippets:
+  - name: template
+    file: template.txt
+'''
+
+
+def git(cwd, *args) -> str:
+    return subprocess.run(['git', *args], cwd=str(cwd), check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.strip()
+
+
+def commit(work, message):
+    git(work, 'add', '-A')
+    git(work, '-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', message)
+    git(work, 'push', '-q', 'origin', 'HEAD')
+
+
+@pytest.fixture()
+def remote(tmp_path):
+    bare = tmp_path.joinpath('remote.git')
+    git(tmp_path, 'init', '-q', '--bare', '-b', 'main', str(bare))
+    git(bare, 'config', 'uploadpack.allowFilter', 'true')
+
+    work = tmp_path.joinpath('work')
+    git(tmp_path, 'clone', '-q', str(bare), str(work))
+    git(work, 'checkout', '-q', '-b', 'main')
+
+    for name in ('one', 'two', 'two/nested'):
+        work.joinpath(name).mkdir()
+        work.joinpath(name, '.meta-cnc.yaml').write_text(skillet_yaml.format(name=name.replace('/', '-')))
+        work.joinpath(name, 'template.txt').write_text(f'{name} v1')
+
+    work.joinpath('docs').mkdir()
+    work.joinpath('docs', 'large.bin').write_bytes(b'x' * 100000)
+    commit(work, 'first')
+
+    work.joinpath('one', 'template.txt').write_text('one v2')
+    commit(work, 'second')
+
+    return f'file://{bare}', work
+
+
+def test_shallow_clone_and_update(remote, tmp_path):
+    url, work = remote
+    store = tmp_path.joinpath('store')
+
+    g = Git(url, str(store))
+    path = g.clone('skillets', 'main')
+    assert git(path, 'rev-list', '--count', 'HEAD') == '1'
+    assert git(path, 'rev-parse', 'HEAD') == g.remote_commit('main')
+
+    # nothing is fetched when the branch has not changed
+    fetch_head = tmp_path.joinpath('store', 'skillets', '.git', 'FETCH_HEAD')
+    assert not fetch_head.exists()
+    Git(url, str(store)).clone('skillets', 'main')
+    assert not fetch_head.exists()
+
+    work.joinpath('one', 'template.txt').write_text('one v3')
+    commit(work, 'third')
+
+    sl = SkilletLoader()
+    sl.load_from_git(url, 'skillets', 'main', local_dir=str(store))
+    assert fetch_head.exists()
+    assert sl.get_skillet_with_name('one').get_snippets()[0].template_str == 'one v3'
+    assert git(path, 'rev-list', '--count', 'HEAD') == '1'
+
+    # other branches are fetched when first checked out
+    git(work, 'checkout', '-q', '-b', 'feature')
+    work.joinpath('three').mkdir()
+    work.joinpath('three', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='three'))
+    work.joinpath('three', 'template.txt').write_text('three')
+    commit(work, 'feature')
+
+    g.branch('feature')
+    assert g.Repo.active_branch.name == 'feature'
+    assert store.joinpath('skillets', 'three', '.meta-cnc.yaml').exists()
+
+
+def test_sparse_clone(remote, tmp_path):
+    url, work = remote
+    store = tmp_path.joinpath('store')
+
+    g = Git(url, str(store), sparse=True)
+    path = g.clone('skillets')
+
+    assert find_skillet_dirs(g.Repo) == ['one', 'two']
+    assert sorted(p.name for p in store.joinpath('skillets').iterdir() if p.name != '.git') == ['one', 'two']
+    assert store.joinpath('skillets', 'two', 'nested', 'template.txt').read_text() == 'two/nested v1'
+
+    # file contents outside of the skillet dirs are never fetched
+    missing = git(path, 'rev-list', '--objects', '--all', '--missing=print')
+    assert any(line.startswith('?') for line in missing.splitlines())
+
+    sl = SkilletLoader(path)
+    assert sorted(s.name for s in sl.skillets) == ['one', 'two']
+
+
+def test_sparse_clone_shared_snippets(remote, tmp_path):
+    url, work = remote
+    work.joinpath('common', 'snippets').mkdir(parents=True)
+    work.joinpath('common', 'snippets', 'shared.txt').write_text('shared')
+    work.joinpath('one', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='one') +
+                                                      '  - name: shared\n    file: ../common/snippets/shared.txt\n')
+    commit(work, 'shared snippets')
+
+    store = tmp_path.joinpath('store')
+    g = Git(url, str(store), sparse=True)
+    path = g.clone('skillets')
+
+    # dirs of snippet files referenced from outside of the skillet dirs are also checked out
+    assert find_snippet_dirs(g.Repo) == ['common/snippets', 'one', 'two']
+    assert sorted(p.name for p in store.joinpath('skillets').iterdir() if p.name != '.git') == \
+        ['common', 'one', 'two']
+    assert not store.joinpath('skillets', 'docs').exists()
+
+    sl = SkilletLoader(path)
+    assert [s.template_str for s in sl.get_skillet_with_name('one').get_snippets()] == ['one v2', 'shared']
+
+
+def test_load_from_git_objects(remote, tmp_path):
+    url, work = remote
+    git(work, 'tag', 'v1', 'HEAD~1')
+    git(work, 'push', '-q', 'origin', 'v1')
+
+    store = tmp_path.joinpath('store')
+    cache_dir = tmp_path.joinpath('cache')
+
+    def load(ref):
+        sl = SkilletLoader(cache_dir=cache_dir, lazy=True)
+        sl.load_from_git_ref(url, 'skillets', ref, local_dir=str(store))
+        return sl
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        main, v1 = executor.map(load, ['main', 'v1'])
+
+    assert sorted(s.name for s in main.skillets) == ['one', 'two']
+    assert main.get_skillet_with_name('one').get_snippets()[0].template_str == 'one v2'
+    assert v1.get_skillet_with_name('one').get_snippets()[0].template_str == 'one v1'
+
+    # the clone is never checked out
+    assert sorted(p.name for p in store.joinpath('skillets').iterdir()) == ['.git']
+
+    # metadata files are cached by their git object id, the snippet path always points into the loaded commit
+    again = load('v1')
+    assert again.cache.hits == 2 and again.cache.misses == 0
+    assert again.get_skillet_with_name('two').path != main.get_skillet_with_name('two').path
+
+
+def make_remote(tmp_path, repo_name, skillets) -> str:
+    bare = tmp_path.joinpath(f'{repo_name}.git')
+    git(tmp_path, 'init', '-q', '--bare', '-b', 'main', str(bare))
+    work = tmp_path.joinpath(f'{repo_name}-work')
+    git(tmp_path, 'clone', '-q', str(bare), str(work))
+    git(work, 'checkout', '-q', '-b', 'main')
+
+    for name, depends in skillets.items():
+        work.joinpath(name).mkdir()
+        work.joinpath(name, '.meta-cnc.yaml').write_text(skillet_yaml.format(name=name) + depends)
+        work.joinpath(name, 'template.txt').write_text(name)
+
+    commit(work, 'first')
+    return f'file://{bare}'
+
+
+def test_load_multiple_repositories(tmp_path):
+    urls = {name: f'file://{tmp_path}/{name}.git' for name in ('a', 'b', 'c')}
+
+    def depends(*names, url=None):
+        return 'depends:\n' + ''.join(f'  - url: {url or urls[n]}\n    name: {n}\n    branch: main\n' for n in names)
+
+    make_remote(tmp_path, 'a', {'a-one': depends('b'), 'a-two': ''})
+    make_remote(tmp_path, 'b', {'b-one': depends('c', 'a')})
+    make_remote(tmp_path, 'c', {'c-one': depends('b', url=urls['a'])})
+
+    sl = SkilletLoader()
+    skillets = sl.load_from_git_repos([{'url': urls['a'], 'name': 'a', 'branch': 'main'},
+                                       {'url': urls['a'], 'name': 'a-again', 'branch': 'main'},
+                                       {'url': f'file://{tmp_path}/missing.git', 'name': 'missing'}],
+                                      local_dir=str(tmp_path.joinpath('store')), max_workers=4)
+
+    # each repository is fetched once, dependencies are loaded after the requested repositories
+    names = [s.name for s in skillets]
+    assert sorted(names[:2]) == ['a-one', 'a-two'] and names[2:] == ['b-one', 'c-one']
+    assert sorted(p.name for p in tmp_path.joinpath('store').iterdir() if not p.name.startswith('.')) == \
+        ['a', 'b', 'c']
+    assert sl.get_skillet_with_name('c-one').get_snippets()[0].template_str == 'c-one'
+
+    # c-one depends on a different repository using the name 'b'
+    assert sorted(e['path'] for e in sl.skillet_errors) == ['b', 'missing']
+
+    # a local dir that is not a git repository is reported without stopping the other repositories
+    tmp_path.joinpath('store', 'not-a-repo').mkdir()
+    sl = SkilletLoader()
+    skillets = sl.load_from_git_repos([{'url': urls['c'], 'name': 'not-a-repo', 'branch': 'main'},
+                                       {'url': urls['a'], 'name': 'a', 'branch': 'main'}],
+                                      local_dir=str(tmp_path.joinpath('store')), resolve_depends=False)
+
+    assert sorted(s.name for s in skillets) == ['a-one', 'a-two']
+    assert [e['path'] for e in sl.skillet_errors] == ['not-a-repo']
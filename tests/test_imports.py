@@ -0,0 +1,48 @@
+# This script will import skilletlib in a new interpreter and verify the heavy dependencies needed only by some skillet
+# types are not imported until they are used
+
+import subprocess
+import sys
+
+from skilletlib.utils.testing_utils import setup_dir
+
+setup_dir()
+
+# modules only needed to work with PAN-OS devices, git repositories, or specific snippet outputs
+heavy_modules = ['skilletlib.panoply', 'lxml', 'pan.xapi', 'xmldiff', 'requests', 'requests_toolbelt', 'xmltodict',
+                 'git', 'jsonpath_ng', 'passlib', 'concurrent.futures.process']
+
+# modules only needed once skillets are loaded or rendered
+loader_modules = ['skilletlib.skilletLoader', 'jinja2', 'yaml']
+
+
+def run(code: str) -> str:
+    return subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True, cwd='..').stderr
+
+
+def test_import_skilletlib():
+    output = run(f'''
+import sys
+import skilletlib
+print([m for m in {heavy_modules + loader_modules!r} if m in sys.modules], file=sys.stderr)
+''')
+
+    assert output.splitlines()[-1] == '[]'
+
+
+def test_template_skillet_imports():
+    output = run(f'''
+import sys
+from skilletlib import SkilletLoader
+sl = SkilletLoader('example_skillets/template_skillet')
+assert 'value is: lazy' in sl.skillets[0].execute({{'SOME_VARIABLE': 'lazy'}})['template']
+print([m for m in {heavy_modules!r} if m in sys.modules], file=sys.stderr)
+''')
+
+    assert output.splitlines()[-1] == '[]'
+
+    # everything is still available from the package
+    output = run('import skilletlib; print(skilletlib.Panoply.__name__, skilletlib.SkilletLoader.__name__, '
+                 'sorted(set(skilletlib.__all__) - set(dir(skilletlib))), file=__import__("sys").stderr)')
+    assert output.splitlines()[-1] == 'Panoply SkilletLoader []'
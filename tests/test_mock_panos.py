@@ -0,0 +1,428 @@
+# This script will start the local PAN-OS XML API stand-in and exercise the online paths of Panoply against it
+
+import io
+
+import pytest
+import yaml
+
+from skilletlib import SkilletLoader
+from skilletlib import panoply
+from skilletlib.exceptions import PanoplyException
+from skilletlib.jobs import JobTracker
+from skilletlib.jobs import update_dynamic_content
+from skilletlib.skillet.handle import SkilletHandle
+from skilletlib.skillet.panos import LazyConfig
+from skilletlib.skillet.panos import PanosSkillet
+from skilletlib.utils.mock_panos import MockPanosServer
+from skilletlib.utils.testing_utils import setup_dir
+
+setup_dir()
+
+address_xpath = "/config/devices/entry[@name='localhost.localdomain']/vsys/entry[@name='vsys1']/address"
+address_element = '<entry name="test-address"><ip-netmask>10.0.0.1/32</ip-netmask></entry>'
+
+
+@pytest.fixture()
+def server():
+    with MockPanosServer() as s:
+        yield s
+
+
+def test_connect(server):
+    p = server.panoply()
+    assert p.connected
+    assert p.facts['model'] == 'PA-VM'
+    assert p.facts['dns-primary'] == '1.1.1.1'
+
+
+def test_set_and_commit(server):
+    p = server.panoply()
+    p.execute_cmd('set', {'xpath': address_xpath, 'element': address_element})
+
+    assert 'test-address' in p.get_configuration(config_source='candidate')
+    assert 'test-address' not in p.get_configuration()
+
+    p.commit()
+
+    assert 'test-address' in p.get_configuration()
+    assert 'ip-netmask' in p.execute_cmd('show', {'xpath': f"{address_xpath}/entry[@name='test-address']"})
+
+    p.execute_cmd('delete', {'xpath': f"{address_xpath}/entry[@name='test-address']"})
+    assert 'test-address' not in p.get_configuration(config_source='candidate')
+
+
+def test_multi_config(server):
+    p = server.panoply()
+    results = p.execute_multi_config([
+        ('set', {'xpath': address_xpath, 'element': address_element}),
+        ('edit', {'xpath': f"{address_xpath}/entry[@name='test-address']",
+                  'element': '<entry name="test-address"><fqdn>example.com</fqdn></entry>'}),
+    ])
+
+    assert [status for _, status in results] == ['success', 'success']
+    assert 'example.com' in p.get_configuration(config_source='candidate')
+
+
+def test_batched_skillet(server):
+    skillet_dict = {
+        'name': 'batched',
+        'type': 'panos',
+        'snippets': [
+            {'name': 'add_a', 'xpath': address_xpath, 'element': '<entry name="a"><fqdn>a.example.com</fqdn></entry>'},
+            {'name': 'add_b', 'xpath': address_xpath, 'element': '<entry name="b"><fqdn>b.example.com</fqdn></entry>'},
+            {'name': 'add_c', 'xpath': address_xpath, 'element': '<entry name="c"><fqdn>c.example.com</fqdn></entry>'},
+            {'name': 'add_bad', 'xpath': '/config/invalid[', 'element': '<entry name="bad"/>'},
+            {'name': 'add_d', 'xpath': address_xpath, 'element': '<entry name="d"><fqdn>d.example.com</fqdn></entry>'},
+            # rendered only after the pending batch has been pushed
+            {'name': 'get_d', 'cmd': 'get',
+             'xpath': address_xpath + "/entry[@name='{{ 'd' if add_d.results == 'success' else 'missing' }}']",
+             'outputs': [{'name': 'd_fqdn', 'capture_value': './/fqdn'}]},
+            {'name': 'add_e', 'xpath': address_xpath, 'element': '<entry name="e"><fqdn>e.example.com</fqdn></entry>'},
+            {'name': 'add_f', 'when': "add_e.results == 'success'", 'xpath': address_xpath,
+             'element': '<entry name="f"><fqdn>f.example.com</fqdn></entry>'},
+        ]
+    }
+
+    p = server.panoply()
+    sl = SkilletLoader()
+    skillet = PanosSkillet(sl.normalize_skillet_dict(skillet_dict), p)
+    server.reset_stats()
+
+    results = skillet.execute({'__batch_size': 2})
+    statuses = {name: output['results'] for name, output in results['snippets'].items()}
+
+    # only the failed command of a batch is reported as an error, the rest of that batch is still applied
+    assert statuses == {'add_a': 'success', 'add_b': 'success', 'add_c': 'success', 'add_bad': 'error',
+                        'add_d': 'success', 'get_d': 'success', 'add_e': 'success', 'add_f': 'success'}
+    assert results['outputs']['d_fqdn'] == 'd.example.com'
+
+    # [a, b], [c, bad], [d], get, [e], [f]
+    assert server.requests['config'] == 6
+
+    candidate = p.get_configuration(config_source='candidate')
+    assert all(f'{name}.example.com' in candidate for name in ('a', 'b', 'c', 'd', 'e', 'f'))
+    assert 'name="bad"' not in candidate
+
+
+def test_batched_skillet_errors(server):
+    skillet_dict = {
+        'name': 'batched',
+        'type': 'panos',
+        'snippets': [
+            {'name': f'add_{name}', 'xpath': address_xpath, 'element': f'<entry name="{name}"><fqdn>x</fqdn></entry>'}
+            for name in ('a', 'b', 'c')
+        ]
+    }
+
+    p = server.panoply()
+    skillet = PanosSkillet(SkilletLoader().normalize_skillet_dict(skillet_dict), p)
+    server.inject_errors([500, 500])
+
+    # both batches fail, the results of every snippet are still returned
+    results = skillet.execute({'__batch_size': 2})
+
+    assert {name: output['results'] for name, output in results['snippets'].items()} == \
+        {'add_a': 'error', 'add_b': 'error', 'add_c': 'error'}
+    assert server.errors == 2
+    assert 'name="a"' not in p.get_configuration(config_source='candidate')
+
+
+def test_bulk_load(server, monkeypatch):
+    p = server.panoply()
+    entries = [f'<entry name="bulk-{i}"><ip-netmask>10.0.0.{i}/32</ip-netmask></entry>' for i in range(10)]
+    entries[5] = '<entry name="bad"><ip-netmask>10.0.0.5/32</entry>'
+
+    sleeps = list()
+    monkeypatch.setattr('skilletlib.panoply.time.sleep', sleeps.append)
+    server.reset_stats()
+    server.inject_errors([503])
+
+    progress = list()
+    results = p.bulk_load(address_xpath, entries, max_chunk_entries=4, max_workers=1,
+                          progress_callback=lambda loaded, failed: progress.append((loaded, failed)))
+
+    assert results['loaded'] == 9
+    assert [f['entry'] for f in results['failed']] == [entries[5]]
+    assert 'Could not parse element' in results['failed'][0]['error']
+
+    # [0-3] after one retry, [4-7] split into [4, 5] and [6, 7], then [4] [5], and [8, 9]
+    assert results['requests'] == 7
+    assert server.requests['config'] == 8 and sleeps == [2]
+    assert progress == [(4, 0), (7, 1), (9, 1)]
+
+    candidate = p.get_configuration(config_source='candidate')
+    assert all(f'bulk-{i}' in candidate for i in range(10) if i != 5)
+    assert 'name="bad"' not in candidate
+
+
+def test_import_and_load(server):
+    p = server.panoply()
+    p.import_file('saved.xml', p.get_configuration(), 'configuration')
+
+    assert 'saved.xml' in p.list_saved_configurations()
+    assert p.load_config('saved.xml')
+
+
+def test_jobs(server):
+    server.device.job_duration = 0.5
+    p = server.panoply()
+    p.xapi.commit(cmd='<commit></commit>')
+    job_id = p.xapi.element_result.find('./job').text
+
+    assert p.get_job_status(job_id)['status'] == 'ACT'
+    assert p.wait_for_jobs([job_id], timeout=10)
+
+    # jobs fail once the device cannot be queried several times in a row, well before the timeout
+    server.device.job_duration = 60
+    p.xapi.commit(cmd='<commit></commit>')
+    job_id = p.xapi.element_result.find('./job').text
+    server.inject_errors([503, 403, 403])
+
+    tracker = JobTracker(min_interval=0.05, max_errors=3, timeout=30)
+    tracker.add_job(p, job_id)
+    result = next(iter(tracker.wait(timeout=10).values()))
+
+    assert result['result'] == 'ERROR' and not result['success']
+    assert '403' in result['details']
+    assert server.errors == 3
+
+
+def test_error_injection(server):
+    p = server.panoply()
+    server.inject_errors([503])
+
+    with pytest.raises(PanoplyException):
+        p.execute_cmd('show', {'xpath': address_xpath})
+
+    assert server.errors == 1
+    assert p.execute_cmd('show', {'xpath': address_xpath}) is not None
+
+
+def test_show_from_cached_config(server):
+    p = server.panoply()
+    context = {'__cache_config': True, 'config': p.get_configuration()}
+    server.reset_stats()
+
+    output = p.execute_cmd('show', {'xpath': address_xpath}, context)
+    assert output == '<address/>'
+    assert server.requests['config'] == 0
+
+    # anything that may change the running configuration sends further queries to the device
+    p.execute_cmd('set', {'xpath': address_xpath, 'element': address_element})
+    p.commit()
+    assert 'test-address' in p.execute_cmd('show', {'xpath': address_xpath}, context)
+    assert server.requests['config'] == 2
+
+    # the configuration of a later skillet is retrieved when first needed and used again from then on
+    server.reset_stats()
+    context = {'__cache_config': True, 'config': LazyConfig(p.get_configuration)}
+
+    for _ in range(3):
+        assert 'test-address' in p.execute_cmd('show', {'xpath': address_xpath}, context)
+
+    assert server.requests['op'] == 1 and server.requests['config'] == 0
+
+    # configurations that were not retrieved with get_configuration are never used, even if they are equal
+    context = {'__cache_config': True, 'config': p.get_configuration().encode().decode()}
+    p.execute_cmd('show', {'xpath': address_xpath}, context)
+    assert server.requests['config'] == 1
+
+
+def test_op_cache(server):
+    p = server.panoply()
+    server.reset_stats()
+
+    # system info was already retrieved while connecting
+    for _ in range(3):
+        p.get_facts()
+        p.has_running_jobs()
+
+    assert server.requests['op'] == 1
+
+    # configuration changes clear the cache, snippets may bypass it with 'cache: false'
+    p.execute_cmd('set', {'xpath': address_xpath, 'element': address_element})
+    p.has_running_jobs()
+    p.execute_cmd('op', {'cmd_str': '<show><jobs><all/></jobs></show>', 'cache': False})
+    assert server.requests['op'] == 3
+
+    # cached cmds that are not 'show' cmds are used again and do not clear the cache
+    for _ in range(2):
+        assert 'PA-VM' in p.execute_op('<request><license><info/></license></request>')
+
+    p.has_running_jobs()
+    assert server.requests['op'] == 4
+
+
+def test_panorama_fan_out(tmp_path):
+    with MockPanosServer(system_info={'model': 'Panorama', 'serial': '000700000001'}) as server:
+        for i in range(4):
+            server.device.add_managed_device({'serial': f'00790000000{i}', 'hostname': f'fw-{i}',
+                                              'model': 'PA-VM' if i % 2 else 'PA-220'})
+
+        panorama = server.panoply()
+        results = panorama.fan_out(lambda d: d.get_facts()['hostname'], {'model': 'PA-VM'})
+
+        assert results == {
+            '007900000001': {'success': True, 'result': 'fw-1', 'error': ''},
+            '007900000003': {'success': True, 'result': 'fw-3', 'error': ''},
+        }
+
+        # a failure on one device is reported for that device only
+        def hostname_or_fail(device):
+            hostname = device.get_facts()['hostname']
+
+            if hostname == 'fw-2':
+                raise PanoplyException('boom')
+
+            return hostname
+
+        results = panorama.fan_out(hostname_or_fail)
+        assert {serial: r['result'] or r['error'] for serial, r in results.items()} == {
+            '007900000000': 'fw-0', '007900000001': 'fw-1', '007900000002': 'boom', '007900000003': 'fw-3',
+        }
+        assert results['007900000002']['success'] is False
+
+        skillet_dict = {
+            'name': 'read_hostname',
+            'type': 'panos',
+            'snippets': [
+                {
+                    'name': 'system_info',
+                    'cmd': 'op',
+                    'cmd_str': '<show><system><info/></system></show>',
+                    'outputs': [{'name': 'hostname', 'capture_value': './/hostname'}]
+                }
+            ]
+        }
+
+        sl = SkilletLoader()
+        skillet = sl.create_skillet(sl.normalize_skillet_dict(skillet_dict))
+        server.reset_stats()
+        results = panorama.execute_skillet_on_devices(skillet)
+
+        assert len(results) == 4
+        assert results['007900000002']['result']['outputs']['hostname'] == 'fw-2'
+        # the configuration of each device is never retrieved for op only skillets
+        assert server.requests['config'] == 0
+
+        # skillets loaded by a lazy loader are handles until first used
+        tmp_path.joinpath('.meta-cnc.yaml').write_text(yaml.safe_dump(skillet_dict))
+        handle = SkilletLoader(tmp_path, lazy=True).skillets[0]
+        assert isinstance(handle, SkilletHandle) and not handle.loaded
+
+        results = panorama.execute_skillet_on_devices(handle, filter_terms={'model': 'PA-220'})
+        assert {serial: r['result']['outputs']['hostname'] for serial, r in results.items()} == {
+            '007900000000': 'fw-0',
+            '007900000002': 'fw-2',
+        }
+
+
+def test_export_configuration(server, tmp_path):
+    p = server.panoply()
+    p.execute_cmd('set', {'xpath': address_xpath, 'element': address_element})
+    p.commit()
+
+    path = tmp_path / 'running.xml'
+    written = p.export_configuration(str(path), chunk_size=256)
+    assert written == path.stat().st_size
+    assert 'test-address' in path.read_text()
+
+    p.import_file('saved.xml', path.read_bytes(), 'configuration')
+    output = io.BytesIO()
+    p.export_configuration(output, configuration_name='saved.xml')
+    assert output.getvalue() == path.read_bytes()
+
+    # failed exports never leave a partial file behind
+    with pytest.raises(PanoplyException):
+        p.export_configuration(str(tmp_path / 'missing.xml'), configuration_name='missing.xml')
+
+    assert sorted(f.name for f in tmp_path.iterdir()) == ['running.xml']
+
+
+def test_import_streaming(server, tmp_path):
+    p = server.panoply()
+    path = tmp_path / 'content.bin'
+    path.write_bytes(b'x' * 100000)
+
+    progress = list()
+    p.import_file('content.bin', path, 'content', progress_callback=lambda sent, total: progress.append((sent, total)),
+                  timeout=10)
+
+    assert server.device.imported_files['content.bin'] == path.read_bytes()
+    assert progress[-1][0] == progress[-1][1] and len(progress) > 1
+
+    with path.open('rb') as f:
+        p.import_file('other.bin', f, 'content')
+
+    assert server.device.imported_files['other.bin'] == path.read_bytes()
+
+
+def test_generate_baseline(server):
+    p = server.panoply()
+    baseline = p.generate_baseline()
+    assert '<hostname>mock-panos</hostname>' in baseline
+
+    # the baseline template is compiled once and shared by all devices
+    template = panoply._baseline_templates[('panos', 'baseline_91')]
+    assert '<hostname>baseline</hostname>' in server.panoply().generate_baseline(reset_hostname=True)
+    assert panoply._baseline_templates[('panos', 'baseline_91')] is template
+
+
+def test_update_dynamic_content():
+    with MockPanosServer(system_info={'model': 'Panorama', 'serial': '000700000001'}, job_duration=0.2) as server:
+        for i in range(3):
+            server.device.add_managed_device({'serial': f'00790000000{i}', 'hostname': f'fw-{i}',
+                                              'app-version': '8000-1000'})
+
+        server.device.managed_devices['007900000000'].content_available['wildfire'] = '400000-1000'
+        panorama = server.panoply()
+        devices = [panorama.get_managed_device(d['serial']) for d in panorama.filter_connected_devices()]
+
+        results = update_dynamic_content(devices, poll_interval=0.1)
+
+        assert len(results) == 3
+        assert all(r['success'] for device in results.values() for r in device.values())
+        assert results['007900000001']['anti-virus'] == {'version': '3001-1001', 'status': 'installed',
+                                                         'success': True, 'details': ''}
+        assert results['007900000000']['wildfire']['status'] == 'current'
+
+        for device in server.device.managed_devices.values():
+            assert device.content_versions['content'] == '8001-1001'
+
+        # everything is now up to date
+        assert panorama.get_managed_device('007900000001').update_all_dynamic_content() == {
+            t: {'version': None, 'status': 'current', 'success': True, 'details': ''}
+            for t in ('content', 'anti-virus', 'wildfire')
+        }
+
+
+def test_content_install_updates_facts():
+    with MockPanosServer(job_duration=0.1) as server:
+        p = server.panoply()
+        assert p.get_facts()['app-version'] == '8000-1000'
+        assert p.get_facts()['av-version'] == '3000-1000'
+
+        # the cached system info must not be returned once new content is installed
+        assert p.update_dynamic_content('content')
+        assert p.get_facts()['app-version'] == '8001-1001'
+
+        results = update_dynamic_content([p], ['anti-virus'], poll_interval=0.1)
+        assert next(iter(results.values()))['anti-virus']['status'] == 'installed'
+        assert p.get_facts()['av-version'] == '3001-1001'
+
+
+def test_commit_gpcs():
+    with MockPanosServer(system_info={'model': 'Panorama'}, job_duration=0.1) as server:
+        p = server.panoply()
+        p.execute_cmd('set', {'xpath': "/config/devices/entry[@name='localhost.localdomain']/device-group",
+                              'element': '<entry name="Remote_Network_Device_Group"/>'
+                                         '<entry name="Mobile_User_Device_Group"/>'})
+        p.commit()
+        server.reset_stats()
+
+        assert p.commit_gpcs() == 'Prisma Access Committed Successfully'
+
+        # one small query per device group and a commit-all for each that exists, the config is never retrieved
+        assert server.requests['config'] == 3
+        assert server.requests['commit'] == 2
+        assert [job['status'] for job in server.device.jobs.values() if job['type'] == 'CommitAll'] == ['FIN', 'FIN']
@@ -0,0 +1,97 @@
+# This script will load the example configuration found in 'tests/example_config/config.xml'
+# and then apply configuration snippets to it offline
+
+
+from skilletlib import SkilletLoader
+from skilletlib.candidate import CandidateConfig
+from skilletlib.utils.testing_utils import setup_dir
+
+setup_dir()
+
+with open('example_config/config.xml', 'r') as config:
+    example_config = config.read()
+
+address_xpath = "/config/devices/entry[@name='localhost.localdomain']/vsys/entry[@name='vsys1']/address"
+
+
+def test_candidate_config_cmds():
+    c = CandidateConfig(example_config)
+    c.set(address_xpath, '<entry name="a1"><ip-netmask>10.0.0.1/32</ip-netmask></entry>'
+                         '<entry name="a2"><ip-netmask>10.0.0.2/32</ip-netmask></entry>')
+    assert '10.0.0.1/32' in c.show(f"{address_xpath}/entry[@name='a1']")
+
+    # set merges, edit replaces
+    c.set(f"{address_xpath}/entry[@name='a1']", '<description>first</description>')
+    assert 'ip-netmask' in c.show(f"{address_xpath}/entry[@name='a1']")
+    c.edit(f"{address_xpath}/entry[@name='a1']", '<entry name="a1"><fqdn>example.com</fqdn></entry>')
+    assert 'ip-netmask' not in c.show(f"{address_xpath}/entry[@name='a1']")
+
+    c.move(f"{address_xpath}/entry[@name='a2']", 'before', 'a1')
+    names = [e.get('name') for e in c.find(f'{address_xpath}/entry')]
+    assert names.index('a2') < names.index('a1')
+
+    c.rename(f"{address_xpath}/entry[@name='a2']", 'a3')
+    c.clone(address_xpath, f"{address_xpath}/entry[@name='a3']", 'a4')
+    c.delete(f"{address_xpath}/entry[@name='a1']")
+
+    names = [e.get('name') for e in c.find(f'{address_xpath}/entry')]
+    assert 'a1' not in names and 'a3' in names and 'a4' in names
+    assert c.changed
+
+
+def test_offline_skillet_execution():
+    skillet_dict = {
+        'name': 'offline_set',
+        'type': 'panos',
+        'snippets': [
+            {
+                'name': 'add_address',
+                'cmd': 'set',
+                'xpath': address_xpath,
+                'element': '<entry name="{{ address_name }}"><ip-netmask>10.1.1.1/32</ip-netmask></entry>'
+            },
+            {
+                'name': 'get_address',
+                'cmd': 'get',
+                'xpath': f"{address_xpath}/entry[@name='{{{{ address_name }}}}']",
+                'outputs': [{'name': 'netmask', 'capture_value': '/entry/ip-netmask'}]
+            }
+        ]
+    }
+
+    sl = SkilletLoader()
+    skillet = sl.create_skillet(sl.normalize_skillet_dict(skillet_dict))
+    results = skillet.execute({'config': example_config, 'address_name': 'offline-address'})
+
+    assert results['snippets']['add_address']['results'] == 'success'
+    assert results['outputs']['netmask'] == '10.1.1.1/32'
+    assert 'offline-address' in results['candidate_config']
+    assert 'offline-address' not in example_config
+
+
+def test_offline_config_file_execution():
+    skillet_dict = {
+        'name': 'offline_validate',
+        'type': 'panos',
+        'snippets': [
+            {
+                'name': 'add_address',
+                'cmd': 'set',
+                'xpath': address_xpath,
+                'element': '<entry name="file-address"><ip-netmask>10.2.2.2/32</ip-netmask></entry>'
+            },
+            {
+                'name': 'check_address',
+                'cmd': 'validate_xml',
+                'xpath': f"{address_xpath}/entry[@name='file-address']",
+                'element': '<entry name="file-address"><ip-netmask>10.2.2.2/32</ip-netmask></entry>'
+            }
+        ]
+    }
+
+    sl = SkilletLoader()
+    skillet = sl.create_skillet(sl.normalize_skillet_dict(skillet_dict))
+    results = skillet.execute({'config_file': 'example_config/config.xml'})
+
+    assert results['snippets']['check_address']['results'] == 'success'
+    assert 'file-address' in results['candidate_config']
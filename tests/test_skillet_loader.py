@@ -0,0 +1,291 @@
+# This script will load skillets from disk and verify the loader finds the same skillets and reports the same
+# errors whether the metadata files are parsed serially, in parallel, or read from the metadata cache
+
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import time
+
+import pytest
+from jinja2 import Environment
+
+from skilletlib import SkilletLoader
+from skilletlib import bundle
+from skilletlib import cache
+from skilletlib.exceptions import SkilletLoaderException
+from skilletlib.snippet import base as snippet_base
+from skilletlib.utils.testing_utils import setup_dir
+from skilletlib.watcher import SkilletWatcher
+
+setup_dir()
+
+skillet_yaml = '''
+name: {name}
+label: {name}
+type: template
+snippets:
+  - name: template
+    element: hello
+'''
+
+
+def test_load_in_parallel():
+    serial = SkilletLoader('../example_skillets')
+    parallel = SkilletLoader('../example_skillets', max_workers=4)
+
+    assert len(serial.skillets) > 1
+    assert [s.name for s in parallel.skillets] == [s.name for s in serial.skillets]
+    assert parallel.skillet_errors == serial.skillet_errors
+
+
+def test_pruning_and_errors(tmp_path):
+    for name in ('one', 'two', 'one/nested', '.git/hidden', 'broken'):
+        skillet_dir = tmp_path.joinpath(name)
+        skillet_dir.mkdir(parents=True)
+        skillet_dir.joinpath('.meta-cnc.yaml').write_text(skillet_yaml.format(name=skillet_dir.name))
+
+    tmp_path.joinpath('broken', '.meta-cnc.yaml').write_text('name: [broken')
+
+    for max_workers in (1, 2):
+        sl = SkilletLoader()
+        skillets = sl.load_all_skillets_from_dir(tmp_path, max_workers=max_workers)
+
+        # skillets nested below another skillet or inside a .git dir are never loaded
+        assert sorted(s.name for s in skillets) == ['one', 'two']
+        assert len(sl.skillet_errors) == 1
+        assert sl.skillet_errors[0]['path'] == str(tmp_path.joinpath('broken', '.meta-cnc.yaml'))
+        assert sl.skillet_errors[0]['error'].startswith('YAMLError')
+
+
+def test_metadata_cache(tmp_path):
+    cache_dir = tmp_path.joinpath('cache')
+    skillet_dir = tmp_path.joinpath('skillets', 'one')
+    skillet_dir.mkdir(parents=True)
+    meta_cnc_file = skillet_dir.joinpath('.meta-cnc.yaml')
+    meta_cnc_file.write_text(skillet_yaml.format(name='one').replace('element: hello', 'file: template.txt'))
+    skillet_dir.joinpath('template.txt').write_text('hello {{ name }}')
+
+    cold = SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir)
+    assert cold.cache.hits == 0
+
+    warm = SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir)
+    assert warm.cache.hits == 2 and warm.cache.misses == 0
+    assert warm.skillets[0].skillet_dict == cold.skillets[0].skillet_dict
+
+    # touching a file without changing it falls back to comparing the hash
+    stat = meta_cnc_file.stat()
+    os.utime(str(meta_cnc_file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir).cache.hits == 2
+
+    meta_cnc_file.write_text(skillet_yaml.format(name='renamed').replace('element: hello', 'file: template.txt'))
+    changed = SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir)
+    assert changed.skillets[0].name == 'renamed'
+    assert changed.cache.hits == 1 and changed.cache.misses == 1
+
+
+class Unpickled:
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def __reduce__(self):
+        return open, (self.path, 'w')
+
+
+def test_metadata_cache_is_json(tmp_path):
+    cache_dir = tmp_path.joinpath('cache')
+    skillet_dir = tmp_path.joinpath('skillets', 'one')
+    skillet_dir.mkdir(parents=True)
+    skillet_dir.joinpath('.meta-cnc.yaml').write_text(skillet_yaml.format(name='one'))
+
+    cold = SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir)
+    cold.cache.close()
+
+    connection = sqlite3.connect(str(cache_dir.joinpath(cache.cache_file_name)))
+    value, = connection.execute("SELECT value FROM entries WHERE kind = 'skillet'").fetchone()
+    assert json.loads(value)['name'] == 'one'
+
+    # anything else written to the cache is never loaded
+    marker = tmp_path.joinpath('unpickled')
+    connection.execute("UPDATE entries SET value = ? WHERE kind = 'skillet'", (pickle.dumps(Unpickled(marker)),))
+    connection.commit()
+
+    warm = SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir)
+    assert warm.skillets[0].name == 'one'
+    assert not marker.exists()
+
+    # skillets that JSON cannot represent are not cached
+    skillet_dir.joinpath('.meta-cnc.yaml').write_text(skillet_yaml.format(name='one') + 'labels:\n  added: 2020-01-01\n')
+    SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir)
+    assert SkilletLoader(tmp_path.joinpath('skillets'), cache_dir=cache_dir).cache.hits == 0
+
+
+def test_lazy_skillets():
+    sl = SkilletLoader('../example_skillets', lazy=True)
+    eager = SkilletLoader('../example_skillets')
+
+    assert [s.name for s in sl.skillets] == [s.name for s in eager.skillets]
+    assert not any(s.loaded for s in sl.skillets)
+    assert sl.load_all_label_values('collection') == eager.load_all_label_values('collection')
+
+    skillet = sl.get_skillet_with_name(eager.skillets[0].name)
+    assert sorted(skillet.declared_variables) == sorted(eager.skillets[0].declared_variables)
+    assert skillet.loaded
+    assert sum(s.loaded for s in sl.skillets) == 1
+
+
+def test_skillet_indexes():
+    sl = SkilletLoader('../example_skillets')
+    first = sl.skillets[0]
+    collection = first.collections[0]
+
+    assert sl.get_skillet_with_name(first.name) is first
+    assert sl.get_skillet_with_name('does-not-exist') is None
+    assert sl.get_skillets_in_collection(collection) == [s for s in sl.skillets if collection in s.collections]
+    assert sl.query(collection=collection, skillet_type=first.type) == \
+        [s for s in sl.skillets if collection in s.collections and s.type == first.type]
+    assert sl.query(labels={'collection': None}) == [s for s in sl.skillets if 'collection' in s.labels]
+    assert collection in sl.load_all_label_values('collection')
+
+    # the indexes follow changes to the skillets list
+    sl.skillets.remove(first)
+    assert sl.get_skillet_with_name(first.name) is next((s for s in sl.skillets if s.name == first.name), None)
+
+
+def test_label_values(tmp_path):
+    labels = {
+        'one': 'labels:\n  collection: [Example, Other]\n  os: panos\n',
+        'two': 'labels:\n  collection: Example\n  os: [panos, panorama]\n',
+    }
+
+    for name, label_yaml in labels.items():
+        tmp_path.joinpath(name).mkdir()
+        tmp_path.joinpath(name, '.meta-cnc.yaml').write_text(skillet_yaml.format(name=name) + label_yaml)
+
+    sl = SkilletLoader(str(tmp_path))
+
+    # string values are returned whole and each item of a list value is returned once
+    assert sl.load_all_label_values('collection') == ['Example', 'Other']
+    assert sl.load_all_label_values('os') == ['panos', 'panorama']
+    assert sl.load_all_label_values('missing') == []
+
+
+def test_reload_paths(tmp_path):
+    for name in ('one', 'two', 'three'):
+        skillet_dir = tmp_path.joinpath(name)
+        skillet_dir.mkdir()
+        skillet_dir.joinpath('.meta-cnc.yaml').write_text(skillet_yaml.format(name=name))
+
+    tmp_path.joinpath('two', '.meta-cnc.yaml').write_text(
+        skillet_yaml.format(name='two').replace('element: hello', 'file: template.txt'))
+    tmp_path.joinpath('two', 'template.txt').write_text('hello')
+
+    sl = SkilletLoader(tmp_path)
+    one, two, three = (sl.get_skillet_with_name(n) for n in ('one', 'two', 'three'))
+
+    tmp_path.joinpath('one', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='renamed'))
+    tmp_path.joinpath('two', 'template.txt').write_text('goodbye')
+    shutil.rmtree(str(tmp_path.joinpath('three')))
+    tmp_path.joinpath('four').mkdir()
+    tmp_path.joinpath('four', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='four'))
+
+    results = sl.reload_paths([tmp_path.joinpath('one', '.meta-cnc.yaml'), tmp_path.joinpath('two', 'template.txt'),
+                               tmp_path.joinpath('three'), tmp_path.joinpath('four')])
+
+    assert results == {'added': ['four'], 'updated': ['one', 'two'], 'removed': ['three']}
+    assert [s.name for s in sl.skillets] == ['renamed', 'two', 'four']
+    assert sl.get_skillet_with_name('one') is None and sl.get_skillet_with_name('three') is None
+    assert sl.get_skillet_with_name('two') is not two
+    assert sl.get_skillet_with_name('two').get_snippets()[0].template_str == 'goodbye'
+
+    # unrelated changes leave the loaded skillets untouched
+    renamed = sl.get_skillet_with_name('renamed')
+    assert sl.reload_paths([tmp_path.joinpath('README.md')]) == {'added': [], 'updated': [], 'removed': []}
+    assert sl.get_skillet_with_name('renamed') is renamed and one not in sl.skillets and three not in sl.skillets
+
+    # broken skillets are removed and reported as errors until fixed
+    tmp_path.joinpath('four', '.meta-cnc.yaml').write_text('name: [broken')
+    assert sl.reload_paths([tmp_path.joinpath('four', '.meta-cnc.yaml')])['removed'] == ['four']
+    assert [e['path'] for e in sl.skillet_errors] == [str(tmp_path.joinpath('four', '.meta-cnc.yaml'))]
+
+    tmp_path.joinpath('four', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='four'))
+    assert sl.reload_paths([tmp_path.joinpath('four', '.meta-cnc.yaml')])['added'] == ['four']
+    assert sl.skillet_errors == []
+
+    # skillets nested below another skillet are never loaded
+    tmp_path.joinpath('two', 'nested').mkdir()
+    tmp_path.joinpath('two', 'nested', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='nested'))
+    assert sl.reload_paths([tmp_path.joinpath('two', 'nested')])['added'] == []
+
+
+def test_skillet_watcher(tmp_path):
+    tmp_path.joinpath('one').mkdir()
+    tmp_path.joinpath('one', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='one'))
+
+    sl = SkilletLoader(tmp_path)
+    changes = list()
+
+    with SkilletWatcher(sl, interval=0.05, callback=changes.append):
+        tmp_path.joinpath('two').mkdir()
+        tmp_path.joinpath('two', '.meta-cnc.yaml').write_text(skillet_yaml.format(name='two'))
+
+        deadline = time.time() + 10
+
+        while not changes and time.time() < deadline:
+            time.sleep(0.05)
+
+    assert changes == [{'added': ['two'], 'updated': [], 'removed': []}]
+    assert [s.name for s in sl.skillets] == ['one', 'two']
+
+
+def test_skillet_bundle(tmp_path, monkeypatch):
+    shutil.copytree('../example_skillets', str(tmp_path.joinpath('skillets')))
+    original = SkilletLoader(tmp_path.joinpath('skillets'))
+    expected = original.get_skillet_with_name('template_example').execute({'SOME_VARIABLE': 'bundled'})
+
+    bundle_path = tmp_path.joinpath('skillets.zip')
+    assert original.build_bundle(bundle_path) == len(original.skillets)
+
+    # the bundle does not depend on the skillet dir or compiling any templates
+    shutil.rmtree(str(tmp_path.joinpath('skillets')))
+    monkeypatch.setattr(snippet_base, '_template_code', dict())
+    monkeypatch.setattr(snippet_base, 'template_code_providers', dict())
+    monkeypatch.setattr(bundle, '_bundles', dict())
+    compiled = list()
+    compile_template = Environment.compile
+    monkeypatch.setattr(Environment, 'compile', lambda env, source, *args, **kwargs:
+                        compiled.append(source) or compile_template(env, source, *args, **kwargs))
+
+    sl = SkilletLoader()
+    sl.load_from_bundle(bundle_path)
+    assert [s.name for s in sl.skillets] == [s.name for s in original.skillets]
+    assert not any(s.loaded for s in sl.skillets)
+    assert sl.load_all_label_values('collection') == original.load_all_label_values('collection')
+
+    skillet = sl.get_skillet_with_name('template_example')
+    assert skillet.execute({'SOME_VARIABLE': 'again'}) == \
+        {**expected, 'template': expected['template'].replace('bundled', 'again')}
+    assert sum(s.loaded for s in sl.skillets) == 1
+
+    # every template in the skillet was precompiled
+    assert compiled == []
+
+    # the bundle is opened once for every loader using it, until it changes or is closed
+    again = SkilletLoader()
+    again.load_from_bundle(bundle_path)
+    assert len(bundle._bundles) == 1 and len(snippet_base.template_code_providers) == 1
+
+    opened = bundle._bundles[str(bundle_path.resolve())]
+    stat = bundle_path.stat()
+    os.utime(str(bundle_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    again.load_from_bundle(bundle_path)
+    assert bundle._bundles[str(bundle_path.resolve())] is not opened
+    assert len(snippet_base.template_code_providers) == 1
+
+    bundle.close_bundle(bundle_path)
+    assert bundle._bundles == {} and snippet_base.template_code_providers == {}
+
+    with pytest.raises(SkilletLoaderException):
+        again.skillets[0].get_snippets()
@@ -0,0 +1,171 @@
+# This script will drive the adaptive limiter with a fake clock and verify the token bucket, the AIMD concurrency
+# window, and that every request sent by Panoply passes through the limiter for its device
+
+import ssl
+import threading
+
+import requests
+from pan import xapi
+
+from skilletlib.throttle import AdaptiveLimiter
+from skilletlib.throttle import ThrottledPanXapi
+from skilletlib.throttle import _SSLContextAdapter
+from skilletlib.utils.mock_panos import MockPanosServer
+from skilletlib.utils.testing_utils import setup_dir
+
+setup_dir()
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def wait(self, timeout=None) -> None:
+        # waiting on the limiter only ever advances the fake clock
+        assert timeout is not None, 'limiter would block forever'
+        self.now += timeout
+
+
+def fake_limiter(**kwargs) -> (AdaptiveLimiter, FakeClock):
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(clock=clock, **kwargs)
+    limiter._condition.wait = clock.wait
+    return limiter, clock
+
+
+def request(limiter: AdaptiveLimiter, latency: float = 0.1, error: str = None) -> None:
+    limiter.acquire()
+    limiter.release(latency, error)
+
+
+def test_token_refill():
+    limiter, clock = fake_limiter(max_concurrency=4, rate=2, burst=2)
+
+    # the burst is admitted immediately, then requests are spaced out by the rate
+    request(limiter)
+    request(limiter)
+    assert limiter.total_wait == 0
+
+    request(limiter)
+    assert limiter.total_wait == 0.5
+    assert clock.now == 1000.5
+
+    # tokens never accumulate beyond the burst
+    clock.now += 60
+    request(limiter)
+    request(limiter)
+    request(limiter)
+    assert limiter.total_wait == 1.0
+    assert limiter.metrics()['requests'] == 6
+
+
+def test_aimd_window():
+    limiter, clock = fake_limiter(max_concurrency=8, rate=None, latency_target=1.0)
+    assert limiter.limit == 2
+
+    # each fast request grows the window by 1 / window
+    for _ in range(10):
+        request(limiter)
+
+    assert 4 < limiter.limit < 5
+
+    # a slow response halves the window, responses within the same latency window do not decrease it again
+    limit = limiter.limit
+    request(limiter, latency=2.5)
+    assert limiter.limit == limit / 2
+
+    request(limiter, error='URLError: code: 503 reason: Service Unavailable')
+    assert limiter.limit == limit / 2
+
+    clock.now += 1.5
+    request(limiter, error='URLError: code: 503 reason: Service Unavailable')
+    assert limiter.limit == limit / 4
+
+    # errors that are not caused by load and responses between the target and twice the target do not change it
+    request(limiter, error='Invalid credentials.')
+    request(limiter, latency=1.5)
+    assert limiter.limit == limit / 4
+
+    # the window never shrinks below the minimum
+    for _ in range(5):
+        clock.now += 1.5
+        request(limiter, latency=10)
+
+    assert limiter.limit == 1
+    assert limiter.metrics()['overloads'] == 8 and limiter.metrics()['errors'] == 3
+
+    # and recovers up to the maximum once the device keeps up again
+    for _ in range(100):
+        request(limiter)
+
+    assert limiter.limit == 8
+
+
+def test_concurrency_limit():
+    limiter = AdaptiveLimiter(max_concurrency=1, rate=None)
+    limiter.acquire()
+
+    acquired = threading.Event()
+
+    def second():
+        limiter.acquire()
+        acquired.set()
+        limiter.release(0.1)
+
+    thread = threading.Thread(target=second)
+    thread.start()
+
+    assert not acquired.wait(0.2)
+    assert limiter.metrics()['in_flight'] == 1
+
+    limiter.release(0.1)
+    assert acquired.wait(5)
+    thread.join()
+    assert limiter.metrics()['in_flight'] == 0
+
+
+def test_requests_are_throttled():
+    # ThrottledPanXapi relies on this private method of pan-python
+    assert hasattr(xapi.PanXapi, '_PanXapi__api_request')
+
+    with MockPanosServer() as server:
+        p = server.panoply()
+        assert isinstance(p.xapi, ThrottledPanXapi)
+
+        before = p.get_throttle_metrics()['requests']
+        p.xapi.op(cmd='<show><system><info/></system></show>')
+        p.clone_xapi().op(cmd='<show><system><info/></system></show>')
+
+        assert p.get_throttle_metrics()['requests'] == before + 2
+
+
+class RecordingSession(requests.Session):
+
+    def post(self, url, **kwargs):
+        # record how the request would be sent rather than connecting to the device
+        self.sent = {'adapter': self.get_adapter(url), 'verify': kwargs.get('verify', self.verify)}
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/xml'
+        response._content = b'<response status="success"><result/></response>'
+        return response
+
+
+def test_session_certificate_verification():
+    def send(ssl_context: ssl.SSLContext = None) -> dict:
+        session = RecordingSession()
+        ThrottledPanXapi(api_key='key', hostname='fw', session=session, ssl_context=ssl_context).op(cmd='<show/>')
+        return session.sent
+
+    # certificates are verified against the CA bundle unless verification is disabled by the context
+    assert send()['verify'] is True
+    assert send(ssl._create_unverified_context())['verify'] is False
+
+    # a context with its own trusted certificates is used to verify the connection
+    context = ssl.create_default_context()
+    sent = send(context)
+    assert isinstance(sent['adapter'], _SSLContextAdapter) and sent['adapter'].ssl_context is context